@@ -0,0 +1,84 @@
+import pytest
+import csv
+import json
+from wealthspread.correlation import batch
+from wealthspread.correlation.portfolio import suggest_from_market_data
+
+
+PORTFOLIOS = [
+    {"id": "a", "holdings": {"T1": 1000, "T2": 500}, "investment_amount": 700},
+    {"id": "b", "holdings": {"T5": 2500}, "investment_amount": 1000},
+    {"id": "c", "holdings": {"T4": 100, "XYZ": 100}, "investment_amount": 50},
+    {"id": "d", "holdings": {"t9": 300, "T10": 300, "T11": 1200}, "investment_amount": 300},
+]
+
+
+def test_batch_jsonl_matches_single_scoring(market, tmp_path):
+    tickers, corr, returns, esg = market
+    esg = esg[:, 0]
+    with open(tmp_path / "portfolios.jsonl", "w") as file:
+        file.writelines(json.dumps(portfolio) + "\n" for portfolio in PORTFOLIOS)
+
+    assert batch.run_batch(tmp_path / "portfolios.jsonl", tmp_path / "results.jsonl", workers=2, chunksize=1) == 4
+    with open(tmp_path / "results.jsonl") as file:
+        rows = [json.loads(line) for line in file]
+
+    assert [row["id"] for row in rows] == ["a", "b", "c", "d"]
+    assert "XYZ" in rows[2]["error"] and all("error" not in rows[i] for i in (0, 1, 3))
+    assert all(row["seconds"] >= 0 for row in rows)
+    for row, portfolio in zip(rows, PORTFOLIOS):
+        if "error" in row:
+            continue
+        holdings = {ticker.upper(): amount for ticker, amount in portfolio["holdings"].items()}
+        expected = suggest_from_market_data(corr, returns, esg, holdings, portfolio["investment_amount"], tickers)
+        suggestion = "|".join(expected[0]) if isinstance(expected[0], tuple) else expected[0]
+        assert [row["suggestion"], row["sharpe"], row["mean_corr"]] == [suggestion, expected[1], expected[2]]
+        assert row["new_esg"] == pytest.approx(expected[4])
+
+
+def test_batch_csv_round_trip(market, tmp_path):
+    with open(tmp_path / "portfolios.csv", "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["id", "ticker", "amount", "investment_amount"])
+        for portfolio in PORTFOLIOS:
+            for ticker, amount in portfolio["holdings"].items():
+                writer.writerow([portfolio["id"], ticker, amount, portfolio["investment_amount"]])
+
+    batch.run_batch(tmp_path / "portfolios.csv", tmp_path / "results.csv", workers=1)
+    with open(tmp_path / "results.csv", newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert [row["id"] for row in rows] == ["a", "b", "c", "d"]
+    assert rows[1]["suggestion"].count("|") == 1
+    assert rows[2]["error"] and not rows[3]["error"]
+
+    with pytest.raises(ValueError):
+        batch.run_batch(tmp_path / "portfolios.csv", tmp_path / "results.txt", workers=1)
+
+
+def test_malformed_portfolios_get_error_rows(market, tmp_path):
+    lines = [json.dumps(PORTFOLIOS[0]), "{not json", json.dumps({"id": "x", "investment_amount": 10}),
+             json.dumps({"id": "y", "holdings": {"T1": "lots"}, "investment_amount": 10}), "[1, 2]",
+             json.dumps(PORTFOLIOS[1])]
+    (tmp_path / "portfolios.jsonl").write_text("\n".join(lines) + "\n")
+    assert batch.run_batch(tmp_path / "portfolios.jsonl", tmp_path / "results.jsonl", workers=1) == 6
+    with open(tmp_path / "results.jsonl") as file:
+        rows = [json.loads(line) for line in file]
+    assert [row["id"] for row in rows] == ["a", 2, "x", "y", 5, "b"]
+    assert "error" not in rows[0] and "error" not in rows[5]
+    assert all(row["error"].startswith(f"Could not parse line {i + 1}") for i, row in enumerate(rows[1:5], 1))
+    assert "holdings" in rows[2]["error"]
+
+    (tmp_path / "portfolios.csv").write_text(
+        "id,ticker,amount,investment_amount\n"
+        "a,T1,1000,700\n"
+        "b,T5,oops,1000\n"
+        "b,T6,100,1000\n"
+        "c,T9,300,300\n"
+        "d,T10\n")
+    batch.run_batch(tmp_path / "portfolios.csv", tmp_path / "results.csv", workers=1)
+    with open(tmp_path / "results.csv", newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert [row["id"] for row in rows] == ["a", "b", "c", "d"]
+    assert not rows[0]["error"] and not rows[2]["error"]
+    assert rows[1]["error"].startswith("Could not parse line 3")
+    assert rows[3]["error"].startswith("Could not parse line 6")
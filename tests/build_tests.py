@@ -0,0 +1,94 @@
+import pytest
+import os
+from functools import partial
+from wealthspread.correlation.build import STAGES, build, stage_dependencies, select_stages
+from wealthspread.esg.esg_analysis import ESG_SCORES_PATH
+
+
+def transform(inputs, output, log, function=str.upper):
+    "Toy stage: writes function(concatenated inputs) and logs that it ran"
+    with open(log, "a") as file:
+        file.write(output.stem + "\n")
+    if "fail" in "".join(path.read_text() for path in inputs):
+        raise ValueError("bad input")
+    output.write_text(function("".join(path.read_text() for path in inputs)))
+
+
+def toy_graph(tmp_path):
+    "src -> a -> b -> d <- c <- src2"
+    log = tmp_path / "log.txt"
+    files = {name: tmp_path / f"{name}.txt" for name in ("src", "src2", "a", "b", "c", "d")}
+    files["src"].write_text("abc")
+    files["src2"].write_text("xyz")
+
+    def stage(inputs, output, function=str.upper):
+        inputs = [files[name] for name in inputs]
+        return {"inputs": inputs, "outputs": [files[output]],
+                "run": partial(transform, inputs, files[output], log, function)}
+
+    stages = {"a": stage(["src"], "a"), "b": stage(["a"], "b", str.lower), "c": stage(["src2"], "c"),
+              "d": stage(["b", "c"], "d")}
+    return stages, files, log
+
+
+def runs(log):
+    ran = log.read_text().split() if log.exists() else []
+    log.unlink(missing_ok=True)
+    return sorted(ran)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_rebuilds_only_stale_stages(tmp_path, workers):
+    stages, files, log = toy_graph(tmp_path)
+    manifest = tmp_path / "manifest.json"
+    rebuild = partial(build, stages=stages, manifest_path=manifest, workers=workers)
+
+    assert sorted(rebuild()["built"]) == ["a", "b", "c", "d"] and runs(log) == ["a", "b", "c", "d"]
+    assert files["d"].read_text() == "ABCXYZ"
+    assert rebuild()["skipped"] and runs(log) == []
+
+    # A new modification time with the same content is not a change
+    os.utime(files["src"], ns=(1, 1))
+    assert rebuild()["built"] == [] and runs(log) == []
+
+    files["src2"].write_text("uvw")
+    assert rebuild()["built"] == ["c", "d"] and files["d"].read_text() == "ABCUVW"
+    runs(log)
+
+    # a is rebuilt, but with the same content, so b and d are not
+    files["src"].write_text("ABC")
+    assert rebuild()["built"] == ["a"] and runs(log) == ["a"]
+
+    files["d"].unlink()
+    assert rebuild()["built"] == ["d"]
+    # An output edited by hand is rebuilt, which restores d's input
+    files["c"].write_text("edited")
+    assert rebuild()["built"] == ["c"] and files["c"].read_text() == "UVW"
+    runs(log)
+    assert rebuild(targets=["b"], force=True)["built"] == ["a", "b"]
+
+
+def test_failure_blocks_dependents_only(tmp_path):
+    stages, files, log = toy_graph(tmp_path)
+    manifest = tmp_path / "manifest.json"
+    files["src2"].write_text("fail")
+    report = build(stages=stages, manifest_path=manifest, workers=1)
+    assert sorted(report["built"]) == ["a", "b"] and list(report["failed"]) == ["c"]
+    assert report["blocked"] == ["d"]
+
+    files["src2"].write_text("ok")
+    runs(log)
+    assert build(stages=stages, manifest_path=manifest, workers=1, dry_run=True)["built"] == ["c", "d"]
+    assert runs(log) == []
+    assert build(stages=stages, manifest_path=manifest, workers=1)["built"] == ["c", "d"]
+
+
+def test_pipeline_graph():
+    dependencies = stage_dependencies(STAGES)
+    assert dependencies["returns"] == set() and dependencies["scaled_returns"] == {"geometric_mean"}
+    assert dependencies["market_store"] == {"correlation", "scaled_returns", "stock_prices"}
+    # The scraped ESG scores feed both stores, so refreshing them rebuilds market_data.npz too
+    assert ESG_SCORES_PATH in STAGES["market_store"]["inputs"] and ESG_SCORES_PATH in STAGES["esg_store"]["inputs"]
+    assert select_stages(STAGES, ["correlation"]) == {"correlation", "returns"}
+    with pytest.raises(ValueError):
+        select_stages(STAGES, ["nope"])
@@ -0,0 +1,40 @@
+import pytest
+import numpy as np
+from wealthspread import service
+from wealthspread.correlation import batch
+
+
+def build_random_market(n_stocks=40, seed=0):
+    """
+    Builds a random market: tickers, correlation matrix, return vector and
+    ESG scores (N, 4), with no ESG data for T3.
+    """
+    rng = np.random.default_rng(seed)
+    daily = rng.normal(size=(250, n_stocks)) + rng.normal(size=(250, 1))
+    corr = np.corrcoef(daily, rowvar=False)
+    returns = rng.uniform(-0.1, 0.45, size=n_stocks)
+    esg = rng.uniform(5, 35, size=(n_stocks, 4))
+    esg[3] = np.nan
+    tickers = [f"T{i}" for i in range(n_stocks)]
+    return tickers, corr, returns, esg
+
+
+@pytest.fixture
+def random_market():
+    "Builds random markets of any size, see build_random_market"
+    return build_random_market
+
+
+@pytest.fixture
+def market(request, monkeypatch):
+    """
+    Replaces the market data of batch scoring and the service with a small
+    random market, 30 stocks unless parametrized indirectly with
+    (n_stocks, seed).
+    """
+    n_stocks, seed = getattr(request, "param", (30, 7))
+    tickers, corr, returns, esg = build_random_market(n_stocks, seed)
+    monkeypatch.setattr(batch, "all_stocks", lambda: tuple(tickers))
+    monkeypatch.setattr(batch, "load_market_data", lambda lookback=None, backend="dense": (corr, returns, esg[:, 0]))
+    monkeypatch.setattr(service, "load_market_store", lambda: {"tickers": np.array(tickers), "esg": esg})
+    return tickers, corr, returns, esg
@@ -0,0 +1,234 @@
+import pytest
+import json
+import numpy as np
+import pandas as pd
+from wealthspread.correlation.market_store import build_market_store, load_market_store
+from wealthspread.correlation.comoments import (comoments_from_returns, update_comoments,
+                                                comoments_correlation, empty_comoments,
+                                                update_correlation_matrix, save_comoments,
+                                                pairwise_correlation)
+from wealthspread.correlation.price_store import open_price_store, write_series
+from wealthspread.correlation.rolling import (rolling_correlation, lookback_correlations,
+                                              build_snapshots, load_snapshot, LOOKBACKS)
+from wealthspread.correlation.factor_model import factor_model_from_returns, factor_corr, factor_model_error
+from wealthspread.correlation.returns import (build_returns_store, load_returns_store, build_returns,
+                                              geometric_means, volatilities)
+
+
+def random_returns(n_days=300, n_stocks=20, seed=0):
+    "Builds daily percent returns with a late listing and scattered gaps"
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(size=(n_days, n_stocks)) * 2 + rng.normal(size=(n_days, 1))
+    returns[:n_days // 3, 2] = np.nan
+    returns[rng.random((n_days, n_stocks)) < 0.05] = np.nan
+    return returns
+
+
+def write_artifacts(tmp_path):
+    "Writes a small set of correlation, return, ESG and price artifacts"
+    tickers = ["AAA", "BBB", "CCC"]
+    corr = pd.DataFrame([[1.0, 0.2, -0.1], [0.2, 1.0, 0.5], [-0.1, 0.5, 1.0]],
+                        index=tickers, columns=tickers)
+    corr.to_csv(tmp_path / "correlation_matrix.csv")
+    with open(tmp_path / "scaled_geometric_mean.json", "w") as file:
+        json.dump({"AAA": 0.1, "BBB": 0.45, "CCC": -0.02}, file)
+    with open(tmp_path / "ESG_Scores.json", "w") as file:
+        json.dump({"AAA": {"totalEsg": 20.0, "environmentScore": 5.0, "socialScore": 7.0, "governanceScore": 8.0},
+                   "BBB": "No ESG data available for BBB.",
+                   "CCC": {"totalEsg": 12.5, "environmentScore": 2.5, "socialScore": 5.0, "governanceScore": 5.0}}, file)
+    with open(tmp_path / "stock_prices.json", "w") as file:
+        json.dump({"AAA": {"2025-01-03": "11.5", "2025-01-02": "10"},
+                   "BBB": {"2025-01-03": "20.25"},
+                   "CCC": {"2025-01-03": "3", "2025-01-02": "2.75"}}, file)
+    return tickers
+
+
+def test_market_store_round_trip(tmp_path):
+    tickers = write_artifacts(tmp_path)
+    build_market_store(
+        tmp_path / "market_data.npz",
+        correlation_path=tmp_path / "correlation_matrix.csv",
+        returns_path=tmp_path / "scaled_geometric_mean.json",
+        esg_path=tmp_path / "ESG_Scores.json",
+        prices_path=tmp_path / "stock_prices.json",
+        tickers=tickers)
+    store = load_market_store(tmp_path / "market_data.npz")
+
+    assert list(store["tickers"]) == tickers
+    assert store["corr"][1, 2] == 0.5
+    assert list(store["returns"]) == [0.1, 0.45, -0.02]
+    assert list(store["esg"][0]) == [20.0, 5.0, 7.0, 8.0]
+    assert np.isnan(store["esg"][1]).all()
+    assert list(store["dates"].astype(str)) == ["2025-01-02", "2025-01-03"]
+    assert store["prices"][1, 0] == 11.5
+    assert np.isnan(store["prices"][0, 1])
+
+
+def test_incremental_comoments_match_pandas():
+    returns = random_returns()
+    tickers = [f"T{i}" for i in range(returns.shape[1])]
+    expected = pd.DataFrame(returns).corr().to_numpy()
+
+    state = comoments_from_returns(returns[:200], tickers)
+    for day_returns in returns[200:]:
+        update_comoments(state, day_returns)
+    assert comoments_correlation(state) == pytest.approx(expected, abs=1e-12, nan_ok=True)
+
+    state = empty_comoments(tickers)
+    for day_returns in returns:
+        update_comoments(state, day_returns)
+    assert comoments_correlation(state) == pytest.approx(expected, abs=1e-12, nan_ok=True)
+
+
+def test_weighted_comoments_match_pandas_ewm():
+    returns = random_returns()[:, 4:8]
+    returns = returns[~np.isnan(returns).any(axis=1)]
+    state = comoments_from_returns(returns, list("abcd"), halflife=20)
+    expected = pd.DataFrame(returns).ewm(halflife=20, adjust=False).corr().iloc[-4:].to_numpy()
+    assert comoments_correlation(state, weighted=True) == pytest.approx(expected, abs=1e-12)
+
+    unweighted = comoments_from_returns(returns, list("abcd"))
+    with pytest.raises(ValueError, match="halflife"):
+        comoments_correlation(unweighted, weighted=True)
+
+
+@pytest.mark.parametrize("min_overlap", [2, 250])
+def test_pairwise_correlation_matches_pandas(min_overlap):
+    returns = random_returns(n_stocks=30)
+    returns[:, 5] = 0.5
+    df = pd.DataFrame(returns)
+    expected = df.corr(min_periods=min_overlap).to_numpy()
+    expected_counts = df.notna().astype(int).T @ df.notna().astype(int)
+
+    corr, counts = pairwise_correlation(returns, min_overlap, block_size=7)
+    assert corr == pytest.approx(expected, abs=1e-12, nan_ok=True)
+    assert (counts == expected_counts.to_numpy()).all()
+
+    corr32, _ = pairwise_correlation(returns, min_overlap, dtype=np.float32)
+    assert corr32.dtype == np.float32
+    assert corr32 == pytest.approx(expected, abs=1e-5, nan_ok=True)
+
+
+def random_prices(n_days=120, n_stocks=6, seed=0):
+    "Builds a (T, N) price matrix with a late listing and scattered missing days"
+    rng = np.random.default_rng(seed)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, size=(n_days, n_stocks)), axis=0))
+    prices[:30, 1] = np.nan
+    prices[rng.random((n_days, n_stocks)) < 0.05] = np.nan
+    return prices
+
+
+def test_returns_match_pandas():
+    prices = random_prices()
+    dates = np.datetime64("2024-01-01") + np.arange(len(prices))
+    returns = build_returns(dates, prices, list("abcdef"))
+
+    # The original loop took each change from the stock's previous available price
+    df = pd.DataFrame(prices)
+    expected = df.ffill().pct_change(fill_method=None).where(df.notna())
+    assert returns["simple"] == pytest.approx(expected.to_numpy(), rel=1e-12, nan_ok=True)
+    assert returns["log"] == pytest.approx(np.log1p(expected.to_numpy()), rel=1e-12, nan_ok=True)
+    assert (returns["present"] == df.notna().to_numpy()).all()
+
+    first = df.apply(lambda column: column.dropna().iloc[0])
+    last = df.apply(lambda column: column.dropna().iloc[-1])
+    assert geometric_means(returns) == pytest.approx(((last / first) ** (1 / 5) - 1).to_numpy(), rel=1e-10)
+    expected_vol = np.log1p(expected).std().to_numpy() * np.sqrt(252)
+    assert volatilities(returns) == pytest.approx(expected_vol, rel=1e-10)
+
+
+def test_returns_store_feeds_correlation(tmp_path):
+    prices = random_prices(n_stocks=4, seed=1)
+    dates = np.datetime64("2024-01-01") + np.arange(len(prices))
+    conn = open_price_store(tmp_path / "prices.sqlite")
+    for j, ticker in enumerate(["AAA", "BBB", "CCC", "DDD"]):
+        present = ~np.isnan(prices[:, j])
+        write_series(conn, ticker, {"datetime": dates[present], "open": prices[present, j],
+                                    "high": prices[present, j], "low": prices[present, j],
+                                    "close": prices[present, j], "volume": np.zeros(present.sum(), np.int64)})
+    conn.close()
+
+    build_returns_store(tmp_path / "returns.npz", tmp_path / "prices.sqlite")
+    returns = load_returns_store(tmp_path / "returns.npz")
+    assert list(returns["tickers"]) == ["AAA", "BBB", "CCC", "DDD"]
+    assert returns["prices"] == pytest.approx(prices, nan_ok=True)
+
+    expected = pd.DataFrame(returns["simple"]).corr().to_numpy()
+    corr = update_correlation_matrix(tmp_path / "returns.npz", tmp_path / "comoments.npz",
+                                     tmp_path / "correlation_matrix.csv")
+    assert corr.to_numpy() == pytest.approx(expected, abs=1e-12)
+
+    # Folding the newer days into a persisted state gives the same matrix
+    save_comoments(comoments_from_returns(returns["simple"][:80], list(returns["tickers"]), returns["dates"][:80]),
+                   tmp_path / "comoments.npz")
+    corr = update_correlation_matrix(tmp_path / "returns.npz", tmp_path / "comoments.npz",
+                                     tmp_path / "correlation_matrix.csv")
+    assert corr.to_numpy() == pytest.approx(expected, abs=1e-12)
+
+
+def test_rolling_windows_match_pandas():
+    returns = random_returns(n_stocks=8)
+    ends = [40, 45, 100, 101, 230, 300]
+    for end, corr, counts in rolling_correlation(returns, 60, ends, min_overlap=30):
+        window = pd.DataFrame(returns[max(0, end - 60):end])
+        assert corr == pytest.approx(window.corr(min_periods=30).to_numpy(), abs=1e-10, nan_ok=True)
+        assert (counts.diagonal() == window.notna().sum().to_numpy()).all()
+
+    lookbacks = {"short": 20, "mid": 90, "all": 1000}
+    for label, (corr, _) in lookback_correlations(returns, lookbacks).items():
+        expected = pd.DataFrame(returns[-lookbacks[label]:]).corr().to_numpy()
+        assert corr == pytest.approx(expected, abs=1e-10, nan_ok=True)
+
+
+def test_snapshots_are_versioned(tmp_path):
+    returns = random_returns(n_stocks=5)
+    dates = np.datetime64("2024-01-01") + np.arange(len(returns))
+    store = {"tickers": np.array(list("abcde")), "dates": dates, "simple": returns}
+    np.savez(tmp_path / "returns.npz", **store)
+    build_snapshots(tmp_path / "returns.npz", tmp_path, {"3m": 63, "1y": 252}, min_overlap=2)
+    np.savez(tmp_path / "returns.npz", **{**store, "simple": returns[:-10], "dates": dates[:-10]})
+    build_snapshots(tmp_path / "returns.npz", tmp_path, {"3m": 63}, min_overlap=2)
+
+    latest = load_snapshot("3m", tmp_path)
+    assert str(latest["version"]) == str(dates[-11])
+    assert latest["corr"] == pytest.approx(pd.DataFrame(returns[-73:-10]).corr().to_numpy(), abs=1e-10)
+    older = load_snapshot("3m", tmp_path, version=str(dates[-1]))
+    assert older["corr"] == pytest.approx(pd.DataFrame(returns[-63:]).corr().to_numpy(), abs=1e-10)
+    assert str(load_snapshot("1y", tmp_path)["version"]) == str(dates[-1])
+    with pytest.raises(KeyError):
+        load_snapshot("5y", tmp_path)
+
+
+def test_snapshots_span_calendar_lookbacks(tmp_path):
+    returns = random_returns(n_days=1500, n_stocks=4)
+    # Trading days only, with a holiday-like gap every few weeks
+    dates = np.busday_offset("2019-01-02", np.arange(len(returns)) + np.arange(len(returns)) // 17, roll="forward")
+    np.savez(tmp_path / "returns.npz", tickers=np.array(list("abcd")), dates=dates, simple=returns)
+    manifest = build_snapshots(tmp_path / "returns.npz", tmp_path, LOOKBACKS, min_overlap=2)
+
+    for label, days in LOOKBACKS.items():
+        snapshot = load_snapshot(label, tmp_path)
+        first = np.datetime64(str(snapshot["first_date"]))
+        assert str(snapshot["first_date"]) == manifest[label]["first_date"]
+        # The window holds exactly the dates less than `days` before the last one
+        assert dates[-1] - first < np.timedelta64(days, "D")
+        assert dates[dates < first][-1] <= dates[-1] - np.timedelta64(days, "D")
+        expected = pd.DataFrame(returns[dates >= first]).corr().to_numpy()
+        assert snapshot["corr"] == pytest.approx(expected, abs=1e-10)
+
+
+def test_factor_model_approximation():
+    returns = random_returns(n_stocks=12)
+    complete = returns[~np.isnan(returns).any(axis=1)]
+    corr = np.corrcoef(complete, rowvar=False)
+
+    exact = factor_model_from_returns(complete, k=12)
+    assert factor_corr(exact) == pytest.approx(corr, abs=1e-10)
+    assert factor_model_error(exact, corr)["max_abs"] == pytest.approx(0, abs=1e-10)
+
+    model = factor_model_from_returns(returns, k=3)
+    assert model["loadings"].shape == (12, 3)
+    assert np.diag(factor_corr(model)) == pytest.approx(np.ones(12))
+    error = factor_model_error(model, pd.DataFrame(returns).corr().to_numpy(), block_size=5)
+    assert 0 < error["relative_frobenius"] < 0.5
+    assert error["mean_abs"] <= error["max_abs"]
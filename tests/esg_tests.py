@@ -1,6 +1,10 @@
 import pytest
 import json
+import threading
 from pathlib import Path
+from wealthspread.esg.esg_scores import collect_esg_scores, load_esg_cache
+from wealthspread.esg.esg_analysis import (build_esg_store, esg_analysis, esg_lookup, iter_esg_analyses,
+                                           write_esg_analysis)
 
 path = Path(__file__).parent /"../wealthspread/esg/"
 
@@ -45,4 +49,83 @@ def test_total_esg_sum():
 
                 if None not in {total_esg, env_score, social_score, gov_score}:
                     assert total_esg == pytest.approx(env_score + social_score + gov_score, abs=0.05), \
-                        f"ESG sum mismatch for {ticker}: {env_score} + {social_score} + {gov_score} != {total_esg}"
\ No newline at end of file
+                        f"ESG sum mismatch for {ticker}: {env_score} + {social_score} + {gov_score} != {total_esg}"
+
+
+def stub_provider(failures):
+    "Stands in for yfinance: B fails failures['B'] times, C always fails, D has no data"
+    calls, lock = [], threading.Lock()
+
+    def provider(ticker, session):
+        with lock:
+            calls.append(ticker)
+            if ticker == "C" or failures.get(ticker, 0) > 0:
+                failures[ticker] = failures.get(ticker, 0) - 1
+                raise ConnectionError(f"{ticker} timed out")
+        if ticker == "D":
+            return None
+        return {"totalEsg": 30.0, "environmentScore": 10.0, "socialScore": 12.0, "governanceScore": 8.0,
+                "peerGroup": f"{ticker} peers"}
+    return provider, calls
+
+
+def test_collect_caches_and_retries_failures_only(tmp_path):
+    output, cache = tmp_path / "ESG_Scores.json", tmp_path / "cache.jsonl"
+    output.write_text(json.dumps({"C": {"totalEsg": 20.0}}))
+    options = dict(cache_path=cache, output_file=output, workers=4, backoff=0.001)
+    provider, calls = stub_provider({"B": 2})
+    esg_dict, failed = collect_esg_scores(["A", "B", "C", "D"], provider, **options)
+
+    assert esg_dict["A"] == esg_dict["B"] == {"totalEsg": 30.0, "environmentScore": 10.0, "socialScore": 12.0,
+                                              "governanceScore": 8.0}
+    assert esg_dict["D"] == "No ESG data available for D."
+    # C keeps the scores of the last successful run
+    assert list(failed) == ["C"] and esg_dict["C"] == {"totalEsg": 20.0}
+    assert json.loads(output.read_text()) == esg_dict
+    assert sorted(calls) == ["A", "B", "B", "B", "C", "C", "C", "D"]
+    assert load_esg_cache(cache)["A"]["raw"]["peerGroup"] == "A peers" and "error" in load_esg_cache(cache)["C"]
+
+    provider, calls = stub_provider({})
+    assert collect_esg_scores(["A", "B", "C", "D"], provider, **options)[0] == esg_dict
+    assert calls == ["C", "C", "C"]
+
+    provider, calls = stub_provider({})
+    collect_esg_scores(["A", "B", "C", "D"], provider, max_age=0, **options)
+    assert sorted(set(calls)) == ["A", "B", "C", "D"]
+    # The cache is compacted to one entry per ticker before each run appends to it
+    assert len(cache.read_text().splitlines()) == 4 + 4
+
+
+def test_esg_analysis_from_store(tmp_path):
+    scores = {"A": {"totalEsg": 12.5, "environmentScore": 2.5, "socialScore": 5.0, "governanceScore": 5.0},
+              "B": {"totalEsg": 20.5, "environmentScore": None, "socialScore": None, "governanceScore": None},
+              "C": "No ESG data available for C."}
+    (tmp_path / "scores.json").write_text(json.dumps(scores))
+    (tmp_path / "tickers.json").write_text(json.dumps({t: {"company_name": f"{t} Corp"} for t in "ABC"}))
+    store = tmp_path / "esg_store.npz"
+    build_esg_store(store, scores_path=tmp_path / "scores.json", tickers_path=tmp_path / "tickers.json")
+
+    assert esg_lookup("A", store) == scores["A"] and esg_lookup("C", store) is None
+    text = esg_analysis("A", store)
+    assert "For A Corp, the total ESG risk score is 12.5, which is considered low." in text
+    assert "'Social' risk score is None" in esg_analysis("B", store)
+    assert esg_analysis("C", store) == "There is no ESG data available for C Corp."
+    assert esg_analysis("A", store) is text
+    with pytest.raises(KeyError):
+        esg_analysis("D", store)
+
+    # The streamed export is the JSON of every analysis, in the store's order
+    assert write_esg_analysis(tmp_path / "analysis.json", store) == 3
+    exported = (tmp_path / "analysis.json").read_text()
+    assert exported == json.dumps(dict(iter_esg_analyses(path=store)), indent=2)
+
+
+def test_cli_shows_missing_components_as_none(monkeypatch, capsys):
+    import wealthspread_cli
+    answers = iter(["smci", ""])
+    monkeypatch.setattr(wealthspread_cli, "clear_screen", lambda: None)
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(answers))
+    wealthspread_cli.get_esg_info()
+    output = capsys.readouterr().out
+    assert "- Total ESG Score: 20.5" in output and "- Environmental Score: None" in output
+    assert "Score: nan" not in output and "Error" not in output
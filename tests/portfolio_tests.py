@@ -0,0 +1,224 @@
+import pytest
+import time
+import warnings
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from wealthspread.correlation.scoring import (score_candidates, top_candidates, top_pair_additions, score_pairs,
+                                              esg_candidates, current_esg, portfolio_esg)
+from wealthspread.correlation.simulation import weighted_mean_correlation
+from wealthspread.correlation.factor_model import factor_model_from_returns, factor_corr
+from wealthspread.correlation.optimizer import (max_sharpe_weights, project_capped_simplex,
+                                                portfolio_sharpe, covariance_matrix)
+from wealthspread.correlation.portfolio import portfolio_geometric_mean
+
+
+def legacy_scores(tickers, corr, returns, current_inv, investment_amount):
+    "Reproduces the original per-ticker pandas loop of suggest_stocks_sharpe"
+    corr_matrix = pd.DataFrame(corr, index=tickers, columns=tickers)
+    geo_means_dict = dict(zip(tickers, returns))
+    current_tickers = list(current_inv.keys())
+    current_amounts = np.array(list(current_inv.values()))
+    sharpes, corrs = [], []
+    for new_stock in [t for t in tickers if t not in current_inv]:
+        new_tickers = current_tickers + [new_stock]
+        new_amounts = np.append(current_amounts, investment_amount)
+        new_weights = {ticker: float(amt / new_amounts.sum()) for ticker, amt in zip(new_tickers, new_amounts)}
+        sub_corr_matrix = corr_matrix.loc[new_tickers, new_tickers]
+        total_mean_corr = weighted_mean_correlation(sub_corr_matrix, new_weights)
+        total_mean_return = portfolio_geometric_mean(geo_means_dict, new_weights)
+        sharpes.append(total_mean_return / total_mean_corr)
+        corrs.append(total_mean_corr)
+    return np.array(sharpes), np.array(corrs)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_vectorized_matches_loop(seed, random_market):
+    tickers, corr, returns, _ = random_market(seed=seed)
+    current_inv = {"T3": 1000.0, "T7": 250.0, "T21": 4000.0}
+    held_idx = [tickers.index(t) for t in current_inv]
+
+    candidates, sharpe, mean_corr, _ = score_candidates(
+        corr, returns, held_idx, list(current_inv.values()), 700.0)
+    expected_sharpe, expected_corr = legacy_scores(tickers, corr, returns, current_inv, 700.0)
+
+    assert [tickers[i] for i in candidates] == [t for t in tickers if t not in current_inv]
+    assert sharpe == pytest.approx(expected_sharpe, rel=1e-12)
+    assert mean_corr == pytest.approx(expected_corr, rel=1e-12)
+    assert top_candidates(sharpe, 1)[0] == int(np.argmax(np.abs(expected_sharpe)))
+
+
+def test_top_candidates_ties_nan_and_empty():
+    assert list(top_candidates(np.array([1.0, np.nan, -3.0, 3.0]), 1)) == [2]
+    assert list(top_candidates(np.array([0.0, np.nan]), 1)) == []
+    assert list(top_candidates(np.array([1.0, 2.0]), 0)) == []
+    assert top_pair_additions(np.eye(3), np.ones(3), [0], [1.0], 1.0, k=0) == []
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_pair_search_matches_brute_force(seed, random_market):
+    tickers, corr, returns, _ = random_market(n_stocks=25, seed=seed)
+    corr_matrix = pd.DataFrame(corr, index=tickers, columns=tickers)
+    geo_means_dict = dict(zip(tickers, returns))
+
+    best_sharpe, best_pair = 0, None
+    for pair in combinations([t for t in tickers if t != "T4"], 2):
+        new_weights = {"T4": 1500 / 2500, pair[0]: 500 / 2500, pair[1]: 500 / 2500}
+        sub_corr_matrix = corr_matrix.loc[list(new_weights), list(new_weights)]
+        sharpe = (portfolio_geometric_mean(geo_means_dict, new_weights)
+                  / weighted_mean_correlation(sub_corr_matrix, new_weights))
+        if abs(sharpe) > abs(best_sharpe):
+            best_sharpe, best_pair = sharpe, pair
+
+    [(first, second, sharpe, _)] = top_pair_additions(corr, returns, [4], [1500.0], 1000.0, block_size=3)
+    assert (tickers[first], tickers[second]) == best_pair
+    assert sharpe == pytest.approx(best_sharpe, rel=1e-12)
+
+
+@pytest.mark.parametrize("max_esg, exclude_missing_esg", [(None, True), (15.0, False), (15.0, True)])
+def test_esg_constraints_match_brute_force(max_esg, exclude_missing_esg, random_market):
+    tickers, corr, returns, _ = random_market(n_stocks=30, seed=4)
+    esg = np.random.default_rng(4).uniform(5, 35, size=30)
+    esg[::7] = np.nan
+
+    def allowed(new_esg, missing):
+        return ((max_esg is None or (not missing and new_esg <= max_esg))
+                and not (exclude_missing_esg and missing))
+
+    # One new stock: the masked candidates are the ones a per-ticker loop keeps.
+    # The unrated holding (0) is left out of the portfolio's ESG.
+    amounts, held_esg = [500.0, 1000.0, 3000.0], 1000.0 * esg[3] + 3000.0 * esg[5]
+    expected = [i for i in range(30) if i not in (0, 3, 5)
+                and allowed((held_esg + 800.0 * esg[i]) / 4800.0, np.isnan(esg[i]))]
+    candidates, new_esg = esg_candidates(esg, [0, 3, 5], amounts, 800.0, max_esg=max_esg,
+                                         exclude_missing_esg=exclude_missing_esg)
+    assert list(candidates) == expected and 0 < len(expected) < 27
+    assert new_esg == pytest.approx((held_esg + 800.0 * esg[candidates]) / 4800.0, nan_ok=True)
+
+    # A pair: the best and full table only hold pairs a brute force allows
+    pairs = [(a, b) for a, b in combinations([i for i in range(30) if i != 3], 2)
+             if allowed((2000.0 * esg[3] + 500.0 * (esg[a] + esg[b])) / 3000.0,
+                        np.isnan(esg[a]) or np.isnan(esg[b]))]
+    first, second, sharpe, _ = score_pairs(corr, returns, [3], [2000.0], 1000.0, esg, max_esg,
+                                           exclude_missing_esg)
+    assert list(zip(first, second)) == pairs and 0 < len(pairs) < 406
+    [best] = top_pair_additions(corr, returns, [3], [2000.0], 1000.0, block_size=4, esg=esg,
+                                max_esg=max_esg, exclude_missing_esg=exclude_missing_esg)
+    assert best[:2] == pairs[int(np.argmax(np.abs(sharpe)))]
+
+
+def test_missing_esg_never_meets_max_esg():
+    esg = np.array([10.0, np.nan, 30.0, 20.0, 25.0])
+    assert current_esg(esg, [0, 1], [1000.0, 1000.0]) == 10.0
+    assert np.isnan(current_esg(esg, [1], [1000.0]))
+
+    # Without data, a candidate's new ESG is unknown rather than lowered
+    candidates, new_esg = esg_candidates(esg, [0], [1000.0], 1000.0)
+    assert list(candidates) == [1, 2, 3, 4] and np.isnan(new_esg[0])
+    assert new_esg[1:] == pytest.approx([20.0, 15.0, 17.5])
+    # However loose the limit, it cannot be met by the unrated stock alone
+    candidates, _ = esg_candidates(esg, [0], [1000.0], 1000.0, max_esg=100.0)
+    assert list(candidates) == [2, 3, 4]
+    first, second, _, _ = score_pairs(np.eye(5), np.full(5, 0.1), [0], [1000.0], 1000.0, esg, max_esg=100.0)
+    assert 1 not in first and 1 not in second and len(first) == 3
+    pairs = np.array([[1, 2], [2, 3]])
+    assert portfolio_esg(esg, [0], [1000.0], 1000.0, pairs) == pytest.approx([np.nan, 17.5], nan_ok=True)
+
+
+def test_top_candidates_order():
+    sharpe = np.array([0.5, -2.0, np.nan, 2.0, 0.0, 1.0])
+    assert list(top_candidates(sharpe, 3)) == [1, 3, 5]
+    assert list(top_candidates(sharpe, 10)) == [1, 3, 5, 0]
+
+
+def test_top_pairs_match_full_table(random_market):
+    tickers, corr, returns, _ = random_market(n_stocks=60, seed=3)
+    first, second, sharpe, _ = score_pairs(corr, returns, [10], [800.0], 1200.0)
+    order = np.lexsort((np.arange(len(sharpe)), -np.abs(sharpe)))[:15]
+
+    top = top_pair_additions(corr, returns, [10], [800.0], 1200.0, k=15, block_size=4)
+    assert [(a, b) for a, b, _, _ in top] == [(first[i], second[i]) for i in order]
+    assert [s for _, _, s, _ in top] == pytest.approx(sharpe[order], rel=1e-12)
+
+
+def test_factor_backend_matches_its_dense_matrix():
+    rng = np.random.default_rng(4)
+    daily = rng.normal(size=(250, 50)) + rng.normal(size=(250, 1))
+    model = factor_model_from_returns(daily, k=5)
+    returns = rng.uniform(-0.1, 0.45, size=50)
+    held_idx, amounts = [2, 30, 41], [100.0, 900.0, 400.0]
+
+    dense = score_candidates(factor_corr(model), returns, held_idx, amounts, 600.0)
+    factor = score_candidates(model, returns, held_idx, amounts, 600.0)
+    for expected, actual in zip(dense, factor):
+        assert actual == pytest.approx(expected, rel=1e-10)
+
+
+def random_covariance(n_stocks=30, seed=5):
+    "Builds a random covariance matrix from simulated daily returns"
+    rng = np.random.default_rng(seed)
+    daily = (rng.normal(size=(500, n_stocks)) + rng.normal(size=(500, 1))) * rng.uniform(0.005, 0.03, n_stocks)
+    daily[:100, 3] = np.nan
+    return covariance_matrix(daily), rng
+
+
+def test_max_sharpe_matches_tangency_portfolio():
+    cov, rng = random_covariance()
+    # Expected returns for which the unconstrained tangency weights are all positive
+    tangency = rng.uniform(0.5, 1.5, size=len(cov))
+    mu = cov @ tangency
+    weights, sharpe = max_sharpe_weights(mu, cov)
+    assert weights[0] == pytest.approx(tangency / tangency.sum(), abs=1e-6)
+    assert sharpe[0] == pytest.approx(portfolio_sharpe(tangency, mu, cov)[0], rel=1e-8)
+
+
+def test_max_sharpe_caps_and_batches():
+    cov, rng = random_covariance(seed=6)
+    mu = rng.uniform(-0.1, 0.45, size=len(cov))
+    mu[7] = np.nan
+    caps = np.array([[1.0], [0.2], [0.08]])
+    weights, sharpe = max_sharpe_weights(mu, cov, caps)
+
+    assert weights.sum(axis=1) == pytest.approx(1)
+    assert (weights <= caps + 1e-12).all() and (weights >= 0).all()
+    assert (weights[:, 7] == 0).all()
+    # Tighter caps can only lower the best Sharpe ratio
+    assert sharpe[0] >= sharpe[1] >= sharpe[2]
+    for row, cap in enumerate(caps[:, 0]):
+        single, single_sharpe = max_sharpe_weights(mu, cov, cap)
+        assert single[0] == pytest.approx(weights[row], abs=1e-6)
+        # No feasible random portfolio does better
+        trials = project_capped_simplex(rng.random((200, len(cov))) * ~np.isnan(mu), np.where(np.isnan(mu), 0, cap))
+        assert (portfolio_sharpe(trials, np.nan_to_num(mu), cov) <= single_sharpe[0] + 1e-9).all()
+
+    with pytest.raises(ValueError):
+        max_sharpe_weights(mu, cov, 0.01)
+
+
+@pytest.mark.parametrize("cap", [1.0, 0.1])
+def test_max_sharpe_500_assets_converges_quickly(cap):
+    cov, rng = random_covariance(n_stocks=500, seed=7)
+    mu = rng.uniform(-0.1, 0.45, size=500)
+    start = time.perf_counter()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        weights, sharpe = max_sharpe_weights(mu, cov, cap)
+    assert time.perf_counter() - start < 1.0
+
+    # KKT conditions of the Sharpe ratio: names between the bounds share the
+    # same gradient, names at 0 have a lower one and names at the cap a higher one
+    w = weights[0]
+    gradient = mu - (w @ mu) / (w @ cov @ w) * (cov @ w)
+    free = (w > 1e-12) & (w < cap - 1e-12)
+    level = gradient[free].mean()
+    assert np.ptp(gradient[free]) < 1e-9
+    assert (gradient[w <= 1e-12] <= level + 1e-9).all() and (gradient[w >= cap - 1e-12] >= level - 1e-9).all()
+
+    with pytest.warns(RuntimeWarning):
+        max_sharpe_weights(mu, cov, cap, max_iter=1)
+
+
+def test_capped_simplex_projection():
+    v = np.array([[0.9, 0.5, -0.2, 0.1], [1.0, 1.0, 1.0, 1.0]])
+    projected = project_capped_simplex(v, 0.4)
+    assert projected == pytest.approx(np.array([[0.4, 0.4, 0.0, 0.2], [0.25, 0.25, 0.25, 0.25]]))
@@ -0,0 +1,79 @@
+import pytest
+import time
+from wealthspread.correlation import portfolio, result_cache
+from wealthspread.correlation.portfolio import suggest_from_market_data
+from wealthspread.correlation.result_cache import (portfolio_key, open_cache, close_cache, cache_get, cache_put,
+                                                   cache_stats, cached_suggest_stocks_sharpe)
+
+
+@pytest.fixture
+def counted_suggest(market, monkeypatch):
+    "Scores suggestions against the random market, counting the computations"
+    tickers, corr, returns, esg = market
+    calls = []
+
+    def suggest(current_inv, investment_amount, lookback=None, backend="dense", max_esg=None,
+                exclude_missing_esg=False):
+        calls.append(current_inv)
+        return suggest_from_market_data(corr, returns, esg[:, 0], current_inv, investment_amount, tickers, max_esg,
+                                        exclude_missing_esg)
+
+    monkeypatch.setattr(portfolio, "suggest_stocks_sharpe", suggest)
+    return suggest, calls
+
+
+def test_key_depends_on_weights_only():
+    key = portfolio_key({"T1": 1000, "T2": 500}, 500, "v1")
+    assert portfolio_key({"T2": 5000, "T1": 10000}, 5000, "v1") == key
+    assert portfolio_key({"T1": 1000, "T2": 500.01}, 500, "v1") == key
+    assert portfolio_key({"T1": 1000, "T2": 500}, 600, "v1") != key
+    assert portfolio_key({"T1": 1000, "T2": 500}, 500, "v2") != key
+    assert portfolio_key({"T1": 1000, "T2": 500}, 500, "v1", lookback="1y") != key
+    assert portfolio_key({"T1": 1000, "T2": 500}, 500, "v1", max_esg=20) != key
+    assert portfolio_key({"T1": 1000, "T2": 500}, 500, "v1", exclude_missing_esg=True) != key
+    with pytest.raises(ValueError):
+        portfolio_key({"T1": 0}, 0, "v1")
+
+
+@pytest.mark.parametrize("market", [(20, 9)], indirect=True)
+def test_cached_suggestions_match_and_skip_work(counted_suggest):
+    suggest, calls = counted_suggest
+    cache = open_cache()
+    for holdings, amount in [({"T1": 1000, "T2": 500}, 700), ({"T5": 300}, 100)]:
+        expected = suggest(holdings, amount)
+        first = cached_suggest_stocks_sharpe(cache, holdings, amount, version="v1")
+        scaled = cached_suggest_stocks_sharpe(cache, {t: a * 3 for t, a in holdings.items()}, amount * 3,
+                                              version="v1")
+        assert first == scaled == [expected[0], *expected[1:3], float(expected[3]), float(expected[4])]
+    assert len(calls) == 4
+    assert cache_stats(cache) == {"hits": 2, "disk_hits": 0, "misses": 2, "evictions": 0, "size": 2,
+                                  "hit_rate": 0.5}
+
+    cached_suggest_stocks_sharpe(cache, {"T1": 1000, "T2": 500}, 700, version="v2")
+    assert len(calls) == 5
+
+
+@pytest.mark.parametrize("market", [(20, 9)], indirect=True)
+def test_lru_ttl_and_disk_tier(tmp_path, counted_suggest, monkeypatch):
+    cache = open_cache(maxsize=2, ttl=60)
+    for key in "abc":
+        cache_put(cache, key, [key])
+    assert cache_get(cache, "a") is None and cache_get(cache, "c") == ["c"]
+    assert cache_stats(cache)["evictions"] == 1
+
+    now = time.time()
+    with monkeypatch.context() as patch:
+        patch.setattr(result_cache.time, "time", lambda: now + 61)
+        assert cache_get(cache, "c") is None
+
+    # A new cache on the same file answers from disk, as after a restart
+    _, calls = counted_suggest
+    path = tmp_path / "results.sqlite"
+    cache = open_cache(path=path)
+    first = cached_suggest_stocks_sharpe(cache, {"T5": 300}, 100, version="v1")
+    close_cache(cache)
+    cache = open_cache(path=path)
+    assert cached_suggest_stocks_sharpe(cache, {"T5": 300}, 100, version="v1") == first
+    assert isinstance(first[0], tuple) and len(calls) == 1
+    assert cache_stats(cache)["disk_hits"] == 1
+    close_cache(cache)
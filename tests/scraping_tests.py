@@ -1,6 +1,12 @@
 import pytest
+import asyncio
 import json
+import time
 from pathlib import Path
+from wealthspread.scrape.companyinfo_scrape import (scrape_company_info, load_checkpoint, new_rate_limiter,
+                                                    wait_for_slot, parse_company_page, retreive_company_info)
+from wealthspread.scrape.page_cache import open_page_cache, page_entry, reparse_pages
+from wealthspread.scrape.company_store import build_company_store, company_record
 
 path = Path(__file__).parent /"../wealthspread/scrape/"
 
@@ -43,3 +49,159 @@ def test_company_info():
     
     for ticker, info in data.items():
         assert len(info) > 0, f"Company information for {ticker} is missing."
+
+
+COMPANY_PAGE = ('<html><body><div class="px-0.5 lg:px-0">About {ticker}</div>'
+                '<p class="mb-3">{ticker} grew revenue</p></body></html>')
+
+
+async def stand_in_server(failures, versions=None, port=0):
+    """
+    Local stand-in for StockAnalysis: serves /stocks/<ticker>/company/ pages,
+    answers 503 while failures[ticker] > 0 and 404 for ticker MISSING.
+    Pages carry an ETag of their version (versions[ticker], default 1) and
+    answer 304 when it is sent back in If-None-Match.
+    Returns (server, requested tickers, most requests in flight at once).
+    """
+    requested, in_flight = [], {"now": 0, "max": 0, "not_modified": 0}
+    versions = versions or {}
+
+    async def handle(reader, writer):
+        while (request_line := await reader.readline()):
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            ticker = request_line.split()[1].decode().split("/")[2]
+            etag = f'"{ticker}-{versions.get(ticker, 1)}"'
+            requested.append(ticker)
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+            await asyncio.sleep(0.01)
+            in_flight["now"] -= 1
+            if ticker == "MISSING":
+                status, body = "404 Not Found", b"gone"
+            elif failures.get(ticker, 0) > 0:
+                failures[ticker] -= 1
+                status, body = "503 Service Unavailable", b"busy"
+            elif headers.get("if-none-match") == etag:
+                in_flight["not_modified"] += 1
+                status, body = "304 Not Modified", b""
+            else:
+                status, body = "200 OK", COMPANY_PAGE.format(ticker=ticker.split("-")[0]).encode()
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/html\r\nETag: {etag}\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port)
+    return server, requested, in_flight
+
+
+async def scrape_from_stand_in(tmp_path, tickers, failures, versions=None, port=0, **options):
+    server, requested, in_flight = await stand_in_server(failures, versions, port)
+    port = in_flight["port"] = server.sockets[0].getsockname()[1]
+    webpages = {ticker: f"http://127.0.0.1:{port}/stocks/{ticker}/company/" for ticker in tickers}
+    options.setdefault("page_cache_dir", tmp_path / "pages")
+    try:
+        result = await scrape_company_info(webpages, tmp_path / "checkpoint.jsonl", backoff=0.01, **options)
+    finally:
+        server.close()
+        await server.wait_closed()
+    return result, requested, in_flight
+
+
+def test_concurrent_scrape_retries_and_checkpoints(tmp_path):
+    tickers = [f"T{i}" for i in range(30)] + ["MISSING"]
+    (company_data, skipped), requested, in_flight = asyncio.run(scrape_from_stand_in(
+        tmp_path, tickers, {"T3": 2}, concurrency=4, requests_per_second=1000))
+
+    assert sorted(company_data) == sorted(tickers[:-1]) and list(skipped) == ["MISSING"]
+    assert company_data["T3"] == {"about_company": "About T3", "fin_performance": "T3 grew revenue"}
+    assert requested.count("T3") == 3 and requested.count("MISSING") == 1
+    assert in_flight["max"] <= 4
+    assert load_checkpoint(tmp_path / "checkpoint.jsonl") == company_data
+
+
+def test_scrape_resumes_from_checkpoint(tmp_path):
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    checkpoint.write_text(json.dumps({"ticker": "T0", "info": {"about_company": "cached",
+                                                               "fin_performance": "cached"}})
+                          + '\n{"ticker": "T1", "in')
+    (company_data, skipped), requested, _ = asyncio.run(scrape_from_stand_in(
+        tmp_path, ["T0", "T1", "T2"], {}, requests_per_second=1000))
+    assert sorted(requested) == ["T1", "T2"] and not skipped
+    assert company_data["T0"]["about_company"] == "cached" and len(company_data) == 3
+    assert load_checkpoint(checkpoint) == company_data
+
+
+def test_rate_limiter_spaces_requests():
+    async def book(limiter, n):
+        start = time.monotonic()
+        await asyncio.gather(*(wait_for_slot(limiter) for _ in range(n)))
+        return time.monotonic() - start
+
+    assert asyncio.run(book(new_rate_limiter(50), 6)) >= 0.09
+
+
+def test_refresh_revalidates_cached_pages_and_reparses_offline(tmp_path):
+    # T1-copy serves the same page as T1, so its body is stored once
+    tickers = ["T0", "T1", "T1-copy", "T2"]
+    (first, _), _, server = asyncio.run(scrape_from_stand_in(tmp_path, tickers, {}, requests_per_second=1000))
+    assert len(list((tmp_path / "pages" / "objects").glob("*/*.html.gz"))) == 3
+
+    (tmp_path / "checkpoint.jsonl").unlink()
+    (refreshed, _), requested, in_flight = asyncio.run(scrape_from_stand_in(
+        tmp_path, tickers, {}, versions={"T2": 2}, port=server["port"], requests_per_second=1000))
+    assert refreshed == first and sorted(requested) == sorted(tickers)
+    assert in_flight["not_modified"] == 3
+
+    conn = open_page_cache(tmp_path / "pages")
+    urls = [entry[0] for entry in conn.execute("SELECT url FROM pages")]
+    entry = page_entry(conn, next(url for url in urls if "/T2/" in url))
+    conn.close()
+    assert entry["etag"] == '"T2-2"' and entry["checked_at"] >= entry["fetched_at"]
+
+    reparsed = reparse_pages(parse_company_page, urls, tmp_path / "pages", workers=2)
+    assert sorted(reparsed.values(), key=str) == sorted(first.values(), key=str)
+
+
+def test_company_store_lookups(tmp_path):
+    company_data = {
+        "AAA": {"about_company": "Makes things. ... [Read more] Industry Consumer Electronics Sector Technology "
+                                 "IPO Date Dec 12, 1980", "fin_performance": "Revenue grew."},
+        "BBB": {"about_company": "No profile table.", "fin_performance": ""},
+    }
+    info_path, store_path = tmp_path / "company_info.json", tmp_path / "company_info.sqlite"
+    info_path.write_text(json.dumps(company_data))
+
+    # Before the store is built, lookups read the JSON file
+    assert company_record("AAA", store_path, info_path)["sector"] == "Technology"
+    assert build_company_store(info_path, store_path) == 2
+    info_path.unlink()
+    record = company_record("AAA", store_path, info_path)
+    assert record["summary"] == "Makes things. ... "
+    assert (record["industry"], record["sector"]) == ("Consumer Electronics", "Technology")
+    assert record["fin_performance"] == "Revenue grew."
+    assert company_record("BBB", store_path, info_path)["industry"] is None
+    assert company_record("ZZZ", store_path, info_path) is None
+    assert retreive_company_info("AAA", info_path, store_path) == (company_data["AAA"]["about_company"],
+                                                                   "Revenue grew.")
+
+
+def test_cli_skips_suggestions_without_company_info(monkeypatch, capsys):
+    import wealthspread_cli
+    from wealthspread.correlation import result_cache
+    from wealthspread.scrape import company_store
+    answers = iter(["1", "AAPL", "1000", "500", "y", ""])
+    monkeypatch.setattr(wealthspread_cli, "clear_screen", lambda: None)
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(answers))
+    monkeypatch.setattr(result_cache, "open_cache", lambda path: None)
+    monkeypatch.setattr(result_cache, "close_cache", lambda cache: None)
+    monkeypatch.setattr(result_cache, "cached_suggest_stocks_sharpe",
+                        lambda cache, portfolio, amount: ("ZZZ", 1.5, 0.4, 20.0, 18.0))
+    monkeypatch.setattr(company_store, "company_record", lambda ticker: None)
+    wealthspread_cli.analyze_portfolio()
+    output = capsys.readouterr().out
+    assert "No company information available for ZZZ." in output
+    assert "Error analyzing portfolio" not in output
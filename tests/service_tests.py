@@ -0,0 +1,81 @@
+import pytest
+import asyncio
+from wealthspread import service
+from wealthspread.service_load_test import http_request, run_load_test
+
+
+async def exercise_service(tickers, esg, monkeypatch):
+    server, state = await service.start_service(port=0, workers=1)
+    port = server.sockets[0].getsockname()[1]
+    assert server.sockets[0].getsockname()[0] == "127.0.0.1"
+    reader, writer = await asyncio.open_connection(service.HOST, port)
+    try:
+        status, row = await http_request(reader, writer, "POST", "/suggest",
+                                         {"holdings": {"T1": 1000, "t2": 500}, "investment_amount": 700})
+        assert status == 200 and row["suggestion"] in tickers and "error" not in row
+        # The same weights in other amounts are answered from the result cache
+        status, repeat = await http_request(reader, writer, "POST", "/suggest",
+                                            {"id": 7, "holdings": {"T1": 2000, "T2": 1000}, "investment_amount": 1400})
+        assert status == 200 and repeat["id"] == 7 and repeat["suggestion"] == row["suggestion"]
+        assert (await http_request(reader, writer, "GET", "/health"))[1]["cache"]["hits"] == 1
+        status, row = await http_request(reader, writer, "POST", "/suggest",
+                                         {"holdings": {"NOPE": 1000}, "investment_amount": 700})
+        assert status == 400 and "NOPE" in row["error"]
+        status, _ = await http_request(reader, writer, "POST", "/suggest", {"holdings": {}})
+        assert status == 400
+        for holdings in ([1, 2], {}, {"T1": -5}, {"T1": 0}, {"T1": "nan"}, {"T1": None}, {"T1": [1]}):
+            status, row = await http_request(reader, writer, "POST", "/suggest",
+                                             {"holdings": holdings, "investment_amount": 5})
+            assert status == 400 and ("holdings" in row["error"] or "T1" in row["error"])
+        for amount in (-5, 0, "nan", "inf", None, [700]):
+            status, row = await http_request(reader, writer, "POST", "/suggest",
+                                             {"holdings": {"T1": 1000}, "investment_amount": amount})
+            assert status == 400 and "investment_amount" in row["error"]
+        # The connection is still served after the bad requests
+        assert (await http_request(reader, writer, "GET", "/health"))[0] == 200
+
+        # Unexpected failures are answered with a 500 rather than a dropped connection
+        def broken_cache(cache, key):
+            raise OSError("disk full")
+        with monkeypatch.context() as patch:
+            patch.setattr(service, "cache_get", broken_cache)
+            status, row = await http_request(reader, writer, "POST", "/suggest",
+                                             {"holdings": {"T1": 1000}, "investment_amount": 700})
+        assert status == 500 and "disk full" in row["error"]
+
+        # A failed SIGHUP reload keeps serving the data already loaded
+        data = state["data"]
+        with monkeypatch.context() as patch:
+            patch.setattr(service, "load_service_data", lambda *args: 1 / 0)
+            assert await service.reload_on_signal(state) is None
+        assert state["data"] is data and state["generation"] == 1
+        assert (await http_request(reader, writer, "GET", "/health"))[1]["generation"] == 1
+
+        status, scores = await http_request(reader, writer, "GET", "/esg/t0")
+        assert status == 200 and scores["totalEsg"] == pytest.approx(esg[0, 0])
+        status, scores = await http_request(reader, writer, "GET", "/esg/T3")
+        assert status == 200 and scores["totalEsg"] is None
+        assert (await http_request(reader, writer, "GET", "/esg/XYZ"))[0] == 404
+        assert (await http_request(reader, writer, "GET", "/nowhere"))[0] == 404
+
+        # Requests keep being served while the data is swapped underneath them
+        load = asyncio.ensure_future(run_load_test(port, clients=4, requests=80, tickers=tickers))
+        status, reloaded = await http_request(reader, writer, "POST", "/reload")
+        report = await load
+        assert status == 200 and reloaded["generation"] == 2
+        assert report["requests"] == 80 and report["errors"] == 0
+        assert report["p50_ms"] <= report["p99_ms"]
+        assert (await http_request(reader, writer, "GET", "/health"))[1]["generation"] == 2
+    finally:
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        service.close_service_data(state["data"])
+
+
+@pytest.mark.parametrize("market", [(20, 8)], indirect=True)
+def test_service_endpoints_and_reload(market, monkeypatch, capsys):
+    tickers, _, _, esg = market
+    asyncio.run(exercise_service(tickers, esg, monkeypatch))
+    errors = capsys.readouterr().err
+    assert "OSError('disk full')" in errors and "Reload failed, still serving generation 1" in errors
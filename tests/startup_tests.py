@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+
+MODULES = [
+    "wealthspread_cli",
+    "wealthspread.correlation.portfolio",
+    "wealthspread.correlation.simulation",
+    "wealthspread.esg.esg_scores",
+    "wealthspread.esg.esg_analysis",
+    "wealthspread.scrape.companyinfo_scrape",
+    "wealthspread.scrape.stockanalysis_scrape",
+]
+
+
+def run_python(code, cwd):
+    env = {**os.environ, "PYTHONPATH": str(project_root)}
+    return subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env,
+                          capture_output=True, text=True, timeout=60)
+
+
+def test_imports_have_no_side_effects(tmp_path):
+    # Importing from another directory must not read or write data files, scrape or load pandas
+    code = "import sys\n" + "".join(f"import {module}\n" for module in MODULES) + \
+        "print('pandas' in sys.modules, 'yfinance' in sys.modules)"
+    result = run_python(code, tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ["False", "False"]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_tickers_load_lazily(tmp_path):
+    code = ("import wealthspread_cli\n"
+            "from wealthspread.correlation.tickers import all_stocks\n"
+            "assert all_stocks.cache_info().currsize == 0\n"
+            "assert wealthspread_cli.ticker_validator('aapl')\n"
+            "print(len(all_stocks()))")
+    result = run_python(code, tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert int(result.stdout) >= 500
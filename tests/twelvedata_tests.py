@@ -0,0 +1,190 @@
+import pytest
+import csv
+import json
+import threading
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from wealthspread.correlation import twelvedata_api, price_store
+
+RECORDED_DIR = Path(__file__).parent / "../wealthspread/correlation/_cache2"
+
+
+def recorded_csv(ticker):
+    "Returns the recorded _cache2 response for a ticker"
+    for path in RECORDED_DIR.iterdir():
+        if f"symbol={ticker.lower()}_start" in path.name:
+            return path.read_text()
+    return None
+
+
+class TwelveDataStandIn(BaseHTTPRequestHandler):
+    "Serves recorded _cache2 responses in Twelve Data's multi-symbol JSON format"
+
+    requests_seen = []
+    ranges_seen = []
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        symbols = query["symbol"][0].split(",")
+        start_date = query["start_date"][0][:10]
+        end_date = query["end_date"][0][:10]
+        self.requests_seen.append(symbols)
+        self.ranges_seen.append(start_date)
+
+        payload = {}
+        for symbol in symbols:
+            content = recorded_csv(symbol)
+            if content is None:
+                payload[symbol] = {"code": 400, "status": "error", "message": "symbol not found"}
+            else:
+                values = [row for row in csv.DictReader(content.splitlines(), delimiter=";")
+                          if start_date <= row["datetime"] <= end_date]
+                payload[symbol] = {"meta": {"symbol": symbol}, "values": values, "status": "ok"}
+        if len(symbols) == 1:
+            payload = payload[symbols[0]]
+
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in_server():
+    TwelveDataStandIn.requests_seen = []
+    TwelveDataStandIn.ranges_seen = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TwelveDataStandIn)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/time_series"
+    server.shutdown()
+
+
+def test_batched_fetch_and_cache(stand_in_server, tmp_path):
+    tickers = ["AAPL", "MSFT", "NVDA", "ABNB", "ZZZZ"]
+    twelvedata_api.fetch_and_cache(
+        tickers, api_url=stand_in_server, store_path=tmp_path / "prices.sqlite",
+        credits_per_minute=600, batch_size=2, output_file=tmp_path / "stock_prices.json")
+
+    assert TwelveDataStandIn.requests_seen == [["AAPL", "MSFT"], ["NVDA", "ABNB"], ["ZZZZ"]]
+    with open(tmp_path / "stock_prices.json") as file:
+        prices = json.load(file)
+    assert sorted(prices) == ["AAPL", "ABNB", "MSFT", "NVDA"]
+    expected = list(csv.DictReader(recorded_csv("AAPL").splitlines(), delimiter=";"))
+    assert list(prices["AAPL"]) == [row["datetime"] for row in expected]
+    assert [float(close) for close in prices["AAPL"].values()] == [float(row["close"]) for row in expected]
+
+    # A second run is served entirely from the store
+    twelvedata_api.fetch_and_cache(
+        tickers[:4], api_url=stand_in_server, store_path=tmp_path / "prices.sqlite",
+        credits_per_minute=600, batch_size=2, output_file=tmp_path / "stock_prices.json")
+    assert len(TwelveDataStandIn.requests_seen) == 3
+
+
+def test_token_bucket_waits_for_quota():
+    waits = []
+    bucket = twelvedata_api.new_token_bucket(60)
+    twelvedata_api.wait_for_tokens(bucket, 60, sleep=waits.append)
+    assert waits == []
+
+    bucket["tokens"] = 0.0
+    twelvedata_api.wait_for_tokens(bucket, 1, sleep=lambda seconds: (waits.append(seconds), bucket.update(tokens=1.0)))
+    assert waits[0] == pytest.approx(1.0, abs=0.05)
+
+    with pytest.raises(ValueError):
+        twelvedata_api.wait_for_tokens(bucket, 61)
+
+
+def test_refresh_fetches_only_missing_tail(stand_in_server, tmp_path):
+    store_path = tmp_path / "prices.sqlite"
+    full = price_store.csv_to_series(recorded_csv("AAPL"))
+    # Store AAPL without its last 10 trading days, MSFT not at all
+    conn = price_store.open_price_store(store_path)
+    price_store.write_series(conn, "AAPL", {column: values[:-10] for column, values in full.items()})
+    conn.close()
+
+    twelvedata_api.refresh_prices(
+        ["AAPL", "MSFT"], end_date="2025-02-01", api_url=stand_in_server, store_path=store_path,
+        credits_per_minute=600, output_file=tmp_path / "stock_prices.json")
+
+    tail_start = full["datetime"][-11] + 1
+    assert sorted(TwelveDataStandIn.ranges_seen) == ["2020-02-01", str(tail_start)]
+    conn = price_store.open_price_store(store_path)
+    stored = price_store.read_series(conn, "AAPL")
+    for column, values in full.items():
+        assert np.array_equal(stored[column], values)
+    coverage = price_store.coverage(conn)
+    conn.close()
+    assert coverage["AAPL"]["last_date"] == str(full["datetime"][-1])
+    assert coverage["AAPL"]["rows"] == len(full["datetime"])
+    assert coverage["MSFT"]["checked_through"] == "2025-02-01"
+
+    # Nothing is missing any more, so a second refresh makes no requests
+    twelvedata_api.refresh_prices(
+        ["AAPL", "MSFT"], end_date=coverage["AAPL"]["last_date"], api_url=stand_in_server,
+        store_path=store_path, credits_per_minute=600, output_file=tmp_path / "stock_prices.json")
+    assert len(TwelveDataStandIn.requests_seen) == 2
+
+
+def test_import_cache_dir(tmp_path):
+    cache_dir = tmp_path / "_cache2"
+    cache_dir.mkdir()
+    for ticker in ["AAPL", "BRK.B"]:
+        url = (f"https://api.twelvedata.com/time_series?apikey=abc&interval=1day&symbol={ticker}"
+               "&start_date=2020-02-01 02:01:00&end_date=2025-02-01 02:01:00&format=CSV")
+        (cache_dir / twelvedata_api.url_to_cache_key(url)).write_text(recorded_csv(ticker))
+
+    assert price_store.import_cache_dir(cache_dir, tmp_path / "prices.sqlite") == 2
+    conn = price_store.open_price_store(tmp_path / "prices.sqlite")
+    stored = price_store.read_series(conn, "BRK.B")
+    conn.close()
+    expected = price_store.rows_to_series(list(csv.DictReader(recorded_csv("BRK.B").splitlines(), delimiter=";")))
+    for column, values in expected.items():
+        assert np.array_equal(stored[column], values)
+    # Only trading days are imported, each bar once
+    assert np.is_busday(stored["datetime"]).all()
+    assert len(stored["datetime"]) < len(recorded_csv("BRK.B").splitlines()) - 1
+
+
+def test_repeated_bars_are_dropped():
+    csv_data = ("datetime;open;high;low;close;volume\n"
+                "2024-06-18;10;11;9;10.5;300\n"
+                "2024-06-17;10;11;9;10.5;300\n"  # same bar as the next day
+                "2024-06-16;9;10;8;9.5;200\n"    # Sunday copy of Monday
+                "2024-06-14;9.5;10;8;9;150\n"
+                "2024-06-13;9.5;10;8;9.2;100\n")
+    series = price_store.csv_to_series(csv_data)
+    assert list(series["datetime"].astype(str)) == ["2024-06-13", "2024-06-14", "2024-06-18"]
+    assert list(series["close"]) == [9.2, 9.0, 10.5]
+    rows = list(csv.DictReader(csv_data.splitlines(), delimiter=";"))
+    assert np.array_equal(price_store.rows_to_series(rows)["datetime"], series["datetime"])
+
+    # A store written before bars were dropped is cleaned when it is merged
+    dates = np.array(["2024-06-13", "2024-06-14", "2024-06-16", "2024-06-17"], dtype="datetime64[D]")
+    stored = {"datetime": dates, "open": np.array([9.5, 9.5, 9.0, 10.0]), "high": np.array([10.0, 10.0, 10.0, 11.0]),
+              "low": np.array([8.0, 8.0, 8.0, 9.0]), "close": np.array([9.2, 9.0, 9.5, 10.5]),
+              "volume": np.array([100, 150, 200, 300])}
+    merged = price_store.merge_series(stored, {column: values[-1:] for column, values in series.items()})
+    for column, values in series.items():
+        assert np.array_equal(merged[column], values)
+
+
+def test_csv_parser_matches_csv_module():
+    for path in sorted(RECORDED_DIR.iterdir())[:25]:
+        rows = list(csv.DictReader(path.read_text().splitlines(), delimiter=";"))
+        expected = price_store.rows_to_series(rows)
+        parsed = price_store.csv_to_series(path.read_bytes())
+        for column, dtype in price_store.COLUMN_DTYPES.items():
+            assert parsed[column].dtype == np.dtype(dtype)
+            assert np.array_equal(parsed[column], expected[column])
+
+    empty = price_store.csv_to_series("datetime;open;high;low;close;volume\n")
+    assert all(len(values) == 0 for values in empty.values())
+    assert float(twelvedata_api.parse_csv_to_dict(recorded_csv("AAPL"))["2025-01-31"]) == 236.0
@@ -0,0 +1,178 @@
+import csv
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from functools import partial
+from multiprocessing import Pool
+from pathlib import Path
+from wealthspread.correlation.tickers import all_stocks
+from wealthspread.correlation.portfolio import load_market_data, suggest_from_market_data
+
+RESULT_FIELDS = ["id", "suggestion", "sharpe", "mean_corr", "current_esg", "new_esg", "seconds", "error"]
+
+# Market data of the worker processes, memory-mapped from the files the parent wrote
+_worker_data = None
+
+
+def parse_error(line_number, error):
+    "The error of a portfolio whose line could not be parsed"
+
+    return f"Could not parse line {line_number}: {type(error).__name__}: {error}"
+
+
+def read_portfolios(path):
+    """
+    Yields (id, {ticker: amount}, investment_amount) for every portfolio in
+    a .jsonl or .csv file, one at a time.
+        JSONL: one {"id", "holdings": {ticker: amount}, "investment_amount"}
+            object per line
+        CSV: one holding per row, with columns id, ticker, amount and
+            investment_amount; the rows of a portfolio are consecutive
+    A portfolio that cannot be parsed is yielded as (id, None, error
+    message) instead, so it gets an error row and the batch carries on.
+    """
+    path = Path(path)
+    with open(path, newline="") as file:
+        if path.suffix == ".jsonl":
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                portfolio_id = line_number
+                try:
+                    row = json.loads(line)
+                    portfolio_id = row.get("id", line_number)
+                    portfolio = (portfolio_id,
+                                 {ticker.upper(): float(amount) for ticker, amount in row["holdings"].items()},
+                                 float(row["investment_amount"]))
+                except (ValueError, KeyError, TypeError, AttributeError) as error:
+                    portfolio = (portfolio_id, None, parse_error(line_number, error))
+                yield portfolio
+        elif path.suffix == ".csv":
+            reader = csv.DictReader(file)
+            current_id, holdings, investment_amount, error = None, {}, None, None
+            for row in reader:
+                if row.get("id") != current_id and (holdings or error):
+                    yield (current_id, None, error) if error else (current_id, holdings, investment_amount)
+                    holdings, error = {}, None
+                current_id = row.get("id")
+                if error:
+                    # The rest of a malformed portfolio is skipped
+                    continue
+                try:
+                    investment_amount = float(row["investment_amount"])
+                    ticker = row["ticker"].upper()
+                    holdings[ticker] = holdings.get(ticker, 0.0) + float(row["amount"])
+                except (ValueError, KeyError, TypeError, AttributeError) as row_error:
+                    error = parse_error(reader.line_num, row_error)
+            if holdings or error:
+                yield (current_id, None, error) if error else (current_id, holdings, investment_amount)
+        else:
+            raise ValueError(f"Unsupported portfolio file {path.name}, use .jsonl or .csv")
+
+
+def save_shared_data(directory, lookback=None, backend="dense"):
+    """
+    Loads the market data once and writes each array as a .npy file in
+    `directory`, which the workers memory-map so every process reads the
+    same physical copy of the correlation matrix.
+    """
+    corr, returns, total_esg = load_market_data(lookback, backend)
+    arrays = {"returns": returns, "total_esg": total_esg, "tickers": np.array(all_stocks())}
+    if isinstance(corr, dict):
+        arrays.update({f"corr_{name}": values for name, values in corr.items()})
+    else:
+        arrays["corr"] = corr
+    for name, values in arrays.items():
+        np.save(Path(directory) / f"{name}.npy", values)
+
+
+def load_shared_data(directory):
+    "Memory-maps the market data written by save_shared_data"
+
+    arrays = {path.stem: np.load(path, mmap_mode="r") for path in Path(directory).glob("*.npy")}
+    corr = arrays["corr"] if "corr" in arrays else {
+        name[len("corr_"):]: values for name, values in arrays.items() if name.startswith("corr_")}
+    return corr, arrays["returns"], arrays["total_esg"], [str(ticker) for ticker in arrays["tickers"]]
+
+
+def init_worker(directory):
+    "Pool initializer: maps the shared market data once per worker"
+
+    global _worker_data
+    _worker_data = load_shared_data(directory)
+
+
+def score_portfolio(portfolio, max_esg=None, exclude_missing_esg=False):
+    "Scores one (id, holdings, investment_amount) portfolio into a result row, within the ESG constraints"
+
+    portfolio_id, holdings, investment_amount = portfolio
+    corr, returns, total_esg, tickers = _worker_data
+    start = time.perf_counter()
+    row = {"id": portfolio_id}
+    try:
+        if holdings is None:
+            # A portfolio read_portfolios could not parse, with its error
+            raise ValueError(investment_amount)
+        unknown = [ticker for ticker in holdings if ticker not in tickers]
+        if unknown:
+            raise ValueError(f"Unknown tickers: {', '.join(unknown)}")
+        suggestion, sharpe, mean_corr, current_esg, new_esg = suggest_from_market_data(
+            corr, returns, total_esg, holdings, investment_amount, tickers, max_esg, exclude_missing_esg)
+        if isinstance(suggestion, tuple):
+            suggestion = "|".join(suggestion)
+        # Unknown values (no correlation, no ESG data) are written as null
+        row.update(suggestion=suggestion, sharpe=sharpe, mean_corr=None if np.isnan(mean_corr) else mean_corr,
+                   current_esg=None if np.isnan(current_esg) else float(current_esg),
+                   new_esg=None if np.isnan(new_esg) else float(new_esg))
+    except Exception as error:
+        row["error"] = str(error)
+    row["seconds"] = round(time.perf_counter() - start, 6)
+    return row
+
+
+def write_results(rows, path):
+    "Streams result rows to a .jsonl or .csv file as they arrive, returns the row count"
+
+    path = Path(path)
+    if path.suffix not in (".jsonl", ".csv"):
+        raise ValueError(f"Unsupported output file {path.name}, use .jsonl or .csv")
+    n_rows = 0
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, RESULT_FIELDS) if path.suffix == ".csv" else None
+        if writer:
+            writer.writeheader()
+        for row in rows:
+            if writer:
+                writer.writerow(row)
+            else:
+                file.write(json.dumps(row) + "\n")
+            n_rows += 1
+    return n_rows
+
+
+def run_batch(input_path, output_path, workers=None, lookback=None, backend="dense", chunksize=64,
+              max_esg=None, exclude_missing_esg=False):
+    """
+    Scores every portfolio of input_path against one copy of the market
+    data, spread across a pool of `workers` processes (default: one per
+    CPU), and streams the results to output_path in input order.
+    max_esg and exclude_missing_esg constrain every suggestion, as in
+    suggest_stocks_sharpe.
+    """
+    score = partial(score_portfolio, max_esg=max_esg, exclude_missing_esg=exclude_missing_esg)
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="wealthspread_batch_") as directory:
+        save_shared_data(directory, lookback, backend)
+        portfolios = read_portfolios(input_path)
+        if workers == 1:
+            init_worker(directory)
+            n_rows = write_results(map(score, portfolios), output_path)
+        else:
+            with Pool(workers, initializer=init_worker, initargs=(directory,)) as pool:
+                n_rows = write_results(pool.imap(score, portfolios, chunksize), output_path)
+    elapsed = time.perf_counter() - start
+    print(f"Scored {n_rows} portfolios in {elapsed:.1f}s with {workers} worker(s), results in {output_path}")
+    return n_rows
@@ -0,0 +1,282 @@
+"""
+Incremental build of the derived market data:
+
+    prices.sqlite ─┬─ returns.npz ─┬─ geometric_mean.json ── scaled_geometric_mean.json ─┐
+                   │               ├─ correlation_matrix.csv ─────────────────────────────┤
+                   │               ├─ snapshots/manifest.json                             ├─ market_data.npz
+                   │               └─ factor_model.npz                                    │
+                   └─ stock_prices.json ──────────────────────────────────────────────────┤
+    esg/ESG_Scores.json ─┬─ esg/esg_store.npz                                             │
+                         └────────────────────────────────────────────────────────────────┘
+    scrape/company_info.json ── scrape/company_info.sqlite
+
+A stage is rebuilt only when the content hash of one of its inputs differs
+from the one recorded in the build manifest, or an output is missing or
+was changed by hand.
+Stages that do not depend on each other run in parallel.
+
+    uv run python -m wealthspread.correlation.build [stage ...] [--workers 4] [--force] [--dry-run]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+from pathlib import Path
+from wealthspread.correlation.tickers import STOCKS_DETAILS_PATH
+from wealthspread.correlation.price_store import PRICE_STORE_PATH, open_price_store, export_stock_prices
+from wealthspread.correlation.returns import RETURNS_STORE_PATH, build_returns_store
+from wealthspread.correlation.market_store import (STORE_PATH, CORRELATION_PATH, RETURNS_PATH, ESG_PATH,
+                                                   PRICES_PATH, build_market_store)
+from wealthspread.correlation.rolling import SNAPSHOT_DIR, MANIFEST_NAME, build_snapshots
+from wealthspread.correlation.factor_model import FACTOR_MODEL_PATH, build_factor_model
+from wealthspread.correlation.simulation import correlation_matrix
+from wealthspread.correlation.portfolio import all_geometric_mean, scale_returns
+from wealthspread.esg.esg_analysis import (ESG_SCORES_PATH as ESG_SOURCE_PATH, TICKERS_PATH as ESG_TICKERS_PATH,
+                                           ESG_STORE_PATH, build_esg_store)
+from wealthspread.scrape.company_store import COMPANY_INFO_PATH, COMPANY_STORE_PATH, build_company_store
+
+CORRELATION_DIR = Path(__file__).parent
+BUILD_MANIFEST_PATH = CORRELATION_DIR / "build_manifest.json"
+GEOMETRIC_MEAN_PATH = CORRELATION_DIR / "geometric_mean.json"
+
+
+def export_prices(store_path=PRICE_STORE_PATH, output_file=PRICES_PATH):
+    "Exports stock_prices.json from the price store"
+
+    conn = open_price_store(store_path)
+    try:
+        export_stock_prices(conn, output_file)
+    finally:
+        conn.close()
+
+
+# Each stage reads its inputs and writes its outputs; a stage depends on the
+# stages whose outputs it reads
+STAGES = {
+    "returns": {
+        "inputs": [PRICE_STORE_PATH],
+        "outputs": [RETURNS_STORE_PATH],
+        "run": partial(build_returns_store, RETURNS_STORE_PATH, PRICE_STORE_PATH),
+    },
+    "stock_prices": {
+        "inputs": [PRICE_STORE_PATH],
+        "outputs": [PRICES_PATH],
+        "run": partial(export_prices, PRICE_STORE_PATH, PRICES_PATH),
+    },
+    "geometric_mean": {
+        "inputs": [RETURNS_STORE_PATH],
+        "outputs": [GEOMETRIC_MEAN_PATH],
+        "run": partial(all_geometric_mean, RETURNS_STORE_PATH, GEOMETRIC_MEAN_PATH),
+    },
+    "scaled_returns": {
+        "inputs": [GEOMETRIC_MEAN_PATH],
+        "outputs": [RETURNS_PATH],
+        "run": partial(scale_returns, GEOMETRIC_MEAN_PATH, RETURNS_PATH),
+    },
+    "correlation": {
+        "inputs": [RETURNS_STORE_PATH],
+        "outputs": [CORRELATION_PATH],
+        "run": partial(correlation_matrix, RETURNS_STORE_PATH, CORRELATION_PATH),
+    },
+    "snapshots": {
+        "inputs": [RETURNS_STORE_PATH],
+        "outputs": [SNAPSHOT_DIR / MANIFEST_NAME],
+        "run": partial(build_snapshots, RETURNS_STORE_PATH, SNAPSHOT_DIR),
+    },
+    "factor_model": {
+        "inputs": [RETURNS_STORE_PATH],
+        "outputs": [FACTOR_MODEL_PATH],
+        "run": partial(build_factor_model, RETURNS_STORE_PATH, FACTOR_MODEL_PATH),
+    },
+    "market_store": {
+        "inputs": [CORRELATION_PATH, RETURNS_PATH, ESG_PATH, PRICES_PATH, STOCKS_DETAILS_PATH],
+        "outputs": [STORE_PATH],
+        "run": partial(build_market_store, STORE_PATH),
+    },
+    "esg_store": {
+        "inputs": [ESG_SOURCE_PATH, ESG_TICKERS_PATH],
+        "outputs": [ESG_STORE_PATH],
+        "run": partial(build_esg_store, ESG_STORE_PATH),
+    },
+    "company_store": {
+        "inputs": [COMPANY_INFO_PATH],
+        "outputs": [COMPANY_STORE_PATH],
+        "run": partial(build_company_store, COMPANY_INFO_PATH, COMPANY_STORE_PATH),
+    },
+}
+
+
+def file_hash(path, known):
+    """
+    SHA-256 of a file's content, or None if it does not exist. `known`
+    maps a path to its last {"size", "mtime_ns", "sha256"}, which is reused
+    while the size and modification time are unchanged, and is updated.
+    """
+    path = str(path)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        known.pop(path, None)
+        return None
+    entry = known.get(path)
+    if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            while chunk := file.read(1 << 20):
+                digest.update(chunk)
+        entry = known[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+    return entry["sha256"]
+
+
+def stage_dependencies(stages):
+    "Maps every stage to the set of stages producing one of its inputs"
+
+    producer = {str(output): name for name, stage in stages.items() for output in stage["outputs"]}
+    return {name: {producer[str(path)] for path in stage["inputs"] if str(path) in producer} - {name}
+            for name, stage in stages.items()}
+
+
+def select_stages(stages, targets=None):
+    "The target stages (default: every stage) and everything they depend on"
+
+    dependencies = stage_dependencies(stages)
+    unknown = set(targets or ()) - set(stages)
+    if unknown:
+        raise ValueError(f"Unknown build stage(s) {', '.join(sorted(unknown))}, use {', '.join(stages)}")
+    selected, queue = set(), list(targets or stages)
+    while queue:
+        name = queue.pop()
+        if name not in selected:
+            selected.add(name)
+            queue.extend(dependencies[name])
+    return selected
+
+
+def load_build_manifest(path=BUILD_MANIFEST_PATH):
+    "The recorded file hashes and stage inputs, empty if nothing was built yet"
+
+    if not Path(path).exists():
+        return {"files": {}, "stages": {}}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_build_manifest(manifest, path=BUILD_MANIFEST_PATH):
+    "Writes the manifest atomically, so an interrupted build never leaves it half written"
+
+    temporary = Path(f"{path}.tmp")
+    temporary.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(temporary, path)
+
+
+def is_stale(stage, record, input_hashes, manifest):
+    "A stage is stale if it never ran, an input changed or an output is missing or was changed since"
+
+    if record is None or record["inputs"] != input_hashes:
+        return True
+    for path in stage["outputs"]:
+        output_hash = file_hash(path, manifest["files"])
+        if output_hash is None or output_hash != record["outputs"].get(str(path)):
+            return True
+    return False
+
+
+def run_stage(run):
+    "Runs a stage in a worker process, dropping whatever it returns"
+
+    run()
+
+
+def build(targets=None, stages=STAGES, manifest_path=BUILD_MANIFEST_PATH, workers=None, force=False,
+          dry_run=False):
+    """
+    Brings the target stages (default: all) up to date, rebuilding only the
+    stale ones. A stage is checked once everything it depends on is done, so
+    an upstream rebuild that writes identical content does not cascade.
+    Independent stages run on `workers` processes (default: one per CPU,
+    1 runs them in this process). With dry_run=True nothing is run, and
+    every stage downstream of a stale one is reported as rebuilt.
+    Output: {"built": [...], "skipped": [...], "failed": {stage: error},
+    "blocked": [...]}, stages in the order they finished
+    """
+    selected = select_stages(stages, targets)
+    dependencies = {name: deps & selected for name, deps in stage_dependencies(stages).items() if name in selected}
+    manifest = load_build_manifest(manifest_path)
+    report = {"built": [], "skipped": [], "failed": {}, "blocked": []}
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(min(workers, len(selected))) if workers > 1 and not dry_run else None
+    pending, running, done = set(selected), {}, set()
+
+    def finish(name, input_hashes):
+        manifest["stages"][name] = {
+            "inputs": input_hashes,
+            "outputs": {str(path): file_hash(path, manifest["files"]) for path in stages[name]["outputs"]},
+        }
+        save_build_manifest(manifest, manifest_path)
+        report["built"].append(name)
+        done.add(name)
+
+    try:
+        while pending or running:
+            # Start every stage whose dependencies are done; skipping one may unblock more
+            ready = [name for name in sorted(pending) if dependencies[name] <= done]
+            for name in ready:
+                pending.remove(name)
+                stage = stages[name]
+                input_hashes = {str(path): file_hash(path, manifest["files"]) for path in stage["inputs"]}
+                rebuilt_upstream = dry_run and dependencies[name] & set(report["built"])
+                if not (force or rebuilt_upstream
+                        or is_stale(stage, manifest["stages"].get(name), input_hashes, manifest)):
+                    report["skipped"].append(name)
+                    done.add(name)
+                elif dry_run:
+                    report["built"].append(name)
+                    done.add(name)
+                elif executor is None:
+                    try:
+                        stage["run"]()
+                        finish(name, input_hashes)
+                    except Exception as error:
+                        report["failed"][name] = f"{type(error).__name__}: {error}"
+                else:
+                    running[executor.submit(run_stage, stage["run"])] = (name, input_hashes)
+            if ready:
+                continue
+            if not running:
+                # Whatever is left waits on a failed stage
+                report["blocked"].extend(sorted(pending))
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, input_hashes = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    finish(name, input_hashes)
+                else:
+                    report["failed"][name] = f"{type(error).__name__}: {error}"
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if not dry_run:
+        save_build_manifest(manifest, manifest_path)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the stale Wealth Spread data artifacts")
+    parser.add_argument("targets", nargs="*", metavar="stage",
+                        help=f"stages to bring up to date with their dependencies (default: all of {', '.join(STAGES)})")
+    parser.add_argument("--workers", type=int, default=None, help="parallel stages (default: one per CPU)")
+    parser.add_argument("--force", action="store_true", help="rebuild every selected stage")
+    parser.add_argument("--dry-run", action="store_true", help="only list the stages that would be rebuilt")
+    args = parser.parse_args()
+    report = build(args.targets or None, workers=args.workers, force=args.force, dry_run=args.dry_run)
+    print(f"{'Would rebuild' if args.dry_run else 'Rebuilt'}: {', '.join(report['built']) or 'nothing'}")
+    print(f"Up to date: {', '.join(report['skipped']) or 'nothing'}")
+    for name, error in report["failed"].items():
+        print(f"Failed {name}: {error}")
+    if report["blocked"]:
+        print(f"Not run after a failure: {', '.join(report['blocked'])}")
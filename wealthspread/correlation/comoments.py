@@ -0,0 +1,220 @@
+import numpy as np
+from pathlib import Path
+from wealthspread.correlation.returns import RETURNS_STORE_PATH, load_returns_store
+
+COMOMENTS_PATH = Path(__file__).parent / "comoments.npz"
+
+
+def empty_comoments(tickers, halflife=None):
+    """
+    Creates an empty co-moment state for `tickers`.
+
+    Every array is (N, N) and holds pairwise-complete statistics: entry
+    [i, j] only uses the days on which both stock i and stock j traded.
+        count: number of shared days
+        mean: running mean of stock i's return over those days
+        m2: running sum of squared deviations of stock i (Welford)
+        cross: running sum of cross deviations of stocks i and j
+    With a `halflife` (in days), ew_mean, ew_var and ew_cov hold the
+    exponentially weighted versions of the same statistics.
+    """
+    n_stocks = len(tickers)
+    state = {
+        "tickers": np.array(tickers),
+        "last_date": np.array("", dtype="U10"),
+        "count": np.zeros((n_stocks, n_stocks)),
+        "mean": np.zeros((n_stocks, n_stocks)),
+        "m2": np.zeros((n_stocks, n_stocks)),
+        "cross": np.zeros((n_stocks, n_stocks)),
+    }
+    if halflife is not None:
+        state["halflife"] = np.array(float(halflife))
+        state["ew_mean"] = np.zeros((n_stocks, n_stocks))
+        state["ew_var"] = np.zeros((n_stocks, n_stocks))
+        state["ew_cov"] = np.zeros((n_stocks, n_stocks))
+    return state
+
+
+def update_comoments(state, day_returns, date=None):
+    """
+    Folds one day of returns into the co-moment state in O(N^2).
+    day_returns is an (N,) array aligned to state["tickers"], NaN for stocks
+    that did not trade that day.
+    """
+    day_returns = np.asarray(day_returns, dtype=np.float64)
+    present = ~np.isnan(day_returns)
+    x = np.where(present, day_returns, 0.0)
+    both = np.outer(present, present)
+
+    # Welford update restricted to the pairs that traded today
+    state["count"] += both
+    dx = np.where(both, x[:, None] - state["mean"], 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        state["mean"] += np.where(both, dx / state["count"], 0.0)
+    dx_new = np.where(both, x[:, None] - state["mean"], 0.0)
+    state["m2"] += dx * dx_new
+    # The mean of stock j over pair [i, j] lives at mean[j, i]
+    state["cross"] += dx * dx_new.T
+
+    if "halflife" in state:
+        alpha = 1 - 0.5 ** (1 / float(state["halflife"]))
+        first = both & (state["count"] == 1)
+        ew_dx = np.where(both, x[:, None] - state["ew_mean"], 0.0)
+        state["ew_mean"] = np.where(first, x[:, None], state["ew_mean"] + alpha * ew_dx)
+        ew_dx = np.where(first, 0.0, ew_dx)
+        decay = np.where(both, 1 - alpha, 1.0)
+        state["ew_var"] = decay * (state["ew_var"] + alpha * ew_dx ** 2)
+        state["ew_cov"] = decay * (state["ew_cov"] + alpha * ew_dx * ew_dx.T)
+
+    if date is not None:
+        state["last_date"] = np.array(date, dtype="U10")
+    return state
+
+
+def comoments_from_returns(returns, tickers, dates=None, halflife=None):
+    """
+    Builds the co-moment state from a (T, N) returns array (NaN for missing
+    days), oldest day first. The plain moments come from masked matrix
+    products in one go; the exponentially weighted moments are folded in
+    day by day.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    present = (~np.isnan(returns)).astype(np.float64)
+    x = np.where(present > 0, returns, 0.0)
+
+    state = empty_comoments(tickers, halflife)
+    count = present.T @ present
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(count > 0, (x.T @ present) / count, 0.0)
+    state["count"] = count
+    state["mean"] = mean
+    state["m2"] = (x ** 2).T @ present - count * mean ** 2
+    state["cross"] = x.T @ x - count * mean * mean.T
+
+    if halflife is not None:
+        ew_state = empty_comoments(tickers, halflife)
+        for day_returns in returns:
+            update_comoments(ew_state, day_returns)
+        for name in ("ew_mean", "ew_var", "ew_cov"):
+            state[name] = ew_state[name]
+
+    if dates is not None and len(dates):
+        state["last_date"] = np.array(str(dates[-1])[:10], dtype="U10")
+    return state
+
+
+def comoments_correlation(state, weighted=False):
+    """
+    Returns the (N, N) correlation matrix from the co-moment state, the
+    exponentially weighted one if `weighted`. Pairs with fewer than two
+    shared days, or a constant return, are NaN. Raises ValueError for a
+    weighted matrix from a state built without a halflife.
+    """
+    if weighted:
+        if "ew_cov" not in state:
+            raise ValueError("The co-moment state has no exponentially weighted moments, "
+                             "build it with a halflife to get the weighted correlation")
+        var, cov = state["ew_var"], state["ew_cov"]
+    else:
+        var, cov = state["m2"], state["cross"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = cov / np.sqrt(var * var.T)
+    corr[(state["count"] < 2) | (var <= 0) | (var.T <= 0)] = np.nan
+    return corr
+
+
+def pairwise_correlation(returns, min_overlap=2, dtype=np.float64, block_size=1024):
+    """
+    Exact pairwise-complete correlation of a (T, N) returns array (NaN for
+    missing days), the same as pandas' df.corr(min_periods=min_overlap),
+    from masked matrix products.
+    Pairs with fewer than `min_overlap` shared days, or a constant return
+    over them, are NaN. dtype=np.float32 halves the memory and time for
+    large universes at about 1e-6 precision. Rows are built `block_size`
+    stocks at a time to bound the temporaries.
+    Output: (corr (N, N), counts (N, N) int64 number of shared days)
+    """
+    returns = np.asarray(returns)
+    present = ~np.isnan(returns)
+    # Shifting each stock by its own mean leaves the correlations unchanged
+    # but keeps the sums of squares from cancelling
+    shift = np.nansum(returns, axis=0) / np.maximum(present.sum(axis=0), 1)
+    x = np.where(present, returns - shift, 0.0).astype(dtype)
+    x2 = x * x
+    p = present.astype(dtype)
+
+    n_stocks = returns.shape[1]
+    corr = np.empty((n_stocks, n_stocks), dtype=dtype)
+    counts = np.empty((n_stocks, n_stocks), dtype=np.int64)
+    for start in range(0, n_stocks, block_size):
+        rows = slice(start, start + block_size)
+        count = p[:, rows].T @ p
+        # [i, j]: sums of stock i (sx, sxx) and stock j (sy, syy) over the shared days
+        sx, sy = x[:, rows].T @ p, p[:, rows].T @ x
+        sxx, syy = x2[:, rows].T @ p, p[:, rows].T @ x2
+        corr[rows] = correlation_from_sums(count, sx, sy, sxx, syy, x[:, rows].T @ x, min_overlap)
+        counts[rows] = np.rint(count)
+    return corr, counts
+
+
+def correlation_from_sums(count, sx, sy, sxx, syy, sxy, min_overlap=2):
+    """
+    Pearson correlation from the sums of each pair over its shared days:
+    count, sums of stock i (sx, sxx) and of stock j (sy, syy) and the
+    cross sum sxy. NaN below `min_overlap` shared days or for a constant
+    return.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var_x = sxx - sx * sx / count
+        var_y = syy - sy * sy / count
+        corr = (sxy - sx * sy / count) / np.sqrt(var_x * var_y)
+    corr[(count < max(min_overlap, 2)) | ~(var_x > 0) | ~(var_y > 0)] = np.nan
+    return np.clip(corr, -1, 1)
+
+
+def save_comoments(state, path=COMOMENTS_PATH):
+    "Persists the co-moment state as an .npz file"
+
+    np.savez(path, **state)
+
+
+def load_comoments(path=COMOMENTS_PATH):
+    "Loads a co-moment state saved by save_comoments"
+
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def update_correlation_matrix(returns_path=RETURNS_STORE_PATH,
+                              state_path=COMOMENTS_PATH,
+                              output_file="correlation_matrix.csv",
+                              weighted=False, halflife=63):
+    """
+    Nightly update: folds every day of the returns store newer than the
+    persisted state into it, then writes correlation_matrix.csv (the
+    exponentially weighted one if `weighted`).
+    Without a persisted state, the state is built from the full history.
+    """
+    import pandas as pd
+    returns = load_returns_store(returns_path)
+    dates = returns["dates"]
+
+    if Path(state_path).exists():
+        state = load_comoments(state_path)
+        tickers = list(state["tickers"])
+        # Align the store's columns to the state, NaN for tickers it lacks
+        position = {ticker: j for j, ticker in enumerate(returns["tickers"])}
+        columns = np.array([position.get(ticker, -1) for ticker in tickers])
+        new_days = np.flatnonzero(dates.astype(str) > str(state["last_date"]))
+        day_returns = np.where(columns >= 0, returns["simple"][new_days][:, columns], np.nan)
+        for date, row in zip(dates[new_days].astype(str), day_returns):
+            update_comoments(state, row, date)
+    else:
+        tickers = list(returns["tickers"])
+        state = comoments_from_returns(returns["simple"], tickers, dates,
+                                       halflife=halflife if weighted else None)
+
+    save_comoments(state, state_path)
+    corr_matrix = pd.DataFrame(comoments_correlation(state, weighted), index=tickers, columns=tickers)
+    corr_matrix.to_csv(output_file, index=True)
+    return corr_matrix
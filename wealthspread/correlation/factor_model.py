@@ -0,0 +1,100 @@
+import numpy as np
+from pathlib import Path
+from wealthspread.correlation.returns import RETURNS_STORE_PATH, load_returns_store
+
+FACTOR_MODEL_PATH = Path(__file__).parent / "factor_model.npz"
+
+N_FACTORS = 20
+
+
+def factor_model_from_returns(returns, k=N_FACTORS):
+    """
+    Approximates the correlation matrix of a (T, N) returns array (NaN for
+    missing days) by k factors plus a diagonal residual,
+        corr ~= loadings @ loadings.T + diag(residual),
+    from a truncated SVD of the standardized returns, so the N x N matrix
+    is never formed. The residual makes every diagonal entry exactly 1.
+    Output: dict with loadings (N, k), residual (N,) and explained, the
+    share of total variance the k factors account for.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    present = ~np.isnan(returns)
+    n_days = present.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.nansum(returns, axis=0) / n_days
+        std = np.sqrt(np.nansum((returns - mean) ** 2, axis=0) / (n_days - 1))
+        z = np.where(present, (returns - mean) / std, 0.0)
+    # Each stock only contributes its own days, so scale by its day count
+    z = np.nan_to_num(z / np.sqrt(np.maximum(n_days - 1, 1)))
+
+    _, singular, vt = np.linalg.svd(z, full_matrices=False)
+    k = min(k, len(singular))
+    loadings = vt[:k].T * singular[:k]
+    residual = np.clip(1 - (loadings ** 2).sum(axis=1), 0, None)
+    return {
+        "loadings": loadings,
+        "residual": residual,
+        "explained": np.array((singular[:k] ** 2).sum() / (singular ** 2).sum()),
+    }
+
+
+def factor_corr(model, rows=None, columns=None):
+    "Materializes the approximate correlation matrix (or a block of it) from a factor model"
+
+    loadings, residual = model["loadings"], model["residual"]
+    rows = np.arange(len(residual)) if rows is None else np.asarray(rows)
+    columns = np.arange(len(residual)) if columns is None else np.asarray(columns)
+    block = loadings[rows] @ loadings[columns].T
+    block += (rows[:, None] == columns[None, :]) * residual[rows][:, None]
+    return block
+
+
+def factor_model_error(model, corr, block_size=1024):
+    """
+    Reports how far the factor model is from the dense correlation matrix,
+    over the off-diagonal entries where `corr` is defined, block by block:
+    {"relative_frobenius", "max_abs", "mean_abs"}
+    """
+    n_stocks = len(model["residual"])
+    sq_error = sq_total = abs_error = 0.0
+    max_abs = 0.0
+    n_entries = 0
+    for start in range(0, n_stocks, block_size):
+        rows = np.arange(start, min(start + block_size, n_stocks))
+        dense = np.asarray(corr[rows])
+        error = factor_corr(model, rows) - dense
+        valid = ~np.isnan(dense) & (rows[:, None] != np.arange(n_stocks)[None, :])
+        error, dense = error[valid], dense[valid]
+        sq_error += (error ** 2).sum()
+        sq_total += (dense ** 2).sum()
+        abs_error += np.abs(error).sum()
+        max_abs = max(max_abs, np.abs(error).max(initial=0.0))
+        n_entries += valid.sum()
+    return {
+        "relative_frobenius": float(np.sqrt(sq_error / sq_total)) if sq_total else np.nan,
+        "max_abs": float(max_abs),
+        "mean_abs": float(abs_error / n_entries) if n_entries else np.nan,
+    }
+
+
+def build_factor_model(returns_path=RETURNS_STORE_PATH, output_path=FACTOR_MODEL_PATH, k=N_FACTORS):
+    "Builds the factor model from the returns store and saves it as an .npz file"
+
+    returns = load_returns_store(returns_path)
+    model = factor_model_from_returns(returns["simple"], k)
+    model["tickers"] = returns["tickers"]
+    np.savez(output_path, **model)
+    print(f"Saved a {model['loadings'].shape[1]}-factor model of {len(model['tickers'])} tickers "
+          f"explaining {float(model['explained']):.1%} of the variance to {output_path}")
+    return model
+
+
+def load_factor_model(path=FACTOR_MODEL_PATH):
+    "Loads a factor model saved by build_factor_model: tickers, loadings, residual, explained"
+
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+if __name__ == "__main__":
+    build_factor_model()
@@ -0,0 +1,108 @@
+import json
+import numpy as np
+from pathlib import Path
+from wealthspread.correlation.tickers import all_stocks
+from wealthspread.esg.esg_analysis import ESG_SCORES_PATH
+
+CORRELATION_DIR = Path(__file__).parent
+STORE_PATH = CORRELATION_DIR / "market_data.npz"
+CORRELATION_PATH = CORRELATION_DIR / "correlation_matrix.csv"
+RETURNS_PATH = CORRELATION_DIR / "scaled_geometric_mean.json"
+# The scores written by wealthspread.esg.esg_scores, which esg_store.npz is built from too
+ESG_PATH = ESG_SCORES_PATH
+PRICES_PATH = CORRELATION_DIR / "stock_prices.json"
+
+# Columns of the "esg" array, NaN where a stock has no ESG data
+ESG_FIELDS = ("totalEsg", "environmentScore", "socialScore", "governanceScore")
+
+
+def esg_array(esg_scores, tickers):
+    "Converts the ESG_Scores.json dictionary into an (N, 4) array"
+
+    esg = np.full((len(tickers), len(ESG_FIELDS)), np.nan)
+    for i, ticker in enumerate(tickers):
+        scores = esg_scores.get(ticker)
+        # Stocks without data hold a "No ESG data available" string
+        if isinstance(scores, dict):
+            for j, field in enumerate(ESG_FIELDS):
+                if scores.get(field) is not None:
+                    esg[i, j] = scores[field]
+    return esg
+
+
+def price_arrays(stock_prices, tickers):
+    """
+    Converts the stock_prices.json dictionary {ticker: {date: close}} into a
+    sorted array of dates and a (T, N) array of closing prices, NaN on days
+    a stock has no price.
+    """
+    dates = sorted({date[:10] for prices in stock_prices.values() for date in prices})
+    date_index = {date: i for i, date in enumerate(dates)}
+    prices = np.full((len(dates), len(tickers)), np.nan)
+    for j, ticker in enumerate(tickers):
+        for date, close in stock_prices.get(ticker, {}).items():
+            prices[date_index[date[:10]], j] = float(close)
+    return np.array(dates, dtype="datetime64[D]"), prices
+
+
+def read_market_artifacts(correlation_path=CORRELATION_PATH, returns_path=RETURNS_PATH,
+                          esg_path=ESG_PATH, prices_path=PRICES_PATH, tickers=None):
+    """
+    Reads the JSON/CSV artifacts into the arrays held by the market store,
+    all aligned to the ticker list. Prices are left out if no
+    stock_prices.json has been fetched.
+    """
+    import pandas as pd
+    if tickers is None:
+        tickers = list(all_stocks())
+
+    corr_matrix = pd.read_csv(correlation_path, index_col=0)
+    corr = corr_matrix.reindex(index=tickers, columns=tickers).to_numpy(dtype=np.float64)
+
+    with open(returns_path, "r") as file:
+        geo_means_dict = json.load(file)
+    returns = np.array([geo_means_dict.get(ticker, np.nan) for ticker in tickers], dtype=np.float64)
+
+    with open(esg_path, "r") as file:
+        esg_scores = json.load(file)
+
+    store = {
+        "tickers": np.array(tickers),
+        "corr": corr,
+        "returns": returns,
+        "esg": esg_array(esg_scores, tickers),
+    }
+
+    if Path(prices_path).exists():
+        with open(prices_path, "r") as file:
+            stock_prices = json.load(file)
+        store["dates"], store["prices"] = price_arrays(stock_prices, tickers)
+
+    return store
+
+
+def build_market_store(output_path=STORE_PATH, **artifact_paths):
+    "Compiles the JSON/CSV artifacts into a single binary .npz store"
+
+    store = read_market_artifacts(**artifact_paths)
+    # Left uncompressed so loading is a straight copy of the arrays
+    np.savez(output_path, **store)
+    print(f"Saved market store for {len(store['tickers'])} tickers to {output_path}")
+    return store
+
+
+def load_market_store(path=STORE_PATH):
+    """
+    Loads the market store in one shot as a dictionary of arrays:
+        tickers (N,), corr (N, N), returns (N,), esg (N, 4)
+        and, when prices were available, dates (T,) and prices (T, N).
+    Falls back to parsing the text artifacts if the store was never built.
+    """
+    if not Path(path).exists():
+        return read_market_artifacts()
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+if __name__ == "__main__":
+    build_market_store()
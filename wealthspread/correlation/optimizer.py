@@ -0,0 +1,195 @@
+import warnings
+import numpy as np
+from wealthspread.correlation.comoments import pairwise_correlation
+from wealthspread.correlation.returns import TRADING_DAYS_PER_YEAR
+
+
+def covariance_matrix(returns, periods_per_year=TRADING_DAYS_PER_YEAR, min_overlap=20, floor=1e-4):
+    """
+    Annualized covariance matrix of a (T, N) daily returns array (NaN for
+    missing days), built from the pairwise-complete correlations and each
+    stock's own volatility.
+    Pairwise-complete correlations need not form a valid matrix, so
+    eigenvalues below `floor` are raised to it before rescaling the
+    diagonal back to 1. Pairs without enough shared days count as
+    uncorrelated, and stocks without a volatility get NaN rows.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    corr, _ = pairwise_correlation(returns, min_overlap)
+    corr = np.nan_to_num(corr, nan=0.0)
+    np.fill_diagonal(corr, 1.0)
+
+    eigenvalues, eigenvectors = np.linalg.eigh(corr)
+    if eigenvalues[0] < floor:
+        corr = (eigenvectors * np.maximum(eigenvalues, floor)) @ eigenvectors.T
+        scale = 1 / np.sqrt(np.diag(corr))
+        corr = corr * np.outer(scale, scale)
+
+    vol = np.nanstd(returns, axis=0, ddof=1) * np.sqrt(periods_per_year)
+    return corr * np.outer(vol, vol)
+
+
+def project_capped_simplex(v, cap, n_bisect=60):
+    """
+    Euclidean projection of every row of `v` onto {w : 0 <= w <= cap,
+    sum(w) = 1}, by bisection on the shift tau in clip(v - tau, 0, cap).
+    `cap` is a scalar or an array broadcastable to v.
+    """
+    v = np.atleast_2d(v)
+    cap = np.broadcast_to(cap, v.shape)
+    lo = (v - cap).min(axis=1, keepdims=True)
+    hi = v.max(axis=1, keepdims=True)
+    for _ in range(n_bisect):
+        tau = (lo + hi) / 2
+        too_big = np.clip(v - tau, 0, cap).sum(axis=1, keepdims=True) > 1
+        lo = np.where(too_big, tau, lo)
+        hi = np.where(too_big, hi, tau)
+    return np.clip(v - (lo + hi) / 2, 0, cap)
+
+
+def portfolio_sharpe(weights, mu, cov, risk_free=0.0):
+    "Sharpe ratio (mu @ w - risk_free) / sqrt(w @ cov @ w) of every row of `weights`"
+
+    weights = np.atleast_2d(weights)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (weights @ mu - risk_free) / np.sqrt(np.einsum("bi,bi->b", weights @ cov, weights))
+
+
+def capped_fill(mu, cap):
+    """
+    Feasible starting point of the active-set solver: the names with the
+    highest `mu` filled up to their cap until the weights sum to 1.
+    Output: (weights, free) with only the last name filled left free
+    """
+    order = np.argsort(-mu, kind="stable")
+    room = np.maximum(0.0, 1 - np.concatenate([[0.0], np.cumsum(cap[order])[:-1]]))
+    weights = np.zeros(len(mu))
+    weights[order] = np.minimum(cap[order], room)
+    free = np.zeros(len(mu), dtype=bool)
+    free[order[np.flatnonzero(weights[order] > 0)[-1]]] = True
+    return weights, free
+
+
+def mean_variance_weights(mu, cov, risk_aversion, cap, weights=None, free=None, max_iter=None, tol=1e-12):
+    """
+    Long-only weights maximizing mu @ w - risk_aversion / 2 * w @ cov @ w
+    with sum(w) = 1 and w <= cap, by a primal active-set method: names are
+    fixed at 0 or their cap until their multiplier says releasing them
+    helps, and the free names are solved for exactly. The optimum is
+    sparse, so every step only solves a small linear system.
+    `weights` and `free` (a feasible point and the names not fixed at a
+    bound) warm start the solve, e.g. from the previous risk aversion.
+    Output: (weights, free, converged)
+    """
+    if weights is None:
+        weights, free = capped_fill(mu, cap)
+    weights, free = weights.copy(), free.copy()
+    scale = tol * max(1.0, np.abs(mu).max())
+    for _ in range(max_iter or 10 * len(mu) + 100):
+        gradient = risk_aversion * (cov @ weights) - mu
+        idx = np.flatnonzero(free)
+        kkt = np.zeros((len(idx) + 1, len(idx) + 1))
+        kkt[:-1, :-1] = risk_aversion * cov[np.ix_(idx, idx)]
+        kkt[:-1, -1] = kkt[-1, :-1] = 1
+        solution = np.linalg.solve(kkt, np.append(-gradient[idx], 0.0))
+        step = solution[:-1]
+
+        # Move towards the optimum of the free names until one hits a bound
+        with np.errstate(divide="ignore", invalid="ignore"):
+            room = np.where(step < 0, weights[idx] / -step, np.where(step > 0, (cap[idx] - weights[idx]) / step, np.inf))
+        blocking = int(np.argmin(room))
+        if room[blocking] < 1:
+            weights[idx] += room[blocking] * step
+            weights[idx[blocking]] = 0.0 if step[blocking] < 0 else cap[idx[blocking]]
+            free[idx[blocking]] = False
+            continue
+        weights[idx] += step
+
+        # At the optimum of the free names: release the fixed name whose multiplier has the wrong sign
+        gradient = risk_aversion * (cov @ weights) - mu
+        nu = -gradient[idx].mean()
+        multiplier = np.where(weights > 0, -(gradient + nu), gradient + nu)
+        multiplier[free | (cap <= 0)] = np.inf
+        release = int(np.argmin(multiplier))
+        if multiplier[release] >= -scale:
+            return weights, free, True
+        free[release] = True
+    return weights, free, False
+
+
+def max_sharpe_weights(mu, cov, cap=1.0, risk_free=0.0, start=None, max_iter=100, tol=1e-10):
+    """
+    Long-only maximum Sharpe ratio weights with a per-name cap.
+    The maximum Sharpe portfolio is the mean-variance optimum whose risk
+    aversion equals its own excess return over its variance, so that risk
+    aversion is found by a safeguarded secant search on its logarithm,
+    each step solved exactly by mean_variance_weights from the last one.
+    The search stops once the relative gap between the two, which is zero
+    exactly where the KKT conditions of the Sharpe ratio hold, is below
+    `tol`; a RuntimeWarning is raised if `max_iter` steps do not get there.
+    One problem is solved per row of `cap` (or `start`, a feasible point to
+    start from). Names with a NaN return or a cap of 0 get no weight. Any
+    stationary point is the global maximum, since the Sharpe ratio is
+    pseudo-concave wherever it is positive.
+    Output: (weights (B, N), sharpe (B,))
+    """
+    mu = np.asarray(mu, dtype=np.float64)
+    cap = np.atleast_2d(np.where(np.isnan(mu), 0.0, cap))
+    if start is not None:
+        cap = np.broadcast_to(cap, np.broadcast_shapes(cap.shape, np.atleast_2d(start).shape))
+    if (cap.sum(axis=1) < 1).any():
+        raise ValueError("The caps leave less than 100% to allocate, raise the cap")
+    mu = np.nan_to_num(mu, nan=0.0) - risk_free
+    cov = np.nan_to_num(cov, nan=0.0)
+
+    weights = np.empty(cap.shape)
+    for row, row_cap in enumerate(cap):
+        state = None
+        if start is not None:
+            point = project_capped_simplex(np.broadcast_to(start, cap.shape)[row], row_cap)[0]
+            state = (point, (point > 0) & (point < row_cap))
+        weights[row] = tangency_weights(mu, cov, row_cap, state, max_iter, tol)
+    return weights, portfolio_sharpe(weights, mu, cov)
+
+
+def tangency_weights(mu, cov, cap, state=None, max_iter=100, tol=1e-10):
+    "Solves one max_sharpe_weights problem, see there"
+
+    def gap(log_aversion):
+        "log(excess / variance) - log(risk aversion) of the mean-variance optimum, falling with risk aversion"
+        nonlocal state
+        w, free, converged = mean_variance_weights(mu, cov, np.exp(log_aversion), cap, *(state or ()))
+        if not converged:
+            warnings.warn("The mean-variance active-set solve hit its iteration limit", RuntimeWarning)
+        state = (w, free)
+        excess = w @ mu
+        return (np.log(excess / (w @ cov @ w)) if excess > 0 else -np.inf) - log_aversion, w
+
+    highest, _ = capped_fill(mu, cap)
+    if highest @ mu <= 0:
+        raise ValueError("No portfolio within the caps has a positive excess return")
+    # Bracket the root, starting from the highest-return portfolio's ratio
+    x0 = np.log(highest @ mu / (highest @ cov @ highest))
+    g0, w = gap(x0)
+    step = 1.0 if g0 > 0 else -1.0
+    x1, (g1, w) = x0 + step, gap(x0 + step)
+    while abs(g1) >= tol and np.sign(g1) == np.sign(g0):
+        x0, g0 = x1, g1
+        step *= 2
+        x1, (g1, w) = x0 + step, gap(x0 + step)
+
+    # Illinois false position, bisecting while an end has no finite gap
+    g = g1
+    for _ in range(max_iter):
+        if abs(g) < tol or abs(x1 - x0) < tol:
+            return w
+        x = x1 - g1 * (x1 - x0) / (g1 - g0) if np.isfinite(g0) else (x0 + x1) / 2
+        g, w = gap(x)
+        if np.sign(g) == np.sign(g1):
+            g0 /= 2
+        else:
+            x0, g0 = x1, g1
+        x1, g1 = x, g
+    warnings.warn(f"max_sharpe_weights did not converge in {max_iter} steps (relative gap {abs(g):.1e})",
+                  RuntimeWarning)
+    return w
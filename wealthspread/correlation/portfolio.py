@@ -1,23 +1,27 @@
 import numpy as np
-import pandas as pd
 import json
-from itertools import combinations
-from wealthspread.correlation.simulation import weighted_mean_correlation
-from wealthspread.correlation.twelvedata_api import tickers_list_creator
-#from twelvedata_api import tickers_list_creator
-#from simulation import weighted_mean_correlation
-# to run the suggest_stocks_sharpe independently(i.e not from CLI) change path by
-# unhashing above 2 paths and hashing the paths above them.
+from wealthspread.correlation.tickers import all_stocks
+from wealthspread.correlation.market_store import load_market_store, ESG_FIELDS
+from wealthspread.correlation.returns import RETURNS_STORE_PATH, load_returns_store, geometric_means
+from wealthspread.correlation.rolling import load_snapshot
+from wealthspread.correlation.factor_model import load_factor_model, factor_corr
+from wealthspread.correlation.optimizer import covariance_matrix, max_sharpe_weights
+from wealthspread.correlation.scoring import (score_candidates, top_candidates, top_pair_additions,
+                                              score_pairs, esg_candidates, current_esg, portfolio_esg)
 
-ALL_STOCKS = tickers_list_creator()
 
-def scale_returns():
+def __getattr__(name):
+    "Loads ALL_STOCKS, the ticker universe, on first use instead of at import"
+
+    if name == "ALL_STOCKS":
+        return list(all_stocks())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def scale_returns(input_file="geometric_mean.json", output_file="scaled_geometric_mean.json"):
     "Scales the returns of stocks with very high historical returns"
 
     # Load the dictionary from the JSON file
-    input_file = "geometric_mean.json"
-    output_file = "scaled_geometric_mean.json"
-
     with open(input_file, "r") as file:
         stock_returns = json.load(file)
 
@@ -31,27 +35,17 @@ def scale_returns():
     # Confirm completion
     output_file
 
-def all_geometric_mean():
+def all_geometric_mean(returns_path=RETURNS_STORE_PATH, output_file="geometric_mean.json"):
     "Creates a file with the geometric means of all the stocks"
-    
-    all_geo_means = {}
-    with open('stock_prices.json', 'r') as file:
-        stocks_data = json.load(file)
-        for ticker in stocks_data.keys():
-            data = stocks_data[ticker]
-            dates = list(data.keys())
-            start_date = dates[-1]  # First date in the data (earliest)
-            end_date = dates[0]    # Last date in the data (most recent)
-        
-            start_price = float(data[start_date])
-            end_price = float(data[end_date])
-            
-        # Calculate geometric mean using the formula
-            geometric_mean = (end_price / start_price) ** (1 / 5) - 1
-            all_geo_means[ticker] = geometric_mean
-
-   # Save dictionary to a JSON file
-    with open("geometric_mean.json", "w") as file:
+
+    # Computed over each stock's full history in the returns matrix
+    returns = load_returns_store(returns_path)
+    geo_means = geometric_means(returns, years=5)
+    all_geo_means = {str(ticker): float(geo_mean) for ticker, geo_mean in zip(returns["tickers"], geo_means)
+                     if not np.isnan(geo_mean)}
+
+    # Save dictionary to a JSON file
+    with open(output_file, "w") as file:
         json.dump(all_geo_means, file, indent=4)
 
 def portfolio_geometric_mean(data, new_weights): 
@@ -66,74 +60,265 @@ def portfolio_geometric_mean(data, new_weights):
     return sum(lst) 
 
 
-def suggest_stocks_sharpe(current_inv, investment_amount):
+def load_market_data(lookback=None, backend="dense"):
+    """
+    Loads the correlation matrix, scaled returns and total ESG scores from
+    the market store, as arrays aligned to ALL_STOCKS.
+    With a lookback ("3m", "1y", "5y"), the correlation matrix comes from
+    that lookback's precomputed snapshot instead (see rolling.py).
+    With backend="factor", corr is the factor model {"loadings",
+    "residual"} (see factor_model.py) rather than a dense matrix.
+    Output: (corr array (N, N), returns array (N,), total ESG array (N,)
+    with NaN where a stock has no ESG data)
+    """
+    if backend not in ("dense", "factor"):
+        raise ValueError(f"Unknown correlation backend {backend!r}, use 'dense' or 'factor'")
+    if backend == "factor" and lookback is not None:
+        raise ValueError("The factor model is built from the full history and has no lookback")
+    stocks = all_stocks()
+    store = load_market_store()
+    position = {ticker: i for i, ticker in enumerate(store["tickers"])}
+    idx = np.array([position[ticker] for ticker in stocks])
+
+    # Missing correlations are skipped by the pandas sums, so count them as 0
+    if backend == "factor":
+        model = load_factor_model()
+        model_position = {ticker: i for i, ticker in enumerate(model["tickers"])}
+        model_idx = np.array([model_position.get(ticker, -1) for ticker in stocks])
+        known = model_idx >= 0
+        # Stocks outside the model only correlate with themselves
+        corr = {"loadings": np.zeros((len(stocks), model["loadings"].shape[1])),
+                "residual": np.ones(len(stocks))}
+        corr["loadings"][known] = model["loadings"][model_idx[known]]
+        corr["residual"][known] = model["residual"][model_idx[known]]
+    elif lookback is None:
+        corr = np.nan_to_num(store["corr"][np.ix_(idx, idx)], nan=0.0)
+    else:
+        snapshot = load_snapshot(lookback)
+        snapshot_position = {ticker: i for i, ticker in enumerate(snapshot["tickers"])}
+        snapshot_idx = np.array([snapshot_position.get(ticker, -1) for ticker in stocks])
+        known = snapshot_idx >= 0
+        corr = np.zeros((len(stocks), len(stocks)))
+        corr[np.ix_(known, known)] = np.nan_to_num(
+            snapshot["corr"][np.ix_(snapshot_idx[known], snapshot_idx[known])], nan=0.0)
+    returns = store["returns"][idx]
+    total_esg = store["esg"][idx, ESG_FIELDS.index("totalEsg")]
+
+    return corr, returns, total_esg
+
+
+def suggest_stocks_sharpe(current_inv, investment_amount, lookback=None, backend="dense", max_esg=None,
+                          exclude_missing_esg=False):
     """
     Main function that returns the stock with the highest sharpe ratio
     Inputs: current_inv: dict {ticker: amount_invested}, 
-    investment_amount: float (new money to be invested)
+    investment_amount: float (new money to be invested),
+    lookback: str (correlation regime "3m", "1y" or "5y", default the
+    market store's matrix),
+    backend: str ("dense" correlation matrix or "factor" model, which
+    scores every candidate in O(N * k)),
+    max_esg: float (only suggest stocks keeping the new portfolio's ESG
+    risk at or below this),
+    exclude_missing_esg: bool (never suggest stocks without ESG data)
     Output: A list [Suggested Stock, Sharpe Ratio, Portfolio Correlation, 
     Old Portfolio ESG, New Portfolio ESG]
+    When the portfolio holds a single stock, a pair of stocks is suggested
+    as a tuple and the new money is split evenly between them.
     """
-    current_tickers = list(current_inv.keys())
-    current_amounts = np.array(list(current_inv.values()))
-    corr_matrix = pd.read_csv("wealthspread/correlation/correlation_matrix.csv", index_col=0)
-    #corr_matrix = pd.read_csv("correlation_matrix.csv", index_col=0)
-
-    with open("wealthspread/correlation/scaled_geometric_mean.json", "r") as file:
-    #with open("scaled_geometric_mean.json", "r") as file:
-        geo_means_dict = json.load(file)
-    
-    with open("wealthspread/correlation/ESG_Scores.json", "r") as file:  
-    #with open("ESG_Scores.json", "r") as file:  
-        esg_scores = json.load(file) 
+    corr, returns, total_esg = load_market_data(lookback, backend)
+    return suggest_from_market_data(corr, returns, total_esg, current_inv, investment_amount,
+                                    max_esg=max_esg, exclude_missing_esg=exclude_missing_esg)
+
+    # Example Usage:
+    # portfolio.suggest_stocks_sharpe({"FI":1000, "BA":1000, "USB":1000, "CMG" :1000, "TDG": 1000}, 1000)
+    # portfolio.suggest_stocks_sharpe({"BK":1000, "GM":1000, "D":1000, "LULU" :1000, "MPC": 1000}, 1000)
+    # portfolio.suggest_stocks_sharpe({"PLD":1000, "COP":1000, "ETN":1000, "LOW" :1000, "HON": 1000}, 1000)
+
+
+def score_additions(corr, returns, total_esg, current_inv, investment_amount, tickers, k=1, full_table=False,
+                    max_esg=None, exclude_missing_esg=False):
+    """
+    The scoring pass shared by suggest_from_market_data and
+    suggest_stocks_ranked. When the portfolio holds a single stock, pairs of
+    stocks splitting the new money evenly are scored, otherwise single
+    stocks; either way the ESG constraints are applied as masks first.
+    Output: (current portfolio ESG, the k best additions as dicts
+    {"ticker", "sharpe", "mean_corr", "new_esg"}, best first, and with
+    full_table every scored addition as a dictionary of arrays, else None)
+    """
+    current_amounts = np.array(list(current_inv.values()), dtype=np.float64)
+    ticker_index = {ticker: i for i, ticker in enumerate(tickers)}
+    held_idx = [ticker_index[ticker] for ticker in current_inv]
+
+    # Weighted ESG score of the holdings with ESG data (see scoring.portfolio_esg)
+    current_esg_score = current_esg(total_esg, held_idx, current_amounts)
+    table = None
+
+    if len(current_inv) == 1:
+        if isinstance(corr, dict):
+            # The pair search needs the dense matrix
+            corr = factor_corr(corr)
 
-    # Determine how many stocks to suggest
-    if len(current_tickers) == 1:
-        possible_additions = list(combinations(ALL_STOCKS, 2))
+        def pair_esg(first, second):
+            pairs = np.column_stack([first, second]).astype(np.intp)
+            return portfolio_esg(total_esg, held_idx, current_amounts, investment_amount, pairs)
+
+        top = [{"ticker": (tickers[first], tickers[second]), "sharpe": sharpe, "mean_corr": mean_corr,
+                "new_esg": pair_esg([first], [second])[0]}
+               for first, second, sharpe, mean_corr in top_pair_additions(
+                   corr, returns, held_idx, current_amounts, investment_amount, k=k, esg=total_esg,
+                   max_esg=max_esg, exclude_missing_esg=exclude_missing_esg)]
+        if full_table:
+            first, second, sharpe, mean_corr = score_pairs(
+                corr, returns, held_idx, current_amounts, investment_amount, total_esg, max_esg,
+                exclude_missing_esg)
+            table = {"ticker": list(zip(np.array(tickers)[first], np.array(tickers)[second])),
+                     "sharpe": sharpe, "mean_corr": mean_corr, "new_esg": pair_esg(first, second)}
     else:
-        possible_additions = [stock for stock in ALL_STOCKS if stock not in current_inv]
-    best_combination = None
-    # best_correlation = float("inf")
-    best_sharpe = 0
-
-    for new_stocks in possible_additions: 
-        new_tickers = current_tickers + [new_stocks]
-        # Compute new weights
-        new_amounts = np.append(current_amounts, investment_amount)
-        new_weights = {ticker: float(amt / new_amounts.sum())for ticker, amt in zip(new_tickers, new_amounts)}
-      
-        # Extract sub-matrix
-        sub_corr_matrix = corr_matrix.loc[new_tickers, new_tickers]
-      
-        # Compute weighted mean correlation 
-        total_mean_corr = weighted_mean_correlation(sub_corr_matrix, new_weights)
-        
-        total_mean_return = portfolio_geometric_mean(geo_means_dict, new_weights)
-        # Find the best combination that minimizes correlation
-        sharpe_ratio = total_mean_return / total_mean_corr 
-        
-        if abs(sharpe_ratio) > abs(best_sharpe):
-            best_sharpe = sharpe_ratio
-            best_combination = new_stocks
-
-    new_stock = best_combination[0] if isinstance(best_combination, tuple) else best_combination
-
-    # Compute weighted ESG score for the current portfolio
-    current_esg_score = sum(
-        current_inv[ticker] * esg_scores.get(ticker, {}).get("totalEsg", 0)  
-        for ticker in current_tickers
-    ) / sum(current_inv.values()) if current_inv else 0
-
-    # Compute weighted ESG score for the new portfolio
-    new_portfolio_inv = {**current_inv, new_stock: investment_amount} 
-    new_esg_score = sum(
-        new_portfolio_inv[ticker] * esg_scores.get(ticker, {}).get("totalEsg", 0) 
-        for ticker in new_portfolio_inv
-    ) / sum(new_portfolio_inv.values()) if new_portfolio_inv else 0
+        # Drop the stocks breaking the ESG constraints, then score the rest in one vectorized pass
+        candidates, new_esg = esg_candidates(total_esg, held_idx, current_amounts, investment_amount,
+                                             max_esg=max_esg, exclude_missing_esg=exclude_missing_esg)
+        candidates, sharpe, mean_corr, _ = score_candidates(
+            corr, returns, held_idx, current_amounts, investment_amount, candidates)
+        top = [{"ticker": tickers[candidates[i]], "sharpe": sharpe[i], "mean_corr": mean_corr[i],
+                "new_esg": new_esg[i]}
+               for i in top_candidates(sharpe, k)]
+        if full_table:
+            table = {"ticker": np.array(tickers)[candidates], "sharpe": sharpe, "mean_corr": mean_corr,
+                     "new_esg": new_esg}
+    return current_esg_score, top, table
+
+
+def suggest_from_market_data(corr, returns, total_esg, current_inv, investment_amount, tickers=None,
+                             max_esg=None, exclude_missing_esg=False):
+    """
+    suggest_stocks_sharpe on market data that has already been loaded with
+    load_market_data, so many portfolios can be scored against one copy.
+    tickers defaults to ALL_STOCKS, the order of the market data arrays.
+    The ESG constraints are applied as masks before any candidate is scored.
+    """
+    if tickers is None:
+        tickers = all_stocks()
+    current_esg_score, top, _ = score_additions(corr, returns, total_esg, current_inv, investment_amount, tickers,
+                                                max_esg=max_esg, exclude_missing_esg=exclude_missing_esg)
+    if not top:
+        best_combination, best_sharpe, total_mean_corr, new_esg_score = None, 0, np.nan, current_esg_score
+    else:
+        best = top[0]
+        best_combination, best_sharpe, total_mean_corr = best["ticker"], best["sharpe"], best["mean_corr"]
+        new_esg_score = best["new_esg"]
 
     return [best_combination, float(np.round(best_sharpe,3)), float(np.round(total_mean_corr,3)), np.round(current_esg_score,2), np.round(new_esg_score,2)]
 
-    # Example Usage:
-    # portfolio.suggest_stocks_sharpe({"FI":1000, "BA":1000, "USB":1000, "CMG" :1000, "TDG": 1000}, 1000)
-    # portfolio.suggest_stocks_sharpe({"BK":1000, "GM":1000, "D":1000, "LULU" :1000, "MPC": 1000}, 1000)
-    # portfolio.suggest_stocks_sharpe({"PLD":1000, "COP":1000, "ETN":1000, "LOW" :1000, "HON": 1000}, 1000)
\ No newline at end of file
+
+def suggest_stocks_ranked(current_inv, investment_amount, k=10, full_table=False, lookback=None,
+                          backend="dense", max_esg=None, exclude_missing_esg=False):
+    """
+    Returns the k best suggestions from a single scoring pass, best first.
+    Inputs: current_inv: dict {ticker: amount_invested},
+    investment_amount: float (new money to be invested),
+    k: int (number of suggestions),
+    full_table: bool (also return every scored candidate),
+    lookback: str (correlation regime, as in suggest_stocks_sharpe),
+    backend: str (correlation backend, as in suggest_stocks_sharpe),
+    max_esg, exclude_missing_esg: ESG constraints, as in suggest_stocks_sharpe
+    Output: A list of dicts {"ticker", "sharpe", "mean_corr", "esg_delta"},
+    where "ticker" is a tuple of two stocks when the portfolio holds a single
+    stock. With full_table=True, returns (list, DataFrame of all candidates).
+    """
+    corr, returns, total_esg = load_market_data(lookback, backend)
+    current_esg_score, top, table = score_additions(corr, returns, total_esg, current_inv, investment_amount,
+                                                    all_stocks(), k, full_table, max_esg, exclude_missing_esg)
+    top = [{"ticker": row["ticker"],
+            "sharpe": float(row["sharpe"]),
+            "mean_corr": float(row["mean_corr"]),
+            "esg_delta": float(row["new_esg"] - current_esg_score)}
+           for row in top]
+    if not full_table:
+        return top
+    import pandas as pd
+    table = pd.DataFrame({
+        "ticker": table["ticker"],
+        "sharpe": table["sharpe"],
+        "mean_corr": table["mean_corr"],
+        "esg_delta": table["new_esg"] - current_esg_score,
+    })
+    return top, table
+
+
+def load_covariance(returns_path=RETURNS_STORE_PATH):
+    """
+    Builds the annualized covariance matrix of ALL_STOCKS from the daily
+    returns store, NaN for stocks without price history.
+    """
+    returns = load_returns_store(returns_path)
+    position = {ticker: j for j, ticker in enumerate(returns["tickers"])}
+    idx = np.array([position.get(ticker, -1) for ticker in all_stocks()])
+    daily = np.where(idx >= 0, returns["simple"][:, idx], np.nan)
+    return covariance_matrix(daily)
+
+
+def suggest_optimal_portfolio(current_inv, investment_amount, cap=0.1, risk_free=0.0):
+    """
+    Mean-variance alternative to suggest_stocks_sharpe: the long-only
+    maximum Sharpe ratio portfolio over every stock, with at most `cap` of
+    the portfolio in any one name, using the scaled geometric means as
+    expected returns and the covariance of the cached prices.
+    Inputs: current_inv: dict {ticker: amount_invested},
+    investment_amount: float (new money to be invested),
+    cap: float (maximum weight per stock),
+    risk_free: float (annual risk free rate)
+    Output: A dict with
+        "weights": {ticker: weight} of the optimal portfolio, largest first
+        "allocation": {ticker: amount} of the new money that moves the
+            portfolio closest to those weights without selling
+        "optimal", "current", "single_stock": {"expected_return",
+            "volatility", "sharpe"} of the optimal portfolio, the current
+            one and the current one plus suggest_stocks_sharpe's pick, so
+            the suggestions can be compared side by side
+    """
+    stocks = all_stocks()
+    _, returns, _ = load_market_data()
+    cov = load_covariance()
+    # Stocks without price history cannot be held by the optimizer
+    mu = np.where(np.isnan(np.diag(cov)), np.nan, returns)
+    weights, _ = max_sharpe_weights(mu, cov, cap, risk_free)
+    weights = weights[0]
+
+    ticker_index = {ticker: i for i, ticker in enumerate(stocks)}
+    mu, cov = np.nan_to_num(mu), np.nan_to_num(cov)
+
+    def stats(amounts):
+        w = np.zeros(len(stocks))
+        for ticker, amount in amounts.items():
+            w[ticker_index[ticker]] += amount
+        w /= w.sum()
+        volatility = float(np.sqrt(w @ cov @ w))
+        expected_return = float(w @ mu)
+        return {"expected_return": round(expected_return, 4), "volatility": round(volatility, 4),
+                "sharpe": round((expected_return - risk_free) / volatility, 3) if volatility > 0 else np.nan}
+
+    # Buy towards the optimal weights with the new money only
+    total = sum(current_inv.values()) + investment_amount
+    shortfall = weights * total
+    for ticker, amount in current_inv.items():
+        shortfall[ticker_index[ticker]] -= amount
+    shortfall = np.clip(shortfall, 0, None)
+    allocation = shortfall / shortfall.sum() * investment_amount if shortfall.sum() > 0 else shortfall
+
+    single = suggest_stocks_sharpe(current_inv, investment_amount)[0]
+    single_amounts = dict(current_inv)
+    if single is not None:
+        picks = single if isinstance(single, tuple) else (single,)
+        for ticker in picks:
+            single_amounts[ticker] = single_amounts.get(ticker, 0) + investment_amount / len(picks)
+
+    order = np.argsort(-weights, kind="stable")
+    return {
+        "weights": {stocks[i]: round(float(weights[i]), 4) for i in order if weights[i] >= 1e-4},
+        "allocation": {stocks[i]: round(float(allocation[i]), 2) for i in np.argsort(-allocation, kind="stable")
+                       if allocation[i] >= 0.01},
+        "optimal": stats({stocks[i]: weights[i] for i in order if weights[i] > 0}),
+        "current": stats(current_inv),
+        "single_stock": stats(single_amounts),
+    }
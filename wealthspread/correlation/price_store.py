@@ -0,0 +1,203 @@
+import json
+import re
+import sqlite3
+import zlib
+import numpy as np
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+
+PRICE_STORE_PATH = Path(__file__).parent / "prices.sqlite"
+
+# Every series is stored oldest day first as one compressed array per column
+COLUMN_DTYPES = {
+    "datetime": "datetime64[D]",
+    "open": "float64",
+    "high": "float64",
+    "low": "float64",
+    "close": "float64",
+    "volume": "int64",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    symbol TEXT NOT NULL,
+    interval TEXT NOT NULL,
+    first_date TEXT,
+    last_date TEXT,
+    rows INTEGER NOT NULL,
+    checked_through TEXT,
+    updated TEXT NOT NULL,
+    datetime BLOB NOT NULL,
+    open BLOB NOT NULL,
+    high BLOB NOT NULL,
+    low BLOB NOT NULL,
+    close BLOB NOT NULL,
+    volume BLOB NOT NULL,
+    PRIMARY KEY (symbol, interval)
+)
+"""
+
+
+def open_price_store(path=PRICE_STORE_PATH):
+    "Opens (creating if needed) the SQLite price store"
+
+    conn = sqlite3.connect(path)
+    conn.execute(SCHEMA)
+    return conn
+
+
+def drop_duplicate_bars(series):
+    """
+    Drops the bars Twelve Data repeats: weekend bars (copies of the next
+    Monday's bar) and bars whose open, high, low and close all equal the
+    next bar's. Output: the series without them, oldest day first
+    """
+    series = {column: values[np.is_busday(series["datetime"])] for column, values in series.items()}
+    prices = np.stack([series[column] for column in ("open", "high", "low", "close")], axis=1)
+    keep = np.ones(len(prices), dtype=bool)
+    keep[:-1] = (prices[:-1] != prices[1:]).any(axis=1)
+    return {column: values[keep] for column, values in series.items()}
+
+
+def rows_to_series(rows):
+    """
+    Converts Twelve Data rows ({"datetime", "open", ..., "volume"} dicts,
+    newest day first) into a dictionary of typed column arrays, oldest day
+    first, without the repeated bars (see drop_duplicate_bars).
+    """
+    rows = rows[::-1]
+    return drop_duplicate_bars({
+        column: np.array([row[column][:10] if column == "datetime" else float(row[column])
+                          for row in rows]).astype(dtype)
+        for column, dtype in COLUMN_DTYPES.items()
+    })
+
+
+def csv_to_series(csv_data):
+    """
+    Parses a semicolon CSV time series from Twelve Data (bytes or str,
+    newest day first) into typed column arrays, oldest day first, without
+    the repeated bars (see drop_duplicate_bars).
+
+    The five numeric columns are read in a single np.loadtxt pass and the
+    dates are sliced straight out of the raw bytes, so no per-row objects
+    are built.
+    """
+    if isinstance(csv_data, str):
+        csv_data = csv_data.encode()
+    raw = np.frombuffer(csv_data, dtype=np.uint8)
+    # The first character of every line after the header starts a row
+    row_starts = np.flatnonzero(raw == ord("\n")) + 1
+    row_starts = row_starts[row_starts + 10 <= raw.size]
+    if row_starts.size == 0:
+        return {column: np.empty(0, dtype=dtype) for column, dtype in COLUMN_DTYPES.items()}
+
+    values = np.loadtxt(BytesIO(csv_data), delimiter=";", skiprows=1,
+                        usecols=(1, 2, 3, 4, 5), ndmin=2)[::-1]
+    dates = raw[row_starts[:len(values), None] + np.arange(10)].view("S10").ravel()
+    return drop_duplicate_bars({
+        "datetime": dates[::-1].astype("datetime64[D]"),
+        "open": values[:, 0].copy(),
+        "high": values[:, 1].copy(),
+        "low": values[:, 2].copy(),
+        "close": values[:, 3].copy(),
+        "volume": values[:, 4].astype(np.int64),
+    })
+
+
+def merge_series(old, new):
+    """
+    Merges two series by date (rows of `new` win), oldest day first. Bars
+    repeated in a series stored before they were dropped on parsing are
+    dropped here too.
+    """
+    if old is None:
+        return new
+    keep = ~np.isin(old["datetime"], new["datetime"])
+    merged = {column: np.concatenate([old[column][keep], new[column]]) for column in COLUMN_DTYPES}
+    order = np.argsort(merged["datetime"], kind="stable")
+    return drop_duplicate_bars({column: values[order] for column, values in merged.items()})
+
+
+def write_series(conn, symbol, series, interval="1day", checked_through=None):
+    "Writes (replacing) the series of one symbol and commits it straight away"
+
+    n_rows = len(series["datetime"])
+    first_date = str(series["datetime"][0]) if n_rows else None
+    last_date = str(series["datetime"][-1]) if n_rows else None
+    blobs = [zlib.compress(np.ascontiguousarray(series[column], dtype=dtype).tobytes())
+             for column, dtype in COLUMN_DTYPES.items()]
+    conn.execute(
+        "INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [symbol, interval, first_date, last_date, n_rows, checked_through,
+         datetime.now(timezone.utc).isoformat(timespec="seconds"), *blobs])
+    conn.commit()
+
+
+def read_series(conn, symbol, interval="1day", columns=tuple(COLUMN_DTYPES)):
+    "Reads the requested columns of one symbol's series, or None if not stored"
+
+    row = conn.execute(
+        f"SELECT {', '.join(columns)} FROM prices WHERE symbol = ? AND interval = ?",
+        [symbol, interval]).fetchone()
+    if row is None:
+        return None
+    return {column: np.frombuffer(zlib.decompress(blob), dtype=COLUMN_DTYPES[column])
+            for column, blob in zip(columns, row)}
+
+
+def coverage(conn, interval="1day"):
+    "Returns {symbol: {first_date, last_date, rows, checked_through}} for the store"
+
+    rows = conn.execute(
+        "SELECT symbol, first_date, last_date, rows, checked_through FROM prices WHERE interval = ?",
+        [interval])
+    return {symbol: {"first_date": first_date, "last_date": last_date,
+                     "rows": n_rows, "checked_through": checked_through}
+            for symbol, first_date, last_date, n_rows, checked_through in rows}
+
+
+def export_stock_prices(conn, output_file="stock_prices.json", tickers=None, interval="1day"):
+    """
+    Writes stock_prices.json ({ticker: {date: close}}, newest day first) one
+    ticker at a time, so the whole history is never held in memory.
+    """
+    if tickers is None:
+        tickers = sorted(coverage(conn, interval))
+    with open(output_file, "w") as file:
+        file.write("{")
+        first = True
+        for ticker in tickers:
+            series = read_series(conn, ticker, interval, columns=("datetime", "close"))
+            if series is None:
+                continue
+            closes = {str(day): str(close) for day, close in
+                      zip(series["datetime"][::-1], series["close"][::-1])}
+            file.write(("" if first else ",") + f"\n    {json.dumps(ticker)}: {json.dumps(closes)}")
+            first = False
+        file.write("\n}\n")
+
+
+def import_cache_dir(cache_dir, path=PRICE_STORE_PATH):
+    """
+    Migration tool: imports every per-URL CSV file of a cache directory such
+    as _cache2 into the price store, keyed by the symbol and interval found
+    in the file name.
+    """
+    conn = open_price_store(path)
+    imported = 0
+    for cache_file in sorted(Path(cache_dir).iterdir()):
+        match = re.search(r"interval=([^_]+)_symbol=(.+?)_start_date", cache_file.name)
+        if match is None:
+            continue
+        interval, symbol = match.group(1), match.group(2).upper()
+        write_series(conn, symbol, csv_to_series(cache_file.read_bytes()), interval)
+        imported += 1
+    conn.close()
+    print(f"Imported {imported} cached series into {path}")
+    return imported
+
+
+if __name__ == "__main__":
+    import_cache_dir(Path(__file__).parent / "_cache2")
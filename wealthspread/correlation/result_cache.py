@@ -0,0 +1,173 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+from wealthspread.correlation.tickers import STOCKS_DETAILS_PATH
+from wealthspread.correlation.market_store import STORE_PATH, CORRELATION_PATH, RETURNS_PATH, ESG_PATH
+from wealthspread.correlation.rolling import SNAPSHOT_DIR, MANIFEST_NAME
+from wealthspread.correlation.factor_model import FACTOR_MODEL_PATH
+
+RESULT_CACHE_PATH = Path(__file__).parent / "result_cache.sqlite"
+# Portfolios whose weights agree to this tolerance share a cached result
+WEIGHT_TOLERANCE = 1e-4
+CACHE_SIZE = 4096
+CACHE_TTL = 24 * 3600
+
+
+def data_version(lookback=None, backend="dense"):
+    """
+    Short fingerprint of the files a suggestion is computed from (their
+    size and modification time), so rebuilding the market data, a snapshot
+    or the factor model invalidates every cached result computed before.
+    """
+    paths = [STOCKS_DETAILS_PATH, STORE_PATH, CORRELATION_PATH, RETURNS_PATH, ESG_PATH]
+    if lookback is not None:
+        paths.append(SNAPSHOT_DIR / MANIFEST_NAME)
+    if backend == "factor":
+        paths.append(FACTOR_MODEL_PATH)
+    stamps = []
+    for path in paths:
+        try:
+            stat = Path(path).stat()
+            stamps.append(f"{Path(path).name}:{stat.st_size}:{stat.st_mtime_ns}")
+        except FileNotFoundError:
+            stamps.append(f"{Path(path).name}:missing")
+    return hashlib.sha1("|".join(stamps).encode()).hexdigest()[:16]
+
+
+def portfolio_key(current_inv, investment_amount, version, lookback=None, backend="dense",
+                  tolerance=WEIGHT_TOLERANCE, max_esg=None, exclude_missing_esg=False):
+    """
+    Cache key of a suggestion request. The suggestion only depends on the
+    weights of the holdings and of the new money in the combined portfolio,
+    so they are normalized to sum to 1 and rounded to `tolerance`: the same
+    holdings in a different dollar amount give the same key.
+    ESG constraints, when set, are part of the key.
+    """
+    total = sum(current_inv.values()) + investment_amount
+    if total <= 0:
+        raise ValueError("The portfolio and investment amount must add up to more than 0")
+    weights = ",".join(f"{ticker}={round(amount / total / tolerance)}"
+                       for ticker, amount in sorted(current_inv.items()))
+    key = f"{version}|{lookback}|{backend}|{weights}|+{round(investment_amount / total / tolerance)}"
+    if max_esg is not None or exclude_missing_esg:
+        key += f"|esg<={max_esg}|{'known' if exclude_missing_esg else 'any'}"
+    return key
+
+
+def open_cache(maxsize=CACHE_SIZE, ttl=CACHE_TTL, path=None):
+    """
+    Creates a result cache: an in-process LRU of at most `maxsize` entries
+    that expire `ttl` seconds after they were computed, backed by an
+    optional SQLite file at `path` that survives restarts.
+    """
+    conn = None
+    if path is not None:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, created REAL)")
+        conn.execute("DELETE FROM results WHERE created < ?", (time.time() - ttl,))
+        conn.commit()
+    return {
+        "entries": OrderedDict(),
+        "maxsize": maxsize,
+        "ttl": ttl,
+        "conn": conn,
+        "hits": 0,
+        "disk_hits": 0,
+        "misses": 0,
+        "evictions": 0,
+    }
+
+
+def close_cache(cache):
+    "Closes the on-disk tier, if any"
+
+    if cache["conn"] is not None:
+        cache["conn"].close()
+        cache["conn"] = None
+
+
+def cache_get(cache, key):
+    """
+    Returns the cached value of `key`, or None. Values found on disk are
+    promoted to memory; expired entries count as misses.
+    """
+    now = time.time()
+    entry = cache["entries"].get(key)
+    if entry is not None:
+        created, value = entry
+        if now - created <= cache["ttl"]:
+            cache["entries"].move_to_end(key)
+            cache["hits"] += 1
+            return value
+        del cache["entries"][key]
+    if cache["conn"] is not None:
+        row = cache["conn"].execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+        if row is not None and now - row[1] <= cache["ttl"]:
+            value = json.loads(row[0])
+            remember(cache, key, value, row[1])
+            cache["disk_hits"] += 1
+            return value
+    cache["misses"] += 1
+    return None
+
+
+def remember(cache, key, value, created):
+    "Adds an entry to the in-process LRU, evicting the least recently used beyond maxsize"
+
+    cache["entries"][key] = (created, value)
+    cache["entries"].move_to_end(key)
+    while len(cache["entries"]) > cache["maxsize"]:
+        cache["entries"].popitem(last=False)
+        cache["evictions"] += 1
+
+
+def cache_put(cache, key, value):
+    "Stores a JSON-able value in memory and, if enabled, on disk"
+
+    created = time.time()
+    remember(cache, key, value, created)
+    if cache["conn"] is not None:
+        cache["conn"].execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                              (key, json.dumps(value), created))
+        cache["conn"].commit()
+
+
+def cache_stats(cache):
+    "Hit/miss counters and current size of a result cache"
+
+    lookups = cache["hits"] + cache["disk_hits"] + cache["misses"]
+    return {
+        "hits": cache["hits"],
+        "disk_hits": cache["disk_hits"],
+        "misses": cache["misses"],
+        "evictions": cache["evictions"],
+        "size": len(cache["entries"]),
+        "hit_rate": round((cache["hits"] + cache["disk_hits"]) / lookups, 4) if lookups else 0.0,
+    }
+
+
+def cached_suggest_stocks_sharpe(cache, current_inv, investment_amount, lookback=None, backend="dense",
+                                 version=None, max_esg=None, exclude_missing_esg=False):
+    """
+    suggest_stocks_sharpe through a result cache. `version` defaults to
+    data_version() of the lookback and backend; pass it in when many
+    requests are answered from the same data.
+    Output: the suggest_stocks_sharpe list
+    """
+    from wealthspread.correlation.portfolio import suggest_stocks_sharpe
+
+    if version is None:
+        version = data_version(lookback, backend)
+    key = portfolio_key(current_inv, investment_amount, version, lookback, backend,
+                        max_esg=max_esg, exclude_missing_esg=exclude_missing_esg)
+    result = cache_get(cache, key)
+    if result is None:
+        result = suggest_stocks_sharpe(current_inv, investment_amount, lookback, backend, max_esg,
+                                       exclude_missing_esg)
+        result = [result[0], result[1], result[2], float(result[3]), float(result[4])]
+        cache_put(cache, key, result)
+    suggestion = tuple(result[0]) if isinstance(result[0], list) else result[0]
+    return [suggestion, *result[1:]]
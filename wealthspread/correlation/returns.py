@@ -0,0 +1,118 @@
+import numpy as np
+from pathlib import Path
+from wealthspread.correlation.price_store import PRICE_STORE_PATH, open_price_store, read_series, coverage
+
+RETURNS_STORE_PATH = Path(__file__).parent / "returns.npz"
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+def price_matrix(tickers=None, store_path=PRICE_STORE_PATH, interval="1day"):
+    """
+    Reads the closing prices of every ticker from the price store into one
+    date-aligned matrix.
+    Output: (dates (T,) datetime64[D], prices (T, N) with NaN on days a
+    stock has no price), oldest day first
+    """
+    conn = open_price_store(store_path)
+    if tickers is None:
+        tickers = sorted(coverage(conn, interval))
+    series = [read_series(conn, ticker, interval, columns=("datetime", "close")) for ticker in tickers]
+    conn.close()
+
+    stored = [s for s in series if s is not None]
+    dates = np.unique(np.concatenate([s["datetime"] for s in stored])) if stored else np.empty(0, "datetime64[D]")
+    prices = np.full((len(dates), len(tickers)), np.nan)
+    for j, s in enumerate(series):
+        if s is not None:
+            prices[np.searchsorted(dates, s["datetime"]), j] = s["close"]
+    return dates, prices
+
+
+def compute_returns(prices):
+    """
+    Computes daily simple and log returns from a (T, N) price matrix.
+    Each return is taken from the stock's previous available price, so a
+    missing day does not also blank out the day after it.
+    Output: (simple (T, N), log (T, N)), NaN on the first row and wherever
+    the stock has no price
+    """
+    present = ~np.isnan(prices)
+    # Row index of the latest available price up to and including each day
+    last_seen = np.where(present, np.arange(len(prices))[:, None], -1)
+    np.maximum.accumulate(last_seen, axis=0, out=last_seen)
+
+    previous = np.full(prices.shape, np.nan)
+    previous[1:] = np.take_along_axis(prices, np.maximum(last_seen[:-1], 0), axis=0)
+    previous[1:][last_seen[:-1] < 0] = np.nan
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        simple = prices / previous - 1
+    simple[~present] = np.nan
+    return simple, np.log1p(simple)
+
+
+def build_returns(dates, prices, tickers):
+    "Bundles the aligned price matrix with its returns and missing-day mask"
+
+    simple, log = compute_returns(prices)
+    return {
+        "tickers": np.array(tickers),
+        "dates": np.asarray(dates, dtype="datetime64[D]"),
+        "prices": prices,
+        "simple": simple,
+        "log": log,
+        "present": ~np.isnan(prices),
+    }
+
+
+def build_returns_store(output_path=RETURNS_STORE_PATH, store_path=PRICE_STORE_PATH, tickers=None):
+    "Builds the aligned price and returns matrices from the price store and saves them"
+
+    if tickers is None:
+        conn = open_price_store(store_path)
+        tickers = sorted(coverage(conn))
+        conn.close()
+    dates, prices = price_matrix(tickers, store_path)
+    returns = build_returns(dates, prices, tickers)
+    # Left uncompressed, like the market store, so loading is a straight copy
+    np.savez(output_path, **returns)
+    print(f"Saved {len(dates)} days of returns for {len(tickers)} tickers to {output_path}")
+    return returns
+
+
+def load_returns_store(path=RETURNS_STORE_PATH):
+    """
+    Loads the returns store as a dictionary of arrays:
+        tickers (N,), dates (T,), prices (T, N), simple (T, N), log (T, N)
+        and present (T, N), False on days a stock has no price.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def geometric_means(returns, years=5):
+    """
+    Annual geometric mean return of every stock over its full history,
+    (end price / start price) ** (1 / years) - 1, from the log returns.
+    NaN for stocks with fewer than two prices.
+    """
+    total = np.nansum(returns["log"], axis=0)
+    total[returns["present"].sum(axis=0) < 2] = np.nan
+    return np.expm1(total / years)
+
+
+def volatilities(returns, periods_per_year=TRADING_DAYS_PER_YEAR):
+    "Annualized volatility (standard deviation of the daily log returns) of every stock"
+
+    log = returns["log"]
+    n_returns = (~np.isnan(log)).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nansum(log, axis=0) / n_returns
+        var = np.nansum((log - mean) ** 2, axis=0) / (n_returns - 1)
+    var[n_returns < 2] = np.nan
+    return np.sqrt(var * periods_per_year)
+
+
+if __name__ == "__main__":
+    build_returns_store()
@@ -0,0 +1,164 @@
+import json
+import numpy as np
+from pathlib import Path
+from wealthspread.correlation.returns import RETURNS_STORE_PATH, load_returns_store
+from wealthspread.correlation.comoments import correlation_from_sums
+
+SNAPSHOT_DIR = Path(__file__).parent / "snapshots"
+MANIFEST_NAME = "manifest.json"
+
+# Lookback windows in calendar days: a window holds the dates less than
+# `days` before its last date, however many rows the date axis has there
+LOOKBACKS = {"3m": 91, "1y": 365, "5y": 1826}
+
+
+def prepare_returns(returns, dtype=np.float64):
+    """
+    Splits a (T, N) returns array (NaN for missing days) into the arrays the
+    window sums are built from: centred returns x, their squares x2 and the
+    present mask p, all zero on missing days.
+    """
+    returns = np.asarray(returns)
+    present = ~np.isnan(returns)
+    # Centring each stock keeps the add/subtract updates from losing precision
+    shift = np.nansum(returns, axis=0) / np.maximum(present.sum(axis=0), 1)
+    x = np.where(present, returns - shift, 0.0).astype(dtype)
+    return x, x * x, present.astype(dtype)
+
+
+def empty_sums(n_stocks, dtype=np.float64):
+    "Creates zeroed window sums for n_stocks"
+
+    return {name: np.zeros((n_stocks, n_stocks), dtype=dtype) for name in ("count", "sx", "sxx", "sxy")}
+
+
+def add_days(sums, prepared, rows, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) the days in `rows` to the window
+    sums, with one matrix product per sum for the whole block of days.
+    """
+    x, x2, p = (array[rows] for array in prepared)
+    if len(p) == 0:
+        return sums
+    sums["count"] += sign * (p.T @ p)
+    sums["sx"] += sign * (x.T @ p)
+    sums["sxx"] += sign * (x2.T @ p)
+    sums["sxy"] += sign * (x.T @ x)
+    return sums
+
+
+def sums_correlation(sums, min_overlap=2):
+    "Returns (corr, counts) for the current window sums"
+
+    corr = correlation_from_sums(sums["count"], sums["sx"], sums["sx"].T,
+                                 sums["sxx"], sums["sxx"].T, sums["sxy"], min_overlap)
+    return corr, np.rint(sums["count"]).astype(np.int64)
+
+
+def rolling_correlation(returns, window, ends, min_overlap=2, dtype=np.float64):
+    """
+    Yields (end, corr, counts) for the `window`-day correlation matrix ending
+    just before each row index in `ends` (ascending). Moving from one end to
+    the next only adds the days entering the window and subtracts the days
+    leaving it, rather than rebuilding the window from scratch.
+    """
+    prepared = prepare_returns(returns, dtype)
+    sums = empty_sums(prepared[0].shape[1], dtype)
+    lo = hi = 0
+    for end in ends:
+        new_lo = max(0, end - window)
+        if new_lo >= hi:
+            # No overlap with the previous window, start again
+            sums = add_days(empty_sums(prepared[0].shape[1], dtype), prepared, slice(new_lo, end))
+        else:
+            add_days(sums, prepared, slice(hi, end))
+            add_days(sums, prepared, slice(lo, new_lo), sign=-1)
+        lo, hi = new_lo, end
+        yield (end, *sums_correlation(sums, min_overlap))
+
+
+def lookback_starts(dates, lookbacks=LOOKBACKS):
+    """
+    The first row of every lookback window ending on the last of `dates`
+    (ascending): the first date less than `days` calendar days before it.
+    Output: {label: row}
+    """
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    return {label: int(np.searchsorted(dates, dates[-1] - np.timedelta64(days, "D"), side="right"))
+            for label, days in lookbacks.items()}
+
+
+def lookback_correlations(returns, lookbacks=LOOKBACKS, min_overlap=2, dtype=np.float64, dates=None):
+    """
+    Correlation matrices over the last `days` of the returns for every
+    lookback in one pass: the windows all end on the latest day, so each
+    longer window extends the sums of the shorter one by its older days.
+    With the `dates` of the rows, the windows are selected by calendar date
+    (see lookback_starts), otherwise each row counts as one day.
+    Output: {label: (corr, counts)}
+    """
+    prepared = prepare_returns(returns, dtype)
+    n_days = prepared[0].shape[0]
+    if dates is None:
+        starts = {label: max(0, n_days - days) for label, days in lookbacks.items()}
+    else:
+        starts = lookback_starts(dates, lookbacks)
+    sums = empty_sums(prepared[0].shape[1], dtype)
+    start = n_days
+    results = {}
+    for label, new_start in sorted(starts.items(), key=lambda item: -item[1]):
+        add_days(sums, prepared, slice(new_start, start))
+        start = new_start
+        results[label] = sums_correlation(sums, min_overlap)
+    return results
+
+
+def build_snapshots(returns_path=RETURNS_STORE_PATH, snapshot_dir=SNAPSHOT_DIR,
+                    lookbacks=LOOKBACKS, min_overlap=20):
+    """
+    Computes the correlation matrix of every lookback from the returns store
+    and saves each one as a snapshot versioned by the last date of returns,
+    e.g. snapshots/corr_1y_2025-01-31.npz, along with the first date it
+    covers. The manifest points each lookback at its latest snapshot.
+    """
+    returns = load_returns_store(returns_path)
+    version = str(returns["dates"][-1])
+    starts = lookback_starts(returns["dates"], lookbacks)
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest_path = snapshot_dir / MANIFEST_NAME
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    correlations = lookback_correlations(returns["simple"], lookbacks, min_overlap, dates=returns["dates"])
+    for label, (corr, counts) in correlations.items():
+        file_name = f"corr_{label}_{version}.npz"
+        first_date = str(returns["dates"][starts[label]])
+        np.savez(snapshot_dir / file_name, tickers=returns["tickers"], corr=corr, counts=counts,
+                 days=np.array(lookbacks[label]), first_date=np.array(first_date), version=np.array(version))
+        manifest[label] = {"file": file_name, "version": version, "days": lookbacks[label],
+                           "first_date": first_date}
+    manifest_path.write_text(json.dumps(manifest, indent=4))
+    print(f"Saved {', '.join(lookbacks)} correlation snapshots for {version} to {snapshot_dir}")
+    return manifest
+
+
+def load_snapshot(lookback, snapshot_dir=SNAPSHOT_DIR, version=None):
+    """
+    Loads a correlation snapshot as a dictionary of arrays (tickers, corr,
+    counts, days, first_date, version): the latest one for the lookback unless a
+    `version` (last date of returns) is given.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    if version is None:
+        manifest = json.loads((snapshot_dir / MANIFEST_NAME).read_text())
+        if lookback not in manifest:
+            raise KeyError(f"No correlation snapshot for lookback {lookback!r}, available: {sorted(manifest)}")
+        file_name = manifest[lookback]["file"]
+    else:
+        file_name = f"corr_{lookback}_{version}.npz"
+    with np.load(snapshot_dir / file_name, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+if __name__ == "__main__":
+    build_snapshots()
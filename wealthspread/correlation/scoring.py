@@ -0,0 +1,340 @@
+import numpy as np
+
+
+def portfolio_weights(current_amounts, investment_amount):
+    """
+    Returns the weights of the current holdings and of the new investment
+    once the new money has been added to the portfolio.
+    """
+    current_amounts = np.asarray(current_amounts, dtype=np.float64)
+    total = current_amounts.sum() + investment_amount
+    return current_amounts / total, investment_amount / total
+
+
+def rated_esg(esg, held_idx, held_w):
+    """
+    The ESG-weighted sum and the total weight of the holdings that have ESG
+    data. Holdings without it are left out rather than counted as no risk.
+    Output: (sum of weight * ESG, sum of weight)
+    """
+    held_esg = esg[np.asarray(held_idx, dtype=np.intp)]
+    rated = ~np.isnan(held_esg)
+    return held_w[rated] @ held_esg[rated], held_w[rated].sum()
+
+
+def current_esg(esg, held_idx, current_amounts):
+    "Weighted ESG risk of the current holdings that have ESG data, NaN if none has any"
+
+    held_sum, held_weight = rated_esg(esg, held_idx, np.asarray(current_amounts, dtype=np.float64))
+    return held_sum / held_weight if held_weight > 0 else np.nan
+
+
+def portfolio_esg(esg, held_idx, current_amounts, investment_amount, candidates):
+    """
+    Weighted ESG risk of the portfolio after `investment_amount` is added
+    to each candidate, for every candidate in one pass. `esg` is the (N,)
+    total ESG array aligned with the ticker index, NaN where a stock has no
+    ESG data. `candidates` are positions in the ticker index, or (M, 2)
+    pairs of positions splitting the money evenly.
+    Holdings without ESG data are left out of the average; a candidate
+    without it gives NaN, since the risk of the new money is unknown.
+    """
+    held_w, new_w = portfolio_weights(current_amounts, investment_amount)
+    held_sum, held_weight = rated_esg(esg, held_idx, held_w)
+    new_esg = esg[candidates]
+    if new_esg.ndim == 2:
+        new_esg = new_esg.mean(axis=1)
+    return (held_sum + new_w * new_esg) / (held_weight + new_w)
+
+
+def esg_candidates(esg, held_idx, current_amounts, investment_amount, candidates=None,
+                   max_esg=None, exclude_missing_esg=False):
+    """
+    Masks out the candidates that break the ESG constraints, before any
+    of them is scored: a new portfolio ESG risk above `max_esg`, or no
+    ESG data at all with `exclude_missing_esg`. A candidate without ESG
+    data never meets `max_esg`, as its risk is unknown.
+    Returns:
+        (candidates that pass, new portfolio ESG of each of them)
+    """
+    held_idx = np.asarray(held_idx, dtype=np.intp)
+    if candidates is None:
+        candidates = np.setdiff1d(np.arange(len(esg)), held_idx, assume_unique=True)
+    candidates = np.asarray(candidates, dtype=np.intp)
+    new_esg = portfolio_esg(esg, held_idx, current_amounts, investment_amount, candidates)
+    keep = np.ones(len(candidates), dtype=bool)
+    if exclude_missing_esg or max_esg is not None:
+        keep &= ~np.isnan(esg[candidates])
+    if max_esg is not None:
+        keep &= new_esg <= max_esg
+    return candidates[keep], new_esg[keep]
+
+
+def score_candidates(corr, returns, held_idx, current_amounts, investment_amount,
+                     candidates=None):
+    """
+    Scores every candidate stock at once for a portfolio that adds
+    `investment_amount` to a single new stock.
+
+    Inputs:
+        corr: (N, N) correlation array aligned with the ticker index, or
+            a factor model {"loadings" (N, k), "residual" (N,)} (see
+            factor_model.py) to score in O(N * k)
+        returns: (N,) array of scaled geometric mean returns
+        held_idx: integer positions of the current holdings
+        current_amounts: amounts invested in each current holding
+        investment_amount: new money to be invested
+        candidates: integer positions to score (defaults to every stock
+            not already held)
+
+    Returns:
+        (candidates, sharpe, mean_corr, port_return) where each array has
+        one entry per candidate, in the same order as `candidates`.
+    """
+    held_idx = np.asarray(held_idx, dtype=np.intp)
+    if candidates is None:
+        candidates = np.setdiff1d(np.arange(len(returns)), held_idx,
+                                  assume_unique=True)
+    candidates = np.asarray(candidates, dtype=np.intp)
+
+    held_w, new_w = portfolio_weights(current_amounts, investment_amount)
+    n_stocks = len(held_idx) + 1
+
+    # w'Cw split into the part shared by every candidate and the part
+    # that depends on the candidate's correlation with the holdings
+    if isinstance(corr, dict):
+        base_quad, cross, self_corr = factor_terms(corr, held_idx, held_w, candidates)
+    else:
+        held_corr = corr[np.ix_(held_idx, held_idx)]
+        base_quad = held_w @ held_corr @ held_w
+        cross = corr[np.ix_(candidates, held_idx)] @ held_w
+        self_corr = corr[candidates, candidates]
+    quad = base_quad + 2 * new_w * cross + new_w ** 2 * self_corr
+
+    weight_sum = held_w.sum() + new_w
+    mean_corr = quad / weight_sum / n_stocks
+
+    port_return = held_w @ returns[held_idx] + new_w * returns[candidates]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe = port_return / mean_corr
+
+    return candidates, sharpe, mean_corr, port_return
+
+
+def factor_terms(model, held_idx, held_w, candidates):
+    """
+    The correlation terms of score_candidates under a factor model
+    (corr = loadings @ loadings.T + diag(residual)), without forming any
+    part of the correlation matrix. Candidates are never held, so the
+    residual only enters the holdings' own term.
+    """
+    loadings, residual = model["loadings"], model["residual"]
+    exposure = loadings[held_idx].T @ held_w
+    base_quad = exposure @ exposure + residual[held_idx] @ held_w ** 2
+    cross = loadings[candidates] @ exposure
+    self_corr = (loadings[candidates] ** 2).sum(axis=1) + residual[candidates]
+    return base_quad, cross, self_corr
+
+
+def top_candidates(sharpe, k):
+    """
+    Returns the positions of the `k` candidates with the largest absolute
+    sharpe ratio, best first, skipping candidates that do not beat zero.
+    Uses a partial sort so only the top `k` entries are ever ordered.
+    Returns no candidates for `k <= 0`.
+    """
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    magnitude = np.abs(sharpe)
+    magnitude = np.where(np.isnan(magnitude), -np.inf, magnitude)
+    if k < len(magnitude):
+        top = np.argpartition(-magnitude, k - 1)[:k]
+        # argpartition may cut a tie at the k-th value, so keep all of them
+        top = np.flatnonzero(magnitude >= magnitude[top].min())
+    else:
+        top = np.arange(len(magnitude))
+    top = top[magnitude[top] > 0]
+    top = top[np.lexsort((top, -magnitude[top]))]
+    return top[:k]
+
+
+def pair_terms(corr, returns, held_idx, current_amounts, investment_amount, esg=None,
+               max_esg=None, exclude_missing_esg=False):
+    """
+    Splits the pair-addition score into the parts shared by every pair and
+    the parts that depend on a single ticker, so that for candidates a, b:
+
+        w'Cw   = base_quad + (single_quad[a] + single_quad[b]) + pair_weight * C[a, b]
+        return = base_return + (single_return[a] + single_return[b])
+        mean_corr = w'Cw / scale
+        ESG    = (base_esg + (single_esg[a] + single_esg[b])) / esg_weight
+
+    Also returns an upper bound on |sharpe| of every pair containing each
+    candidate (inf where no bound can be given).
+    With an `esg` array, candidates without ESG data are dropped if
+    `exclude_missing_esg` or `max_esg` is given, and so are candidates that
+    break `max_esg` with any partner; the pairs left above `max_esg` are
+    masked when scored. The ESG is averaged as in portfolio_esg.
+    """
+    held_idx = np.asarray(held_idx, dtype=np.intp)
+    candidates = np.setdiff1d(np.arange(len(returns)), held_idx, assume_unique=True)
+
+    held_w, new_w = portfolio_weights(current_amounts, investment_amount)
+    half_w = new_w / 2
+
+    esg_limit = np.inf
+    if esg is None:
+        base_esg, esg_weight, single_esg = 0.0, 1.0, np.zeros(len(candidates))
+    else:
+        if exclude_missing_esg or max_esg is not None:
+            candidates = candidates[~np.isnan(esg[candidates])]
+        base_esg, held_weight = rated_esg(esg, held_idx, held_w)
+        esg_weight = held_weight + new_w
+        single_esg = half_w * esg[candidates]
+        if max_esg is not None and len(candidates):
+            esg_limit = max_esg * esg_weight - base_esg
+            feasible = single_esg + single_esg.min() <= esg_limit
+            candidates, single_esg = candidates[feasible], single_esg[feasible]
+    n_stocks = len(held_idx) + 2
+    scale = (held_w.sum() + new_w) * n_stocks
+
+    base_quad = held_w @ corr[np.ix_(held_idx, held_idx)] @ held_w
+    base_return = held_w @ returns[held_idx]
+    cand_corr = corr[np.ix_(candidates, candidates)]
+    single_quad = (2 * half_w * (corr[np.ix_(candidates, held_idx)] @ held_w)
+                   + half_w ** 2 * np.diag(cand_corr))
+    single_return = half_w * returns[candidates]
+    pair_weight = 2 * half_w ** 2
+
+    bound = np.full(len(candidates), np.inf)
+    if len(candidates) > 1:
+        off_diag = cand_corr.copy()
+        np.fill_diagonal(off_diag, np.inf)
+        quad_floor = (base_quad + single_quad + single_quad.min()
+                      + pair_weight * off_diag.min(axis=1))
+        return_ceiling = np.maximum(
+            np.abs(base_return + single_return + single_return.max()),
+            np.abs(base_return + single_return + single_return.min()))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bound = np.where(quad_floor > 0, return_ceiling * scale / quad_floor, np.inf)
+
+    return {
+        "candidates": candidates,
+        "cand_corr": cand_corr,
+        "base_quad": base_quad,
+        "base_return": base_return,
+        "single_quad": single_quad,
+        "single_return": single_return,
+        "pair_weight": pair_weight,
+        "scale": scale,
+        "bound": bound,
+        "base_esg": base_esg,
+        "esg_weight": esg_weight,
+        "single_esg": single_esg,
+        "esg_limit": esg_limit,
+    }
+
+
+def pair_values(terms, first, second):
+    "Returns (sharpe, mean_corr) for pairs given as positions in the candidates"
+    quad = (terms["base_quad"]
+            + (terms["single_quad"][first] + terms["single_quad"][second])
+            + terms["pair_weight"] * terms["cand_corr"][first, second])
+    mean_corr = quad / terms["scale"]
+    port_return = terms["base_return"] + (terms["single_return"][first]
+                                          + terms["single_return"][second])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return port_return / mean_corr, mean_corr
+
+
+def pair_esg(terms, first, second):
+    "Returns the new portfolio ESG of pairs given as positions in the candidates"
+    return (terms["base_esg"] + (terms["single_esg"][first] + terms["single_esg"][second])) / terms["esg_weight"]
+
+
+def score_pairs(corr, returns, held_idx, current_amounts, investment_amount, esg=None,
+                max_esg=None, exclude_missing_esg=False):
+    """
+    Scores every pair of candidates, each receiving half of
+    `investment_amount`, in `combinations` order, leaving out the pairs
+    that break the ESG constraints (see pair_terms).
+
+    Returns:
+        (first, second, sharpe, mean_corr) arrays, one entry per pair, with
+        `first` and `second` as positions in the ticker index.
+    """
+    terms = pair_terms(corr, returns, held_idx, current_amounts, investment_amount, esg,
+                       max_esg, exclude_missing_esg)
+    first, second = np.triu_indices(len(terms["candidates"]), k=1)
+    if np.isfinite(terms["esg_limit"]):
+        keep = terms["single_esg"][first] + terms["single_esg"][second] <= terms["esg_limit"]
+        first, second = first[keep], second[keep]
+    sharpe, mean_corr = pair_values(terms, first, second)
+    return terms["candidates"][first], terms["candidates"][second], sharpe, mean_corr
+
+
+def top_pair_additions(corr, returns, held_idx, current_amounts, investment_amount,
+                       k=1, block_size=64, esg=None, max_esg=None, exclude_missing_esg=False):
+    """
+    Finds the `k` pairs of stocks that, each receiving half of
+    `investment_amount`, give the portfolios with the largest absolute
+    sharpe ratio.
+
+    The search is exact. Every candidate row gets an upper bound on the
+    score of any pair it belongs to (see `pair_terms`), and rows are scored
+    against every other candidate at once, in order of decreasing bound,
+    until no remaining bound can beat the k-th best pair found so far.
+    Ties go to the pair that comes first in `combinations` order. Pairs
+    breaking the ESG constraints (see pair_terms) are masked before ranking.
+
+    Returns:
+        A list of up to `k` tuples (first, second, sharpe, mean_corr), best
+        first, with `first < second` as positions in the ticker index.
+        Pairs that do not beat zero are left out, and `k <= 0` finds none.
+    """
+    if k <= 0:
+        return []
+    terms = pair_terms(corr, returns, held_idx, current_amounts, investment_amount, esg,
+                       max_esg, exclude_missing_esg)
+    candidates, bound = terms["candidates"], terms["bound"]
+    constrained = np.isfinite(terms["esg_limit"])
+    n_cand = len(candidates)
+    if n_cand < 2:
+        return []
+
+    order = np.argsort(-bound, kind="stable")
+    found = {}
+    threshold = 0.0
+    for start in range(0, n_cand, block_size):
+        rows = order[start:start + block_size]
+        if bound[rows[0]] < threshold:
+            break
+
+        # A pair shows up twice when both of its rows are in the block
+        first = np.minimum(rows[:, None], np.arange(n_cand)[None, :])
+        second = np.maximum(rows[:, None], np.arange(n_cand)[None, :])
+        sharpe, _ = pair_values(terms, first, second)
+        score = np.abs(sharpe)
+        score[first == second] = -np.inf
+        if constrained:
+            score[terms["single_esg"][first] + terms["single_esg"][second] > terms["esg_limit"]] = -np.inf
+        score = np.where(np.isnan(score), -np.inf, score).ravel()
+
+        keep = min(2 * k, len(score))
+        cut = np.partition(score, len(score) - keep)[len(score) - keep]
+        for flat in np.flatnonzero((score >= cut) & (score > 0) & (score >= threshold)):
+            found[(int(first.flat[flat]), int(second.flat[flat]))] = score[flat]
+
+        if len(found) >= k:
+            ranked = sorted(found.items(), key=lambda item: (-item[1], item[0]))[:k]
+            found = dict(ranked)
+            threshold = ranked[-1][1]
+
+    ranked = sorted(found.items(), key=lambda item: (-item[1], item[0]))[:k]
+    results = []
+    for (first, second), _ in ranked:
+        sharpe, mean_corr = pair_values(terms, first, second)
+        results.append((int(candidates[first]), int(candidates[second]), sharpe, mean_corr))
+    return results
+
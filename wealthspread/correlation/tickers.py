@@ -0,0 +1,16 @@
+import json
+from functools import lru_cache
+from pathlib import Path
+
+STOCKS_DETAILS_PATH = Path(__file__).parent / "stocks_details.json"
+
+
+@lru_cache(maxsize=None)
+def all_stocks(path=STOCKS_DETAILS_PATH):
+    """
+    Returns the ticker universe from stocks_details.json as a tuple. The file
+    is found relative to the package, not the working directory, and is
+    only read the first time it is asked for.
+    """
+    with open(path, "r") as ticker_file:
+        return tuple(json.load(ticker_file))
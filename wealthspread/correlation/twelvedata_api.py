@@ -1,32 +1,36 @@
 import requests
-import csv
 import json
-from io import StringIO
 from pathlib import Path
-import os
+import re
 import time
+from datetime import date, timedelta
+from wealthspread.correlation.tickers import all_stocks
+from wealthspread.correlation.price_store import (PRICE_STORE_PATH, open_price_store, rows_to_series,
+                                                  csv_to_series, merge_series, write_series, read_series,
+                                                  coverage, export_stock_prices)
 ALLOWED_CHARS = "abcdefghijklmnopqrstuvwxyz1234567890%+,^=._"
 
 # ******** Paste API Key below which has been sent via email ******
 API_KEY = ""
 
+API_URL = "https://api.twelvedata.com/time_series"
+START_DATE = "2020-02-01 02:01:00"
+END_DATE = "2025-02-01 02:01:00"
+
+# Each symbol in a request costs one API credit; set this to the plan's quota
+CREDITS_PER_MINUTE = 8
+# Twelve Data accepts up to 120 symbols in one time_series request
+MAX_BATCH_SIZE = 120
+
 
 def tickers_list_creator():
     "Creates the list of tickers which will be used to "
     "iterate over when running the API"
 
-    tickers_list = []
-    tickers_file = "stocks_details.json"
-    with open(tickers_file,"r") as ticker_file:
-        tickers = json.load(ticker_file)
-        for key, val in tickers.items():
-            tickers_list.append(key) 
-    return tickers_list
+    return list(all_stocks())
 
-# Creates the CACHE
+# Legacy per-URL CACHE, see price_store.import_cache_dir to migrate it
 CACHE_DIR = Path(__file__).parent / "_cache2"
-# Cache dictionary to store all API responses for multiple tickers
-cache = {}
 
 
 def url_to_cache_key(url: str) -> str:
@@ -45,7 +49,7 @@ def url_to_cache_key(url: str) -> str:
     """
 
     lowered = url.lower()
-    removed_lowered = lowered.lstrip("http(s)://")
+    removed_lowered = re.sub(r"^https?://", "", lowered)
     updated_url = ""
     for charac in removed_lowered:
         if charac not in ALLOWED_CHARS:
@@ -55,58 +59,153 @@ def url_to_cache_key(url: str) -> str:
     return updated_url
 
 
-def fetch_and_cache(tickers=None):
-    "Fetches the data via API and cache's it"
-    
-    if tickers == None:
+def new_token_bucket(credits_per_minute):
+    """
+    Creates a token bucket holding up to a minute's worth of API credits,
+    refilled continuously at the plan's per-minute rate.
+    """
+    return {
+        "capacity": float(credits_per_minute),
+        "tokens": float(credits_per_minute),
+        "rate": credits_per_minute / 60,
+        "updated": time.monotonic(),
+    }
+
+
+def wait_for_tokens(bucket, n_tokens, sleep=time.sleep):
+    "Blocks until `n_tokens` credits are available, then takes them"
+
+    if n_tokens > bucket["capacity"]:
+        raise ValueError(f"a request of {n_tokens} credits exceeds the quota of {bucket['capacity']:.0f}")
+    while True:
+        now = time.monotonic()
+        bucket["tokens"] = min(bucket["capacity"],
+                               bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+        bucket["updated"] = now
+        if bucket["tokens"] >= n_tokens:
+            bucket["tokens"] -= n_tokens
+            return
+        sleep((n_tokens - bucket["tokens"]) / bucket["rate"])
+
+
+def fetch_batch(tickers, session, api_url=API_URL, start_date=START_DATE, end_date=END_DATE):
+    """
+    Fetches the daily time series of several tickers with one multi-symbol
+    request. Returns {ticker: series of typed column arrays} for every ticker
+    that came back ok.
+    """
+    response = session.get(api_url, params={
+        "apikey": API_KEY,
+        "interval": "1day",
+        "symbol": ",".join(tickers),
+        "start_date": start_date,
+        "end_date": end_date,
+    })
+    response.raise_for_status()
+    payload = response.json()
+    # A single symbol is returned unwrapped, several are keyed by symbol
+    if len(tickers) == 1:
+        payload = {tickers[0]: payload}
+
+    results = {}
+    for ticker in tickers:
+        series = payload.get(ticker, {})
+        if series.get("status") == "ok":
+            results[ticker] = rows_to_series(series["values"])
+        else:
+            print(f"No data for {ticker}: {series.get('message', 'missing from response')}")
+    return results
+
+
+def fetch_and_cache(tickers=None, api_url=API_URL, store_path=PRICE_STORE_PATH,
+                    credits_per_minute=CREDITS_PER_MINUTE, batch_size=MAX_BATCH_SIZE,
+                    output_file="stock_prices.json"):
+    """
+    Fetches the data via API and cache's it in the price store.
+
+    Tickers already in the store are skipped without any delay. The rest
+    are fetched in multi-symbol batches, paced by a token bucket so the
+    plan's per-minute credit quota (one credit per symbol) is never
+    exceeded, and each one is written to the store as soon as it arrives.
+    stock_prices.json is then exported from the store.
+    """
+    if tickers is None:
+        tickers = tickers_list_creator()
+    conn = open_price_store(store_path)
+    stored = coverage(conn)
+
+    missing = [ticker for ticker in tickers if ticker not in stored]
+    print(f"{len(tickers) - len(missing)} tickers were already fetched and cached previously")
+
+    batch_size = min(batch_size, credits_per_minute)
+    bucket = new_token_bucket(credits_per_minute)
+    with requests.Session() as session:
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            wait_for_tokens(bucket, len(batch))
+            for ticker, series in fetch_batch(batch, session, api_url).items():
+                write_series(conn, ticker, series, checked_through=END_DATE[:10])
+            print(f"Fetched and cached {min(start + batch_size, len(missing))} of {len(missing)} tickers")
+
+    export_stock_prices(conn, output_file, tickers)
+    conn.close()
+
+
+def refresh_prices(tickers=None, end_date=None, api_url=API_URL, store_path=PRICE_STORE_PATH,
+                   credits_per_minute=CREDITS_PER_MINUTE, batch_size=MAX_BATCH_SIZE,
+                   output_file="stock_prices.json"):
+    """
+    Incrementally refreshes the stored price history up to `end_date`
+    (default: today).
+
+    For each ticker, only the days after the last stored date are
+    requested. Tickers that share the same missing range are fetched
+    together in multi-symbol batches; tickers not in the store get the full
+    history from START_DATE. New rows are merged into the stored series,
+    whose coverage (first/last date, rows, date checked through) is kept
+    alongside it in the store.
+    """
+    if tickers is None:
         tickers = tickers_list_creator()
-        CACHE_DIR.mkdir(exist_ok=True)
-        cache = {} 
-        for ticker in tickers: 
-            time.sleep(10)
-            updated_url = url_to_cache_key(f"https://api.twelvedata.com/time_series?apikey={API_KEY}&interval=1day&symbol={ticker}&start_date=2020-02-01 02:01:00&end_date=2025-02-01 02:01:00&format=CSV")
-            new_path = os.path.join(CACHE_DIR, updated_url)
-            
-            if os.path.exists(new_path):
-                with Path(new_path).open("r") as f:
-                    content = f.read()
-                    print(f"Data for {ticker} was already fetched and cached previously")
-                    data_dict = parse_csv_to_dict(content)
-                    cache[ticker] = data_dict  # Save the parsed dictionary in cache
-    
-            else:
-                response = requests.get(f"https://api.twelvedata.com/time_series?apikey={API_KEY}&interval=1day&symbol={ticker}&start_date=2020-02-01 02:01:00&end_date=2025-02-01 02:01:00&format=CSV")
-                if response.status_code == 200:
-                    response_text = response.text
-                    with Path(new_path).open("w") as f:
-                        f.write(response_text)
-                        print('Fetching')
-
-                        data_dict = parse_csv_to_dict(response_text)
-                        cache[ticker] = data_dict  # Save the parsed dictionary in cache
-                       
-                        print(f"Data for {ticker} fetched and cached now.")
-                        
-        with open("stock_prices.json", "w") as output_file:
-            json.dump(cache, output_file, indent=4)            
+    if end_date is None:
+        end_date = date.today().isoformat()
+    conn = open_price_store(store_path)
+    stored = coverage(conn)
+
+    # Group tickers by the first day they are missing
+    by_start = {}
+    for ticker in tickers:
+        last_date = stored.get(ticker, {}).get("last_date")
+        if last_date is None:
+            start_date = START_DATE
+        else:
+            start_date = (date.fromisoformat(last_date) + timedelta(days=1)).isoformat()
+        if start_date[:10] <= end_date[:10]:
+            by_start.setdefault(start_date, []).append(ticker)
+
+    batch_size = min(batch_size, credits_per_minute)
+    bucket = new_token_bucket(credits_per_minute)
+    with requests.Session() as session:
+        for start_date, stale in by_start.items():
+            for start in range(0, len(stale), batch_size):
+                batch = stale[start:start + batch_size]
+                wait_for_tokens(bucket, len(batch))
+                fetched = fetch_batch(batch, session, api_url, start_date, end_date)
+                for ticker, series in fetched.items():
+                    merged = merge_series(read_series(conn, ticker), series)
+                    write_series(conn, ticker, merged, checked_through=end_date[:10])
+                print(f"Refreshed {len(fetched)} of {len(batch)} tickers from {start_date}")
+
+    export_stock_prices(conn, output_file, tickers)
+    conn.close()
 
 
 def parse_csv_to_dict(csv_data):
-    "Parses the CSV to a Dictionary"
-    
-    # Use StringIO to treat the string as a file for the csv.reader
-    f = StringIO(csv_data)
-    reader = csv.DictReader(f, delimiter=";")
-    
-    # Create a dictionary where dates are the keys and only the close price is saved
-    data_dict = {}
-    for row in reader:
-        date = row["datetime"]
-        close_price = row["close"]
-        data_dict[date] = close_price
-    
-    print(f"Parsed dictionary: {data_dict}")  # Debug print to check the parsed data
-    return data_dict
+    "Parses the CSV to a Dictionary of {date: close}, newest day first"
+
+    series = csv_to_series(csv_data)
+    return {str(day): str(close) for day, close in
+            zip(series["datetime"][::-1], series["close"][::-1])}
 
 
 def count_companies():
@@ -1,10 +1,35 @@
+import argparse
 import json
+import os
+from functools import lru_cache
+from pathlib import Path
 
-with open('ESG_Scores.json', 'r') as file:
-    esg_data = json.load(file)
+ESG_DIR = Path(__file__).parent
+ESG_SCORES_PATH = ESG_DIR / "ESG_Scores.json"
+TICKERS_PATH = ESG_DIR.parent / "scrape" / "SA_sp500_tickers.json"
+ESG_ANALYSIS_PATH = ESG_DIR / "ESG_Analysis.json"
+# Company names and ESG scores as arrays, so one lookup does not parse the JSON files
+ESG_STORE_PATH = ESG_DIR / "esg_store.npz"
+
+# Columns of the "scores" array, NaN where a stock has no ESG data
+ESG_FIELDS = ("totalEsg", "environmentScore", "socialScore", "governanceScore")
+ANALYSIS_CACHE_SIZE = 256  # rendered analyses kept in memory
+
+ESG_ANALYSIS_TEMPLATE = """
+    A company's total ESG risk score reflects its overall exposure to environmental, social, and governance risks
+    and how well those risks are managed. A lower score indicates better management of ESG risks.
+    
+    For {company_name}, the total ESG risk score is {esg}, which is considered {rank}. 
+    Breaking it down by category:
+    - The 'Environmental' risk score is {e}, reflecting the company's environmental impact 
+        (carbon emissions, waste management, resource use)
+    - The 'Social' risk score is {s}, reflecting the company's social practices
+        (labor relations, community engagement, customer satisfaction)
+    - The 'Governance' risk score is {g}, reflecting the company's governance structure
+        (executive compensation, shareholder rights, business ethics)
+    """
+NO_DATA_TEMPLATE = "There is no ESG data available for {company_name}."
 
-with open('../scrape/SA_sp500_tickers.json', 'r') as file:
-    ticker_data = json.load(file)
 
 def risk_ranking(score):
     '''
@@ -18,44 +43,137 @@ def risk_ranking(score):
         return 'medium'
     else:
         return 'high'
-    
-def generate_esg_analysis(ticker, esg_data):
+
+
+def read_esg_artifacts(scores_path=ESG_SCORES_PATH, tickers_path=TICKERS_PATH):
+    """
+    Parses ESG_Scores.json and the scraped tickers into the arrays of the
+    ESG store: tickers (N,), company_names (N,) and scores (N, 4).
+    """
+    import numpy as np
+
+    with open(scores_path, "r") as file:
+        esg_data = json.load(file)
+    with open(tickers_path, "r") as file:
+        company_names = {ticker: info["company_name"] for ticker, info in json.load(file).items()}
+
+    tickers = list(esg_data)
+    scores = np.full((len(tickers), len(ESG_FIELDS)), np.nan)
+    for i, ticker in enumerate(tickers):
+        if isinstance(esg_data[ticker], dict):
+            for j, field in enumerate(ESG_FIELDS):
+                if esg_data[ticker].get(field) is not None:
+                    scores[i, j] = esg_data[ticker][field]
+    return {
+        "tickers": np.array(tickers),
+        "company_names": np.array([company_names[ticker] for ticker in tickers]),
+        "scores": scores,
+    }
+
+
+def build_esg_store(output_path=ESG_STORE_PATH, **artifact_paths):
+    "Compiles ESG_Scores.json and the company names into the binary ESG store"
+
+    import numpy as np
+
+    store = read_esg_artifacts(**artifact_paths)
+    temporary = Path(f"{output_path}.tmp.npz")
+    np.savez(temporary, **store)
+    os.replace(temporary, output_path)
+    print(f"Saved ESG store for {len(store['tickers'])} tickers to {output_path}")
+    return store
+
+
+@lru_cache(maxsize=None)
+def load_esg_store(path=ESG_STORE_PATH):
+    """
+    Loads the ESG store once, as a dictionary of its arrays plus "index",
+    {ticker: row}. Falls back to parsing the JSON files if the store was
+    never built.
+    """
+    import numpy as np
+
+    if not Path(path).exists():
+        store = read_esg_artifacts()
+    else:
+        with np.load(path, allow_pickle=False) as data:
+            store = {name: data[name] for name in data.files}
+    store["index"] = {str(ticker): i for i, ticker in enumerate(store["tickers"])}
+    return store
+
+
+def esg_lookup(ticker, path=ESG_STORE_PATH):
+    """
+    The ESG risk scores of a ticker as {field: float, NaN if missing}, or
+    None if the ticker has no ESG data. Raises KeyError for an unknown
+    ticker.
+    """
+    store = load_esg_store(path)
+    row = store["scores"][store["index"][ticker]]
+    if row[0] != row[0]:  # NaN total: no ESG data
+        return None
+    return dict(zip(ESG_FIELDS, row.tolist()))
+
+
+def score_text(value):
+    "A score as it reads in the analysis, with missing scores shown as in ESG_Scores.json"
+
+    return "None" if value != value else value
+
+
+@lru_cache(maxsize=ANALYSIS_CACHE_SIZE)
+def esg_analysis(ticker, path=ESG_STORE_PATH):
     '''
-    Function takes a S&P500 stock (ticker), finds its respective ESG Risk profile,
-    and returns an analysis of the score, providing definitions and context
-    around each value.
-    If no score is available (the case for some stocks), returns alternate message.
+    Renders the analysis of a S&P500 stock's (ticker) ESG Risk profile,
+    providing definitions and context around each value, from the ESG
+    store. If no score is available (the case for some stocks), returns
+    alternate message. Raises KeyError for an unknown ticker.
     '''
-    company_name = ticker_data[ticker]["company_name"]
-    if isinstance(esg_data[ticker], str):
-        return f"There is no ESG data available for {company_name}."
-
-    esg = esg_data[ticker]['totalEsg']
-    e = esg_data[ticker]['environmentScore']
-    s = esg_data[ticker]['socialScore']
-    g = esg_data[ticker]['governanceScore']
-    
-    rank = risk_ranking(esg)
+    store = load_esg_store(path)
+    company_name = str(store["company_names"][store["index"][ticker]])
+    scores = esg_lookup(ticker, path)
+    if scores is None:
+        return NO_DATA_TEMPLATE.format(company_name=company_name)
 
-    esg_analysis = f"""
-    A company's total ESG risk score reflects its overall exposure to environmental, social, and governance risks
-    and how well those risks are managed. A lower score indicates better management of ESG risks.
-    
-    For {company_name}, the total ESG risk score is {esg}, which is considered {rank}. 
-    Breaking it down by category:
-    - The 'Environmental' risk score is {e}, reflecting the company's environmental impact 
-        (carbon emissions, waste management, resource use)
-    - The 'Social' risk score is {s}, reflecting the company's social practices
-        (labor relations, community engagement, customer satisfaction)
-    - The 'Governance' risk score is {g}, reflecting the company's governance structure
-        (executive compensation, shareholder rights, business ethics)
+    esg, e, s, g = (scores[field] for field in ESG_FIELDS)
+    return ESG_ANALYSIS_TEMPLATE.format(company_name=company_name, esg=score_text(esg), rank=risk_ranking(esg),
+                                        e=score_text(e), s=score_text(s), g=score_text(g))
+
+
+def iter_esg_analyses(tickers=None, path=ESG_STORE_PATH):
+    "Yields (ticker, analysis) for every ticker of the ESG store (or of `tickers`), one at a time"
+
+    for ticker in tickers if tickers is not None else load_esg_store(path)["tickers"]:
+        yield str(ticker), esg_analysis(str(ticker), path)
+
+
+def write_esg_analysis(output_file=ESG_ANALYSIS_PATH, path=ESG_STORE_PATH):
+    """
+    Streams the analysis of every ticker's ESG scores to ESG_Analysis.json,
+    one entry at a time, and replaces the file in one step once complete.
+    The analyses are rendered straight to the file, not through the LRU.
+    Output: the number of tickers written
     """
-    return esg_analysis
+    temporary = Path(f"{output_file}.tmp")
+    count = 0
+    with open(temporary, "w") as file:
+        file.write("{")
+        for ticker in load_esg_store(path)["tickers"]:
+            # Same layout as json.dump(..., indent=2)
+            file.write(f'{"," if count else ""}\n  {json.dumps(str(ticker))}: '
+                       f'{json.dumps(esg_analysis.__wrapped__(str(ticker), path))}')
+            count += 1
+        file.write("\n}" if count else "}")
+    os.replace(temporary, output_file)
+    return count
 
-# Load the anlyses into a dictionary, dump to json file
-analysis_dict = {}
-for ticker, data in esg_data.items():
-    analysis_dict[ticker] = generate_esg_analysis(ticker, esg_data)
-with open("ESG_Analysis.json", "w") as file:
-    json.dump(analysis_dict, file, indent=2)
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the ESG store and export every ticker's ESG analysis")
+    parser.add_argument("--build-store", action="store_true",
+                        help="rebuild esg_store.npz from ESG_Scores.json and the scraped tickers first")
+    parser.add_argument("--output", default=ESG_ANALYSIS_PATH, help="where to export the analyses")
+    args = parser.parse_args()
+    if args.build_store:
+        build_esg_store()
+    print(f"Exported the ESG analysis of {write_esg_analysis(args.output)} tickers to {args.output}")
@@ -1,55 +1,190 @@
-import yfinance as yf # This is the Yahoo Finance API library (regular web-API unavailable to general public)
-from requests.exceptions import RequestException
-import pandas as pd
+import argparse
 import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 
-def esg_scores(ticker):
+ESG_DIR = Path(__file__).parent
+TICKERS_PATH = ESG_DIR.parent / "scrape" / "SA_sp500_tickers.json"
+ESG_SCORES_PATH = ESG_DIR / "ESG_Scores.json"
+# Every raw provider response, one {"ticker", "fetched_at", "raw" or "error"} per line
+ESG_CACHE_PATH = ESG_DIR / "esg_raw_cache.jsonl"
+
+ESG_FIELDS = ('totalEsg', 'environmentScore', 'socialScore', 'governanceScore')
+WORKERS = 8  # tickers queried at once
+RETRIES = 3
+BACKOFF = 1.0  # seconds before the first retry, doubled on every further attempt
+MAX_AGE = 30 * 24 * 3600  # Sustainalytics scores are updated monthly at most
+
+
+def new_session():
+    "One HTTP session shared by every worker thread, so connections are reused"
+
+    try:
+        # Recent yfinance versions only accept a curl_cffi session
+        from curl_cffi import requests as curl_requests
+        return curl_requests.Session(impersonate="chrome")
+    except ImportError:
+        import requests
+        return requests.Session()
+
+
+def yfinance_sustainability(ticker, session=None):
+    '''
+    Raw sustainability table {metric: value} of a ticker from the yfinance
+    (Yahoo Finance) API / Python library, None if Yahoo has no ESG data
+    for it. Yahoo Finance employs ESG risk scores from Sustainalytics (a
+    Morningstar company). Network and API errors are raised.
+    '''
+    import yfinance as yf # This is the Yahoo Finance API library (regular web-API unavailable to general public)
+
+    # yfinance method to get ESG data, returned in dataframe format
+    esg_data = yf.Ticker(ticker, session=session).sustainability
+    if esg_data is None or esg_data.empty:
+        return None
+    return json.loads(esg_data["esgScores"].to_json())
+
+
+def scores_from_raw(raw):
+    "Pulls only the four ESG risk scores out of a raw sustainability table, None if it has none"
+
+    if not raw:
+        return None
+    scores = {field: raw[field] for field in ESG_FIELDS if field in raw}
+    return scores or None
+
+
+def esg_scores(ticker, session=None):
     '''
     Function takes a ticker (stock symbol) and returns ESG Risk Score
     sourced from the yfinance (Yahoo Finance) API / Python library.
-    Yahoo Finance employs ESG risk scores from Sustainalytics (a 
+    Yahoo Finance employs ESG risk scores from Sustainalytics (a
     Morningstar company).
     '''
-    # yfinance method to get specific ticker data
-    stock = yf.Ticker(ticker)
     try:
-        # yfinance method to get ESG data
-        esg_data = stock.sustainability
-        if esg_data is None or esg_data.empty:
-            return None
-        else:
-            # yfinance returns results in dataframe format
-            esg_df = pd.DataFrame(esg_data)
-
-            # pull only these specific sustainability metrics
-            scores = esg_df.index.intersection([
-                'totalEsg',
-                'environmentScore',
-                'socialScore',
-                'governanceScore'])
-
-            if len(scores) == 0:
-                return None
-            
-            filtered_df = esg_df.loc[scores]
-            return filtered_df.to_dict()['esgScores']
-    
-    except RequestException as e:
-        return f"No ESG Data for {ticker}"
+        return scores_from_raw(yfinance_sustainability(ticker, session))
     except Exception as e:
         return f"No ESG Data for {ticker}"
 
-# Grab unique tickers from the S&P500
-with open('../scrape/SA_sp500_tickers.json', 'r') as file:
-    data = json.load(file)
-
-# Load S&P500 yfinance ESG results into dictionary, then dump to json
-esg_dict = {}
-for ticker, info in data.items():
-    result = esg_scores(ticker)
-    if result:
-        esg_dict[ticker] = result
-    else:
-        esg_dict[ticker] = f"No ESG data available for {ticker}."
-with open("ESG_Scores.json", "w") as file:
-    json.dump(esg_dict, file, indent=2)
\ No newline at end of file
+
+def fetch_with_retries(provider, ticker, session=None, retries=RETRIES, backoff=BACKOFF, sleep=time.sleep):
+    "Calls provider(ticker, session), retrying failures with jittered exponential backoff"
+
+    for attempt in range(retries):
+        try:
+            return provider(ticker, session)
+        except Exception:
+            if attempt == retries - 1:
+                raise
+            sleep(random.uniform(0, backoff * 2 ** attempt))
+
+
+def load_esg_cache(path=ESG_CACHE_PATH):
+    "The latest cached response of every ticker, skipping a line cut short by a crash"
+
+    cache = {}
+    if Path(path).exists():
+        with open(path, "r") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                cache[entry.pop("ticker")] = entry
+    return cache
+
+
+def esg_entry(ticker, raw):
+    "The ESG_Scores.json value of a ticker's raw response"
+
+    return scores_from_raw(raw) or f"No ESG data available for {ticker}."
+
+
+def write_esg_scores(esg_dict, output_file=ESG_SCORES_PATH):
+    "Rewrites ESG_Scores.json in one step, so readers never see a half-written file"
+
+    temporary = Path(f"{output_file}.tmp")
+    with open(temporary, "w") as file:
+        json.dump(esg_dict, file, indent=2)
+    os.replace(temporary, output_file)
+
+
+def collect_esg_scores(tickers, provider=yfinance_sustainability, cache_path=ESG_CACHE_PATH,
+                       output_file=ESG_SCORES_PATH, workers=WORKERS, retries=RETRIES, backoff=BACKOFF,
+                       max_age=MAX_AGE, session=None):
+    """
+    Queries the ESG scores of `tickers` on a pool of `workers` threads
+    sharing one session, through provider(ticker, session), which returns
+    the raw sustainability table, None for no data, or raises.
+    Every response is appended to the raw cache with its fetch time, and
+    ESG_Scores.json is rewritten as each ticker completes. Tickers with a
+    cached response younger than max_age seconds are not queried again, so
+    a rerun only retries the failures (max_age=0 refreshes everything).
+    A ticker that still fails keeps its previous ESG_Scores.json entry.
+    Output: ({ticker: scores or "No ESG data" message}, {failed ticker: error})
+    """
+    cache = load_esg_cache(cache_path)
+    previous = {}
+    if Path(output_file).exists():
+        with open(output_file, "r") as file:
+            previous = json.load(file)
+    now = time.time()
+    fresh = {ticker for ticker in tickers
+             if "raw" in cache.get(ticker, {}) and now - cache[ticker]["fetched_at"] <= max_age}
+    esg_dict = {ticker: esg_entry(ticker, cache[ticker]["raw"]) if ticker in fresh
+                else previous.get(ticker, f"No ESG data available for {ticker}.") for ticker in tickers}
+    todo = [ticker for ticker in tickers if ticker not in fresh]
+    failed = {}
+    if session is None and todo and provider is yfinance_sustainability:
+        session = new_session()
+
+    # Rewritten with the latest entry of every ticker, so the cache does not grow with every refresh
+    with open(cache_path, "w") as cache_file:
+        for ticker, entry in cache.items():
+            cache_file.write(json.dumps({"ticker": ticker, **entry}) + "\n")
+        with ThreadPoolExecutor(workers) as executor:
+            futures = {executor.submit(fetch_with_retries, provider, ticker, session, retries, backoff): ticker
+                       for ticker in todo}
+            for future in as_completed(futures):
+                ticker = futures[future]
+                try:
+                    raw = future.result()
+                    entry = {"fetched_at": time.time(), "raw": raw}
+                    esg_dict[ticker] = esg_entry(ticker, raw)
+                except Exception as error:
+                    failed[ticker] = f"{type(error).__name__}: {error}"
+                    entry = {"fetched_at": time.time(), "error": failed[ticker]}
+                cache_file.write(json.dumps({"ticker": ticker, **entry}) + "\n")
+                cache_file.flush()
+                write_esg_scores(esg_dict, output_file)
+    if not todo:
+        write_esg_scores(esg_dict, output_file)
+    return esg_dict, failed
+
+
+def scrape_esg_scores(tickers_path=TICKERS_PATH, output_file=ESG_SCORES_PATH, **collect_options):
+    "Collects the ESG scores of every S&P500 ticker and saves them to ESG_Scores.json"
+
+    # Grab unique tickers from the S&P500
+    with open(tickers_path, 'r') as file:
+        tickers = list(json.load(file))
+
+    start = time.perf_counter()
+    esg_dict, failed = collect_esg_scores(tickers, output_file=output_file, **collect_options)
+    print(f"Collected ESG scores of {len(tickers) - len(failed)} tickers in {time.perf_counter() - start:.0f}s, "
+          f"saved to {output_file}")
+    if failed:
+        print(f"{len(failed)} tickers failed and will be retried on the next run:", ", ".join(failed))
+    return esg_dict
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect the ESG risk scores of every S&P500 stock")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--max-age-days", type=float, default=MAX_AGE / 86400,
+                        help="requery tickers whose cached scores are older than this")
+    parser.add_argument("--refresh", action="store_true", help="requery every ticker")
+    args = parser.parse_args()
+    scrape_esg_scores(workers=args.workers, max_age=0 if args.refresh else args.max_age_days * 86400)
@@ -0,0 +1,103 @@
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+SCRAPE_DIR = Path(__file__).parent
+COMPANY_INFO_PATH = SCRAPE_DIR / "company_info.json"
+COMPANY_STORE_PATH = SCRAPE_DIR / "company_info.sqlite"
+
+# One row per company, looked up by ticker without reading the others
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS companies (
+    ticker TEXT PRIMARY KEY,
+    about_company TEXT NOT NULL,
+    fin_performance TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    industry TEXT,
+    sector TEXT
+) WITHOUT ROWID
+"""
+COLUMNS = ("ticker", "about_company", "fin_performance", "summary", "industry", "sector")
+
+
+def split_profile(about_company):
+    """
+    Splits a scraped company description into the description itself and
+    the industry and sector of its profile table (None when missing).
+    Output: (summary, industry, sector)
+    """
+    summary = about_company.split('[Read more]')[0] if '[Read more]' in about_company else about_company
+    industry = about_company.split('Industry ')[1].split(' Sector')[0].strip() if 'Industry ' in about_company else None
+    sector = about_company.split('Sector ')[1].split(' IPO')[0].strip() if 'Sector ' in about_company else None
+    return summary, industry, sector
+
+
+def company_row(ticker, info):
+    "The store row of one company_info.json entry"
+
+    about_company = info.get("about_company", "")
+    return (ticker, about_company, info.get("fin_performance", ""), *split_profile(about_company))
+
+
+def open_company_store(path=COMPANY_STORE_PATH):
+    "Opens (creating if needed) the SQLite company store"
+
+    conn = sqlite3.connect(path)
+    conn.execute(SCHEMA)
+    return conn
+
+
+def write_companies(conn, company_data):
+    'Inserts or replaces the companies of {ticker: {"about_company", "fin_performance"}}'
+
+    conn.executemany(f"INSERT OR REPLACE INTO companies VALUES ({', '.join('?' * len(COLUMNS))})",
+                     (company_row(ticker, info) for ticker, info in company_data.items()))
+    conn.commit()
+
+
+def build_company_store(info_path=COMPANY_INFO_PATH, store_path=COMPANY_STORE_PATH, company_data=None):
+    """
+    Compiles company_info.json (or the given company_data) into the company
+    store, replacing the old store in one step so readers never see it half
+    written.
+    """
+    if company_data is None:
+        with open(info_path, "r") as file:
+            company_data = json.load(file)
+    temporary = Path(f"{store_path}.tmp")
+    temporary.unlink(missing_ok=True)
+    conn = open_company_store(temporary)
+    try:
+        write_companies(conn, company_data)
+    finally:
+        conn.close()
+    os.replace(temporary, store_path)
+    return len(company_data)
+
+
+def lookup_company(conn, ticker):
+    "The stored row of one ticker as {ticker, about_company, fin_performance, summary, industry, sector}, or None"
+
+    row = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM companies WHERE ticker = ?", (ticker,)).fetchone()
+    return None if row is None else dict(zip(COLUMNS, row))
+
+
+def company_record(ticker, path=COMPANY_STORE_PATH, info_path=COMPANY_INFO_PATH):
+    """
+    Looks up one company by ticker, see lookup_company. Falls back to
+    reading company_info.json if the store was never built.
+    """
+    if not Path(path).exists():
+        with open(info_path, "r") as file:
+            info = json.load(file).get(ticker)
+        return None if info is None else dict(zip(COLUMNS, company_row(ticker, info)))
+    conn = sqlite3.connect(path)
+    try:
+        return lookup_company(conn, ticker)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    print(f"Saved {build_company_store()} companies to {COMPANY_STORE_PATH}")
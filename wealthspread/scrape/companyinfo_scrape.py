@@ -1,93 +1,257 @@
+import argparse
+import asyncio
 import httpx
+import importlib.util
 import lxml.html
 import json
-from time import sleep
+import random
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+from wealthspread.scrape.page_cache import (PAGE_CACHE_DIR, open_page_cache, conditional_headers, record_response,
+                                            decode_page, reparse_pages)
+from wealthspread.scrape.company_store import COMPANY_INFO_PATH, COMPANY_STORE_PATH, build_company_store, company_record
 
-def company_info():
+SCRAPE_DIR = Path(__file__).parent
+TICKERS_PATH = SCRAPE_DIR / "SA_sp500_tickers.json"
+# One parsed company per line, appended as each page arrives
+CHECKPOINT_PATH = SCRAPE_DIR / "company_info.partial.jsonl"
+
+CONCURRENCY = 8  # pages in flight at once
+REQUESTS_PER_SECOND = 5  # per host, so a full refresh of ~500 pages takes under 2 minutes
+RETRIES = 3
+BACKOFF = 1.0  # seconds before the first retry, doubled on every further attempt
+# Worth retrying: rate limited or a server-side error
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_company_page(html):
+    """
+    Extracts the company description and financial performance summary
+    from a StockAnalysis company page.
+    """
+    parsed_response = lxml.html.fromstring(html)
+
+    # Extract company description
+    about_elements = parsed_response.xpath('//*[@class="px-0.5 lg:px-0"]')
+    about_company = about_elements[0].text_content().strip() if about_elements else "Company description not available."
+
+    # Extract financial performance
+    fin_elements = parsed_response.xpath('//*[@class="mb-3"]')
+    fin_performance = fin_elements[0].text_content().strip() if fin_elements else "Financial performance data not available."
+
+    return {"about_company": about_company, "fin_performance": fin_performance}
+
+
+def new_rate_limiter(requests_per_second):
+    "Spaces the requests to one host evenly, at most requests_per_second of them"
+
+    return {"interval": 1 / requests_per_second, "next": 0.0}
+
+
+async def wait_for_slot(limiter):
+    "Waits for the limiter's next free slot and books it"
+
+    now = time.monotonic()
+    slot = max(now, limiter["next"])
+    limiter["next"] = slot + limiter["interval"]
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+
+def backoff_delay(attempt, backoff=BACKOFF):
+    "Exponential backoff with full jitter, so failed requests do not retry in lockstep"
+
+    return random.uniform(0, backoff * 2 ** attempt)
+
+
+async def fetch_page(client, url, limiters, requests_per_second=REQUESTS_PER_SECOND, retries=RETRIES,
+                     backoff=BACKOFF, headers=None):
+    """
+    GETs a page within its host's rate limit, retrying connection errors,
+    429s and 5xx responses with jittered exponential backoff. Other HTTP
+    errors are raised straight away, except 304 Not Modified, which is
+    returned for a conditional GET (see page_cache.py).
+    """
+    host = urlsplit(url).netloc
+    limiter = limiters.setdefault(host, new_rate_limiter(requests_per_second))
+    for attempt in range(retries):
+        await wait_for_slot(limiter)
+        try:
+            response = await client.get(url, headers=headers)
+            if response.status_code == 304:
+                return response
+            if response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+                return response
+            error = httpx.HTTPStatusError(f"{response.status_code} for {url}", request=response.request,
+                                          response=response)
+        except httpx.RequestError as request_error:
+            error = request_error
+        if attempt < retries - 1:
+            await asyncio.sleep(backoff_delay(attempt, backoff))
+    raise error
+
+
+def load_checkpoint(path=CHECKPOINT_PATH):
+    "The companies parsed by an earlier, unfinished run, skipping a line cut short by a crash"
+
+    company_data = {}
+    if Path(path).exists():
+        with open(path, "r") as file:
+            for line in file:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                company_data[row["ticker"]] = row["info"]
+    return company_data
+
+
+def new_client(concurrency=CONCURRENCY):
+    "A pooled keep-alive client, over HTTP/2 when the h2 package is installed"
+
+    return httpx.AsyncClient(timeout=httpx.Timeout(30), follow_redirects=True,
+                             http2=importlib.util.find_spec("h2") is not None,
+                             limits=httpx.Limits(max_connections=concurrency,
+                                                 max_keepalive_connections=concurrency))
+
+
+async def scrape_company_info(webpages, checkpoint_path=CHECKPOINT_PATH, concurrency=CONCURRENCY,
+                              requests_per_second=REQUESTS_PER_SECOND, retries=RETRIES, backoff=BACKOFF,
+                              page_cache_dir=PAGE_CACHE_DIR):
+    """
+    Scrapes {ticker: webpage} with at most `concurrency` pages in flight,
+    appending every parsed company to the checkpoint as it arrives.
+    Companies already in the checkpoint are not fetched again.
+    The raw pages are kept in the page cache (None to not keep them), and
+    pages already cached are only downloaded again if they changed.
+    Output: ({ticker: {"about_company", "fin_performance"}}, {skipped ticker: error})
+    """
+    company_data = load_checkpoint(checkpoint_path)
+    todo = [ticker for ticker in webpages if ticker not in company_data]
+    if company_data:
+        print(f"Resuming: {len(company_data)} companies already scraped, {len(todo)} to go")
+    skipped = {}
+    limiters = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    pages = open_page_cache(page_cache_dir) if page_cache_dir is not None else None
+
+    async with new_client(concurrency) as client:
+        # Rewritten with the rows read back, dropping any line cut short by a crash
+        with open(checkpoint_path, "w") as checkpoint:
+            for ticker, info in company_data.items():
+                checkpoint.write(json.dumps({"ticker": ticker, "info": info}) + "\n")
+            checkpoint.flush()
+
+            async def scrape(ticker):
+                async with semaphore:
+                    url = webpages[ticker]
+                    try:
+                        headers = conditional_headers(pages, url) if pages is not None else None
+                        response = await fetch_page(client, url, limiters, requests_per_second,
+                                                    retries, backoff, headers)
+                        if pages is not None:
+                            info = parse_company_page(decode_page(record_response(pages, page_cache_dir, url,
+                                                                                  response)))
+                        else:
+                            info = parse_company_page(response.text)
+                    except Exception as error:
+                        skipped[ticker] = str(error) or type(error).__name__
+                        print(f"Skipping {ticker} due to error: {skipped[ticker]}")
+                        return
+                company_data[ticker] = info
+                checkpoint.write(json.dumps({"ticker": ticker, "info": info}) + "\n")
+                checkpoint.flush()
+
+            try:
+                await asyncio.gather(*(scrape(ticker) for ticker in todo))
+            finally:
+                if pages is not None:
+                    pages.close()
+    return company_data, skipped
+
+
+def company_info(tickers_path=TICKERS_PATH, output_file_path=COMPANY_INFO_PATH, checkpoint_path=CHECKPOINT_PATH,
+                 resume=True, store_path=COMPANY_STORE_PATH, **scrape_options):
     """
     Fetches and extracts company information and financial performance
-    from StockAnalysis.
+    from StockAnalysis for every S&P500 ticker, and saves them to
+    company_info.json and the company store (see company_store.py).
+    Each company is checkpointed as soon as it is parsed, so a crashed or
+    interrupted run picks up where it stopped (resume=False starts over).
+    The checkpoint is removed once every company has been scraped.
 
-    Inputs    
+    Inputs
+            - tickers_path: the scraped S&P500 tickers (SA_sp500_tickers.json)
+            - output_file_path: where to save the company information
+            - store_path: where to save the company store
+            - scrape_options: concurrency, requests_per_second, retries, backoff
 
     Returns:
-            - about_company (str): A brief description of the company.
-            - fin_performance (str): The financial performance summary.
+            - {ticker: {"about_company": str, "fin_performance": str}}
                 """
+    with open(tickers_path, "r") as file:
+        webpages = {ticker: info["webpage"] for ticker, info in json.load(file).items()}
+    if not resume:
+        Path(checkpoint_path).unlink(missing_ok=True)
 
-# Initialize a dictionary to store the results
-company_data = {}
+    start = time.perf_counter()
+    company_data, skipped = asyncio.run(scrape_company_info(webpages, checkpoint_path, **scrape_options))
+    print(f"\nScraped {len(company_data)} companies in {time.perf_counter() - start:.0f}s")
 
-# Counter for skipped companies
-skipped_count = 0  
-skipped_companies = []  # List to store names of skipped companies
+    # Print the list of skipped companies
+    if skipped:
+        print(f"Total companies skipped due to errors: {len(skipped)}")
+        print("Skipped Companies:", ", ".join(skipped))
 
-# Create a client with an increased timeout globally
-client = httpx.Client(timeout=httpx.Timeout(30))  # Timeout set to 30 seconds
+    # Save the company data to a JSON file, in the order of the tickers file
+    company_data = {ticker: company_data[ticker] for ticker in webpages if ticker in company_data}
+    with open(output_file_path, "w") as output_file:
+        json.dump(company_data, output_file, indent=4)
+    build_company_store(store_path=store_path, company_data=company_data)
+    if not skipped:
+        Path(checkpoint_path).unlink(missing_ok=True)
 
-# Open the JSON file containing S&P 500 tickers
-with open("wealthspread/scrape/SA_sp500_tickers.json", "r") as file:
-    data = json.load(file)  # Load JSON data into a Python dictionary
+    print(f"Company information saved to '{output_file_path}' and '{store_path}'.")
+    return company_data
 
-    for company_name, info in data.items():
-        retries = 3  # Retry 3 times
-        for attempt in range(retries):
-            try:
-                # Fetch the webpage using the client with the longer timeout
-                response = client.get(info['webpage'])  # No timeout argument needed now
-                response.raise_for_status()  # Check if request was successful
-
-                # Parse the HTML response
-                parsed_response = lxml.html.fromstring(response.text)
-
-                # Extract company description
-                about_elements = parsed_response.xpath('//*[@class="px-0.5 lg:px-0"]')
-                about_company = about_elements[0].text_content().strip() if about_elements else "Company description not available."
-
-                # Extract financial performance
-                fin_elements = parsed_response.xpath('//*[@class="mb-3"]')
-                fin_performance = fin_elements[0].text_content().strip() if fin_elements else "Financial performance data not available."
-
-                # Add the data to the dictionary with the company ticker as the key
-                company_data[company_name] = {
-                    "about_company": about_company,
-                    "fin_performance": fin_performance
-                }
-
-                # Break the retry loop if successful
-                break  
-
-            except (httpx.RequestError, IndexError, Exception) as e:
-                if attempt < retries - 1:
-                    print(f"Attempt {attempt+1} failed for {company_name}. Retrying...")
-                    sleep(2)  # Wait for 2 seconds before retrying
-                else:
-                    skipped_count += 1
-                    skipped_companies.append(company_name)  # Store the skipped company name
-                    print(f"Skipping {company_name} due to error: {e}")
-                    break
-
-# Print the total number of skipped companies
-print(f"\nTotal companies skipped due to errors: {skipped_count}")
-
-# Print the list of skipped companies
-if skipped_companies:
-    print("Skipped Companies:", ", ".join(skipped_companies))
-
-# Save the company data to a JSON file
-with open("wealthspread/scrape/company_info.json", "w") as output_file:
-    json.dump(company_data, output_file, indent=4)
-
-print("Company information saved to 'company_info.json'.")
-
-def retreive_company_info(company_name):
-    "To retreive already scraped company information"
-    
-    with open('wealthspread/scrape/company_info.json', 'r') as f:
-        data = json.load(f)
-        for ticker, info in data.items():
-          #  print(ticker, info)
-            if ticker == company_name:
-                return data[company_name]['about_company'], data[company_name]['fin_performance'] 
-       
-        
+
+def reparse_company_info(tickers_path=TICKERS_PATH, output_file_path=COMPANY_INFO_PATH,
+                         page_cache_dir=PAGE_CACHE_DIR, workers=None, store_path=COMPANY_STORE_PATH):
+    """
+    Rebuilds company_info.json and the company store from the cached company pages, without any
+    network access, e.g. after changing parse_company_page. Companies whose
+    page was never cached are left out.
+    """
+    with open(tickers_path, "r") as file:
+        webpages = {ticker: info["webpage"] for ticker, info in json.load(file).items()}
+    parsed = reparse_pages(parse_company_page, list(webpages.values()), page_cache_dir, workers)
+    company_data = {ticker: parsed[url] for ticker, url in webpages.items() if url in parsed}
+    with open(output_file_path, "w") as output_file:
+        json.dump(company_data, output_file, indent=4)
+    build_company_store(store_path=store_path, company_data=company_data)
+    print(f"Re-parsed {len(company_data)} cached company pages into '{output_file_path}', "
+          f"{len(webpages) - len(company_data)} not cached")
+    return company_data
+
+
+def retreive_company_info(company_name, path=COMPANY_INFO_PATH, store_path=COMPANY_STORE_PATH):
+    "To retreive already scraped company information, looked up by ticker in the company store"
+
+    record = company_record(company_name, store_path, path)
+    if record is not None:
+        return record['about_company'], record['fin_performance']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape the company information of every S&P500 stock")
+    parser.add_argument("--reparse", action="store_true",
+                        help="rebuild company_info.json from the cached pages, without any network access")
+    parser.add_argument("--workers", type=int, default=None, help="re-parse processes (default: one per CPU)")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of an unfinished run")
+    args = parser.parse_args()
+    if args.reparse:
+        reparse_company_info(workers=args.workers)
+    else:
+        company_info(resume=not args.restart)
@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+PAGE_CACHE_DIR = Path(__file__).parent / "page_cache"
+INDEX_NAME = "index.sqlite"
+
+
+def open_page_cache(cache_dir=PAGE_CACHE_DIR):
+    """
+    Opens the raw page cache: gzipped response bodies stored once per
+    content hash under objects/, and an index of the latest body of every
+    URL with its fetch time and HTTP validators.
+    """
+    cache_dir = Path(cache_dir)
+    (cache_dir / "objects").mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(cache_dir / INDEX_NAME)
+    conn.execute("""CREATE TABLE IF NOT EXISTS pages (
+                        url TEXT PRIMARY KEY,
+                        sha256 TEXT NOT NULL,
+                        etag TEXT,
+                        last_modified TEXT,
+                        fetched_at REAL NOT NULL,
+                        checked_at REAL NOT NULL)""")
+    return conn
+
+
+def blob_path(cache_dir, sha256):
+    "Where the body with this content hash is stored"
+
+    return Path(cache_dir) / "objects" / sha256[:2] / f"{sha256}.html.gz"
+
+
+def store_page(conn, cache_dir, url, body, etag=None, last_modified=None):
+    """
+    Stores a fetched body (bytes) as the latest version of `url`. Identical
+    bodies, of the same or different URLs, are only stored once.
+    Output: the body's SHA-256
+    """
+    sha256 = hashlib.sha256(body).hexdigest()
+    path = blob_path(cache_dir, sha256)
+    if not path.exists():
+        path.parent.mkdir(exist_ok=True)
+        temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temporary.write_bytes(gzip.compress(body, mtime=0))
+        os.replace(temporary, path)
+    now = time.time()
+    conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                 (url, sha256, etag, last_modified, now, now))
+    conn.commit()
+    return sha256
+
+
+def page_entry(conn, url):
+    "The index entry {url, sha256, etag, last_modified, fetched_at, checked_at} of a URL, or None"
+
+    row = conn.execute("SELECT * FROM pages WHERE url = ?", (url,)).fetchone()
+    if row is None:
+        return None
+    return dict(zip(("url", "sha256", "etag", "last_modified", "fetched_at", "checked_at"), row))
+
+
+def read_page(cache_dir, sha256):
+    "The stored body with this content hash, as bytes"
+
+    return gzip.decompress(blob_path(cache_dir, sha256).read_bytes())
+
+
+def conditional_headers(conn, url):
+    "If-None-Match/If-Modified-Since headers revalidating the cached copy of a URL, if any"
+
+    entry = page_entry(conn, url)
+    headers = {}
+    if entry is not None:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def record_response(conn, cache_dir, url, response):
+    """
+    Records the response to a (conditional) GET of `url`: a 304 Not
+    Modified only updates when the cached copy was last checked, anything
+    else is stored with its validators.
+    Output: the page body, as bytes
+    """
+    if response.status_code == 304:
+        entry = page_entry(conn, url)
+        if entry is None:
+            raise ValueError(f"{url} answered 304 Not Modified but is not in the page cache")
+        conn.execute("UPDATE pages SET checked_at = ? WHERE url = ?", (time.time(), url))
+        conn.commit()
+        return read_page(cache_dir, entry["sha256"])
+    store_page(conn, cache_dir, url, response.content, response.headers.get("etag"),
+               response.headers.get("last-modified"))
+    return response.content
+
+
+def decode_page(body):
+    "Page bytes to text; StockAnalysis serves UTF-8"
+
+    return body.decode("utf-8", errors="replace")
+
+
+def parse_cached_page(parser, path):
+    "Runs parser on the text of one stored page (in a re-parse worker)"
+
+    return parser(decode_page(gzip.decompress(Path(path).read_bytes())))
+
+
+def reparse_pages(parser, urls=None, cache_dir=PAGE_CACHE_DIR, workers=None, chunksize=16):
+    """
+    Runs parser(html) over the cached copy of every URL of `urls` (default:
+    every cached URL) without any network access, on a pool of `workers`
+    processes (default: one per CPU). parser must be a module-level
+    function so it can be sent to the workers.
+    Output: {url: parser's result}, for the URLs that are cached
+    """
+    conn = open_page_cache(cache_dir)
+    try:
+        if urls is None:
+            entries = conn.execute("SELECT url, sha256 FROM pages ORDER BY url").fetchall()
+        else:
+            entries = [(url, entry["sha256"]) for url in urls if (entry := page_entry(conn, url)) is not None]
+    finally:
+        conn.close()
+    paths = [blob_path(cache_dir, sha256) for _, sha256 in entries]
+    work = partial(parse_cached_page, parser)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) <= 1:
+        results = list(map(work, paths))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(work, paths, chunksize=chunksize))
+    return {url: result for (url, _), result in zip(entries, results)}
@@ -1,17 +1,24 @@
+import argparse
 import time
 import httpx
 import json
 import lxml.html
+from pathlib import Path
+from wealthspread.scrape.page_cache import (PAGE_CACHE_DIR, open_page_cache, page_entry, conditional_headers,
+                                            record_response, read_page, decode_page)
 
 ALLOWED_DOMAINS = ("https://stockanalysis.com/",)
 REQUEST_DELAY = 0.1
+SP500_TICKERS_PATH = Path(__file__).parent / "SA_sp500_tickers.json"
+SP500_URL = "https://stockanalysis.com/list/sp-500-stocks/"
 
 
-def make_request(url):
+def make_request(url, headers=None):
     """
     Make a request to `url` and return the raw response.
     This function ensure that the domain matches what is expected
-    and that the rate limit is obeyed.
+    and that the rate limit is obeyed. A 304 Not Modified answer to a
+    conditional request is returned rather than raised.
     """
     # check if URL starts with an allowed domain name
     for domain in ALLOWED_DOMAINS:
@@ -24,11 +31,46 @@ def make_request(url):
         raise ValueError(f"can not fetch {url}, must be in {ALLOWED_DOMAINS}")
     time.sleep(REQUEST_DELAY)
     print(f"Fetching {url}")
-    resp = httpx.get(url)
-    resp.raise_for_status()
+    resp = httpx.get(url, headers=headers)
+    if resp.status_code != 304:
+        resp.raise_for_status()
     return resp
+
+
+def fetch_cached_html(url, page_cache_dir=PAGE_CACHE_DIR):
+    """
+    Fetches `url` with a conditional GET against its copy in the page
+    cache, storing the page if it changed, and returns the page's HTML.
+    """
+    conn = open_page_cache(page_cache_dir)
+    try:
+        resp = make_request(url, conditional_headers(conn, url))
+        return decode_page(record_response(conn, page_cache_dir, url, resp))
+    finally:
+        conn.close()
+
+
+def parse_sp500_page(html):
+    "Extracts the nested ticker dictionary described in scrape_sp500_page from the page's HTML"
+
+    sp500_dict = {}
+    root = lxml.html.fromstring(html)
+
+    rows = root.xpath("//table[@id='main-table']//tr")
+
+    for row in rows[1:]:
+        ticker = row.xpath("./td[2]/a")[0].text.strip()
+        
+        sp500_dict[ticker] = {
+            "company_name": row.xpath("./td[3]/text()")[0].strip(),
+            "market_cap": row.xpath("./td[4]/text()")[0].strip(),
+            "stock_price": row.xpath("./td[5]/text()")[0].strip(),
+            "pct_change": row.xpath("./td[6]/text()")[0].strip(),
+            "revenue": row.xpath("./td[7]/text()")[0].strip(),
+            "webpage": "https://stockanalysis.com" + row.xpath("./td[2]/a")[0].get('href').strip()}
+    return sp500_dict
     
-def scrape_sp500_page(url):
+def scrape_sp500_page(url, filename=SP500_TICKERS_PATH, page_cache_dir=PAGE_CACHE_DIR, offline=False):
     """
     This function takes a URL to a S&P500 webpage and returns a
     nested dictionary with the unique symbol (ticker), url to the stock's detailed page, 
@@ -36,6 +78,9 @@ def scrape_sp500_page(url):
 
     Parameters:
         * url:  a URL to a page with a list of the S&P500 securities
+        * filename: where to save the tickers (SA_sp500_tickers.json)
+        * page_cache_dir: where the raw page is kept (see page_cache.py)
+        * offline: re-parse the cached page instead of fetching it
 
     Returns:
         A nested dictionary with the following keys:
@@ -47,30 +92,29 @@ def scrape_sp500_page(url):
                 * revenue:          company's posted revenue
                 * webpage:          url snippet to the stock's detail page
     """
-    sp500_dict = {}
-    
-    resp = make_request(url)
-    root = lxml.html.fromstring(resp.text)
-
-    rows = root.xpath("//table[@id='main-table']//tr")
-
-    for row in rows[1:]:
-        ticker = row.xpath("./td[2]/a")[0].text.strip()
-        
-        sp500_dict[ticker] = {
-            "company_name": row.xpath("./td[3]/text()")[0].strip(),
-            "market_cap": row.xpath("./td[4]/text()")[0].strip(),
-            "stock_price": row.xpath("./td[5]/text()")[0].strip(),
-            "pct_change": row.xpath("./td[6]/text()")[0].strip(),
-            "revenue": row.xpath("./td[7]/text()")[0].strip(),
-            "webpage": "https://stockanalysis.com" + row.xpath("./td[2]/a")[0].get('href').strip()}
+    if offline:
+        conn = open_page_cache(page_cache_dir)
+        entry = page_entry(conn, url)
+        conn.close()
+        if entry is None:
+            raise ValueError(f"{url} is not in the page cache, scrape it once without offline=True")
+        html = decode_page(read_page(page_cache_dir, entry["sha256"]))
+    else:
+        html = fetch_cached_html(url, page_cache_dir)
+    sp500_dict = parse_sp500_page(html)
 
     print(f"Scraped {len(sp500_dict)} tickers")
 
-    filename = "SA_sp500_tickers.json"
     with open(filename, "w") as file:
         json.dump(sp500_dict, file, indent=2)
 
     print(f"Saved {len(sp500_dict)} tickers to {filename}")
+    return sp500_dict
+
 
-scrape_sp500_page("https://stockanalysis.com/list/sp-500-stocks/")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape the list of S&P500 stocks")
+    parser.add_argument("--reparse", action="store_true",
+                        help="rebuild SA_sp500_tickers.json from the cached page, without any network access")
+    args = parser.parse_args()
+    scrape_sp500_page(SP500_URL, offline=args.reparse)
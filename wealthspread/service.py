@@ -0,0 +1,266 @@
+"""
+Wealth Spread suggestion service: a long-running local HTTP server that
+keeps the market data in memory between requests.
+
+    uv run python -m wealthspread.service [--port 8765] [--workers 2]
+
+Endpoints (JSON in and out):
+    POST /suggest   {"holdings": {ticker: amount}, "investment_amount": x}
+    GET  /esg/<ticker>
+    POST /reload    reloads the data after a nightly rebuild (as does SIGHUP)
+    GET  /health    also reports the result cache's hit/miss counters
+
+Suggestions are cached on the portfolio's normalized weights (see
+correlation/result_cache.py), so repeat portfolios skip the workers.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from wealthspread.correlation.market_store import load_market_store, ESG_FIELDS
+from wealthspread.correlation.batch import save_shared_data, init_worker, score_portfolio
+from wealthspread.correlation.result_cache import (CACHE_SIZE, CACHE_TTL, data_version, portfolio_key, open_cache,
+                                                   close_cache, cache_get, cache_put, cache_stats)
+
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_BODY_BYTES = 1 << 20
+
+
+def init_service_worker(directory):
+    "Scoring worker initializer: maps the market data and leaves SIGHUP to the server"
+
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    init_worker(directory)
+
+
+def load_service_data(workers=None, lookback=None, backend="dense"):
+    """
+    Loads everything the service answers from: the market data, written
+    once for the scoring workers to memory-map, a pool of scoring workers
+    and the ESG scores of every ticker, versioned by the data files.
+    """
+    version = data_version(lookback, backend)
+    directory = tempfile.mkdtemp(prefix="wealthspread_service_")
+    try:
+        save_shared_data(directory, lookback, backend)
+        store = load_market_store()
+        esg = {str(ticker): {field: None if math.isnan(score) else float(score)
+                             for field, score in zip(ESG_FIELDS, scores)}
+               for ticker, scores in zip(store["tickers"], store["esg"])}
+        executor = ProcessPoolExecutor(workers or os.cpu_count() or 1,
+                                       initializer=init_service_worker, initargs=(directory,))
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    return {
+        "directory": directory,
+        "executor": executor,
+        "esg": esg,
+        "version": version,
+        "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def close_service_data(data):
+    "Shuts down a data generation's workers once their requests finish, then removes its files"
+
+    data["executor"].shutdown(wait=True)
+    shutil.rmtree(data["directory"], ignore_errors=True)
+
+
+async def reload_data(service):
+    """
+    Loads a fresh copy of the data off the event loop, then swaps it in with
+    one assignment. Requests already running keep the generation they
+    started with; the old one is closed once they are done.
+    """
+    loop = asyncio.get_running_loop()
+    async with service["reload_lock"]:
+        new = await loop.run_in_executor(None, load_service_data, *service["load_args"])
+        old, service["data"] = service["data"], new
+        service["generation"] += 1
+    loop.run_in_executor(None, close_service_data, old)
+    return {"reloaded": True, "generation": service["generation"], "loaded_at": new["loaded_at"]}
+
+
+async def reload_on_signal(service):
+    "SIGHUP reload: reports a failed reload and keeps serving the data already loaded"
+
+    try:
+        reloaded = await reload_data(service)
+    except Exception as error:
+        print(f"Reload failed, still serving generation {service['generation']}: {error!r}", file=sys.stderr)
+        return None
+    print(f"Reloaded the data, now serving generation {reloaded['generation']}")
+    return reloaded
+
+
+def parse_amount(amount, name):
+    "Validates an amount of a /suggest request as a finite positive number, raising ValueError otherwise"
+
+    if isinstance(amount, bool) or not isinstance(amount, (int, float, str)):
+        raise ValueError(f"{name} must be a number")
+    amount = float(amount)
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError(f"{name} must be a finite positive number")
+    return amount
+
+
+def parse_holdings(holdings):
+    """
+    Validates the holdings of a /suggest request, {ticker: amount} with at
+    least one ticker and finite positive amounts. Raises ValueError otherwise.
+    Output: {TICKER: float amount}
+    """
+    if not isinstance(holdings, dict) or not holdings:
+        raise ValueError("holdings must be a non-empty object of {ticker: amount}")
+    return {ticker.upper(): parse_amount(amount, f"Amount of {ticker}") for ticker, amount in holdings.items()}
+
+
+async def suggest(service, body):
+    "Scores one portfolio on the worker pool, unless the same weights were scored before"
+
+    data = service["data"]
+    request = json.loads(body or b"{}")
+    if not isinstance(request, dict):
+        raise ValueError("Request body must be a JSON object")
+    holdings = parse_holdings(request.get("holdings"))
+    investment_amount = parse_amount(request.get("investment_amount"), "investment_amount")
+    max_esg = None if request.get("max_esg") is None else float(request["max_esg"])
+    exclude_missing_esg = bool(request.get("exclude_missing_esg", False))
+    start = time.perf_counter()
+    key = portfolio_key(holdings, investment_amount, data["version"], *service["load_args"][1:],
+                        max_esg=max_esg, exclude_missing_esg=exclude_missing_esg)
+    row = cache_get(service["cache"], key)
+    if row is None:
+        row = await asyncio.get_running_loop().run_in_executor(
+            data["executor"], score_portfolio, (None, holdings, investment_amount), max_esg, exclude_missing_esg)
+        del row["id"]
+        if "error" not in row:
+            cache_put(service["cache"], key, row)
+    else:
+        row = {**row, "seconds": round(time.perf_counter() - start, 6)}
+    return (400 if "error" in row else 200), {"id": request.get("id"), **row}
+
+
+async def route(service, method, path, body):
+    "Dispatches one request, returning (status, JSON-able response)"
+
+    if method == "POST" and path == "/suggest":
+        return await suggest(service, body)
+    if method == "GET" and path.startswith("/esg/"):
+        ticker = path[len("/esg/"):].upper()
+        scores = service["data"]["esg"].get(ticker)
+        if scores is None:
+            return 404, {"error": f"Unknown ticker {ticker}"}
+        return 200, {"ticker": ticker, **scores}
+    if method == "POST" and path == "/reload":
+        return 200, await reload_data(service)
+    if method == "GET" and path == "/health":
+        return 200, {"status": "ok", "generation": service["generation"],
+                     "loaded_at": service["data"]["loaded_at"], "cache": cache_stats(service["cache"])}
+    return 404, {"error": f"No route for {method} {path}"}
+
+
+async def handle_connection(service, reader, writer):
+    "Serves HTTP/1.1 requests on one connection, keeping it alive between requests"
+
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_BYTES:
+                status, response = 413, {"error": "Request body too large"}
+                body = b""
+            else:
+                body = await reader.readexactly(length) if length else b""
+                try:
+                    status, response = await route(service, method, path.split("?")[0], body)
+                except (ValueError, KeyError, TypeError) as error:
+                    status, response = 400, {"error": f"Bad request: {error}"}
+                except Exception as error:
+                    # Still answer, so a broken pool or cache fails the request rather than the connection
+                    print(f"Error serving {method} {path}: {error!r}", file=sys.stderr)
+                    status, response = 500, {"error": f"Internal error: {type(error).__name__}: {error}"}
+
+            payload = json.dumps(response).encode()
+            keep_alive = headers.get("connection", "").lower() != "close"
+            writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                         f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                         f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + payload)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_service(port=PORT, workers=None, lookback=None, backend="dense", cache=None):
+    """
+    Loads the data and starts listening on localhost only. `cache` is the
+    result cache (see result_cache.open_cache), in memory only by default.
+    Output: (asyncio server, service state)
+    """
+    load_args = (workers, lookback, backend)
+    loop = asyncio.get_running_loop()
+    service = {
+        "data": await loop.run_in_executor(None, load_service_data, *load_args),
+        "load_args": load_args,
+        "generation": 1,
+        "reload_lock": asyncio.Lock(),
+        "cache": cache if cache is not None else open_cache(),
+    }
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(service, reader, writer), HOST, port)
+    return server, service
+
+
+async def serve(port=PORT, workers=None, lookback=None, backend="dense", cache=None):
+    "Runs the service until SIGINT or SIGTERM, reloading the data on SIGHUP"
+
+    server, service = await start_service(port, workers, lookback, backend, cache)
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    if hasattr(signal, "SIGHUP"):
+        loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(reload_on_signal(service)))
+    print(f"Wealth Spread service listening on http://{HOST}:{server.sockets[0].getsockname()[1]}")
+    async with server:
+        await stop.wait()
+    close_service_data(service["data"])
+    close_cache(service["cache"])
+    print("Wealth Spread service stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wealth Spread local suggestion service")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=None, help="scoring processes (default: one per CPU)")
+    parser.add_argument("--lookback", choices=["3m", "1y", "5y"], default=None)
+    parser.add_argument("--backend", choices=["dense", "factor"], default="dense")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE, help="suggestions kept in memory")
+    parser.add_argument("--cache-ttl", type=float, default=CACHE_TTL, help="seconds a cached suggestion is kept")
+    parser.add_argument("--cache-file", default=None, help="SQLite file keeping cached suggestions across restarts")
+    args = parser.parse_args()
+    cache = open_cache(args.cache_size, args.cache_ttl, args.cache_file)
+    asyncio.run(serve(args.port, args.workers, args.lookback, args.backend, cache))
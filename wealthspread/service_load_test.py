@@ -0,0 +1,90 @@
+"""
+Load test for the suggestion service: runs concurrent keep-alive clients
+against a running service and reports the latency percentiles.
+
+    uv run python -m wealthspread.service_load_test --clients 16 --requests 2000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import numpy as np
+from wealthspread.correlation.tickers import all_stocks
+from wealthspread.service import HOST, PORT
+
+
+async def http_request(reader, writer, method, path, payload=None):
+    "Sends one request on an open keep-alive connection, returns (status, JSON response)"
+
+    body = b"" if payload is None else json.dumps(payload).encode()
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: {HOST}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return status, json.loads(await reader.readexactly(int(headers["content-length"])))
+
+
+def random_portfolio(tickers, rng):
+    "A random portfolio of 1-8 holdings"
+
+    holdings = {ticker: rng.randint(1, 50) * 100 for ticker in rng.sample(tickers, rng.randint(1, 8))}
+    return {"holdings": holdings, "investment_amount": rng.randint(1, 20) * 100}
+
+
+async def client(port, requests, tickers, latencies, seed, esg_share):
+    "One client sending `requests` requests back to back on one connection"
+
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(HOST, port)
+    try:
+        for _ in range(requests):
+            start = time.perf_counter()
+            if rng.random() < esg_share:
+                status, _ = await http_request(reader, writer, "GET", f"/esg/{rng.choice(tickers)}")
+            else:
+                status, _ = await http_request(reader, writer, "POST", "/suggest", random_portfolio(tickers, rng))
+            latencies.append((time.perf_counter() - start, status))
+    finally:
+        writer.close()
+
+
+async def run_load_test(port=PORT, clients=16, requests=2000, esg_share=0.2, tickers=None):
+    """
+    Spreads `requests` requests over `clients` concurrent connections and
+    returns {"requests", "errors", "seconds", "throughput", "p50_ms", "p99_ms"}.
+    """
+    if tickers is None:
+        tickers = list(all_stocks())
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, requests // clients + (i < requests % clients), tickers,
+                                  latencies, i, esg_share)
+                           for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    seconds = np.array([latency for latency, _ in latencies])
+    return {
+        "requests": len(latencies),
+        "errors": sum(status != 200 for _, status in latencies),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(seconds, 50)) * 1000, 2),
+        "p99_ms": round(float(np.percentile(seconds, 99)) * 1000, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the Wealth Spread suggestion service")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--esg-share", type=float, default=0.2, help="share of requests that are ESG lookups")
+    args = parser.parse_args()
+    report = asyncio.run(run_load_test(args.port, args.clients, args.requests, args.esg_share))
+    print(f"{report['requests']} requests ({report['errors']} errors) in {report['seconds']}s, "
+          f"{report['throughput']} req/s, p50 {report['p50_ms']} ms, p99 {report['p99_ms']} ms")
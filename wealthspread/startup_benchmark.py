@@ -0,0 +1,48 @@
+"""
+Startup benchmark: times fresh-interpreter imports of the CLI and the
+analysis modules, and how long the CLI takes to show its menu and exit.
+
+    uv run python -m wealthspread.startup_benchmark --runs 10
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+import numpy as np
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+MODULES = ["wealthspread_cli", "wealthspread.correlation.portfolio", "wealthspread.correlation.simulation"]
+
+
+def time_command(args, runs, stdin=None):
+    "Median wall-clock seconds of running `args` in a fresh interpreter `runs` times"
+
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, input=stdin, cwd=PROJECT_ROOT, capture_output=True, text=True, check=True)
+        seconds.append(time.perf_counter() - start)
+    return float(np.median(seconds))
+
+
+def run_startup_benchmark(runs=10):
+    """
+    Returns {label: median seconds} for the bare interpreter, the import of
+    every module of MODULES and the CLI's time to menu (start, show the
+    menu, choose Exit).
+    """
+    report = {"python": time_command([sys.executable, "-c", "pass"], runs)}
+    for module in MODULES:
+        report[f"import {module}"] = time_command([sys.executable, "-c", f"import {module}"], runs)
+    report["time to menu"] = time_command([sys.executable, "wealthspread_cli.py"], runs, stdin="3\n")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time Wealth Spread's startup")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    for label, seconds in run_startup_benchmark(args.runs).items():
+        print(f"{label:<50} {seconds * 1000:8.1f} ms")
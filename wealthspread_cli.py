@@ -5,13 +5,13 @@ Wealth Spread: Interactive CLI for Intelligent Portfolio Diversification
 
 import os
 import sys
-import json
+import argparse
 from pathlib import Path
 import random
-from wealthspread.correlation.twelvedata_api import tickers_list_creator
+from wealthspread.correlation.tickers import all_stocks
 
-
-ALL_STOCKS = tickers_list_creator()
+# The analysis modules (numpy, the market data) are imported when first
+# needed, so the menu comes up without loading them
 
 # Get project root and set up paths
 project_root = Path(__file__).parent.absolute()
@@ -20,16 +20,6 @@ project_root = Path(__file__).parent.absolute()
 correlation_path = project_root / "wealthspread" / "correlation"
 sys.path.insert(0, str(correlation_path))
 
-# Import the portfolio module directly
-import wealthspread.correlation.portfolio
-
-
-# Define file paths
-ESG_SCORES_PATH = project_root / "wealthspread" / "esg" / "ESG_Scores.json"
-COMPANY_INFO_PATH = project_root / "wealthspread" / "scrape" / "company_info.json"
-
-# Common tickers for better UX
-SAMPLE_TICKERS = ALL_STOCKS
 
 def clear_screen():
     """Clear the terminal screen"""
@@ -50,12 +40,6 @@ def print_header():
    """)
     print("=" * 90 + "\n")
 
-def load_json_file(filepath):
-    """Load a JSON file and return the data"""
-    with open(filepath, 'r') as f:
-        return json.load(f)
-
-
 def input_with_validation(prompt, validator=None, error_message=None):
     """Get user input with validation"""
     while True:
@@ -74,15 +58,15 @@ def is_valid_amount(amount_str):
 
 def ticker_validator(ticker):
     "Validates if the tickers is from the S&P 500"
-    return ticker.upper() in ALL_STOCKS
+    return ticker.upper() in all_stocks()
 
 def get_current_portfolio():
     """Interactively get the user's current portfolio"""
     print("\n=== CURRENT PORTFOLIO ===")
-    print("Let's start by creating your current portfolio (2-5 stocks).\n")
+    print("Let's start by creating your current portfolio (1-5 stocks).\n")
     
     portfolio = {}
-    min_stocks = 2
+    min_stocks = 1
     max_stocks = 5
     
     # Get number of stocks
@@ -95,7 +79,7 @@ def get_current_portfolio():
     
     # Show some sample tickers
     print("\nSample tickers for reference:")
-    sample_display = ", ".join(random.sample(ALL_STOCKS, 15))
+    sample_display = ", ".join(random.sample(all_stocks(), 15))
     print(f"  {sample_display}, ...")
     
     # Get each stock ticker and amount
@@ -150,26 +134,40 @@ def analyze_portfolio():
                 print("\nAnalyzing portfolio... (this may take a moment)")
                 
                 try:
-                    # Call the suggest_stocks_sharpe function from portfolio module
-                    result = wealthspread.correlation.portfolio.suggest_stocks_sharpe(user_portfolio, investment_amount)
-                    with open(COMPANY_INFO_PATH, 'r') as file:
-                          data = json.load(file)
+                    from wealthspread.correlation.result_cache import (RESULT_CACHE_PATH, open_cache, close_cache,
+                                                                       cached_suggest_stocks_sharpe)
+                    # Call suggest_stocks_sharpe through the result cache, which remembers
+                    # earlier portfolios with the same weights across runs
+                    cache = open_cache(path=RESULT_CACHE_PATH)
+                    try:
+                        result = cached_suggest_stocks_sharpe(cache, user_portfolio, investment_amount)
+                    finally:
+                        close_cache(cache)
+                    from wealthspread.scrape.company_store import company_record
+                    from wealthspread.esg.esg_analysis import score_text
 
                     # Preview results in an appealing way
                     print("\n=== ANALYSIS RESULTS ===")
                     print("\n" + "="*50)
                     print("📈 Portfolio Diversification Suggestion 📈")
                     print("="*50)
-                    print(f"\n🎯 **Recommended Stock to Add:** {result[0]}")
+                    # A single-stock portfolio gets a pair of suggestions
+                    suggested = result[0] if isinstance(result[0], tuple) else (result[0],)
+                    print(f"\n🎯 **Recommended Stock to Add:** {', '.join(suggested)}")
                     print(f"\n🚀 **Optimized Sharpe Ratio:** {result[1]}")
                     print(f"🔗 **Average Portfolio Correlation:** {result[2]}")
-                    print(f"\n🌿 **Current ESG Score:** {result[3]}")
-                    print(f"🌱 **New ESG Score (after addition):** {result[4]}")                    
+                    print(f"\n🌿 **Current ESG Score:** {score_text(result[3])}")
+                    print(f"🌱 **New ESG Score (after addition):** {score_text(result[4])}")                    
                     print("\n✨ Happy Investing! ✨")
-                    print("\n--- Company Information ---")
-                    print(f"\n**About Company:**\n{data[result[0]]['about_company']}")
-                    print("\n--- Financial Performance ---")
-                    print(f"\n**Financials:**\n{data[result[0]]['fin_performance']}")
+                    for ticker in suggested:
+                        info = company_record(ticker)
+                        print(f"\n--- Company Information: {ticker} ---")
+                        if info is None:
+                            print(f"\nNo company information available for {ticker}.")
+                            continue
+                        print(f"\n**About Company:**\n{info['about_company']}")
+                        print("\n--- Financial Performance ---")
+                        print(f"\n**Financials:**\n{info['fin_performance']}")
                     print("="*50 + "\n")
                     
                 except Exception as e:
@@ -195,7 +193,7 @@ def get_esg_info():
     
     # Show sample tickers
     print("Sample tickers for reference:")
-    sample_display = ", ".join(random.sample(ALL_STOCKS, 15))
+    sample_display = ", ".join(random.sample(all_stocks(), 15))
     print(f"  {sample_display}, ...")
     
     ticker = input_with_validation(
@@ -206,33 +204,28 @@ def get_esg_info():
     
     try:
         # Load ESG data and company info
-        esg_scores = load_json_file(ESG_SCORES_PATH)
-        company_info = load_json_file(COMPANY_INFO_PATH)
+        from wealthspread.esg.esg_analysis import load_esg_store, esg_lookup, score_text
+        from wealthspread.scrape.company_store import company_record
+        esg_index = load_esg_store()["index"]
+        info = company_record(ticker)
         
         # Display company information
         print(f"\n=== COMPANY AND ESG INFORMATION FOR {ticker} ===\n")
         
         # Company information
-        if ticker in company_info:
-            info = company_info[ticker]
+        if info is not None:
             print("COMPANY INFORMATION:")
+            print(f"- About: {info['summary']}")
             
-            # Extract about company data
-            about_text = info.get('about_company', '')
-            about_summary = about_text.split('[Read more]')[0] if '[Read more]' in about_text else about_text
-            print(f"- About: {about_summary}")
-            
-            # Look for industry and sector info
-            if 'Industry ' in about_text:
-                industry = about_text.split('Industry ')[1].split(' Sector')[0].strip()
-                print(f"- Industry: {industry}")
+            # Industry and sector are extracted from the profile when the store is built
+            if info['industry'] is not None:
+                print(f"- Industry: {info['industry']}")
                 
-            if 'Sector ' in about_text:
-                sector = about_text.split('Sector ')[1].split(' IPO')[0].strip()
-                print(f"- Sector: {sector}")
+            if info['sector'] is not None:
+                print(f"- Sector: {info['sector']}")
                 
             # Extract financial performance
-            fin_performance = info.get('fin_performance', '')
+            fin_performance = info['fin_performance']
             if fin_performance:
                 print(f"- Financial Performance: {fin_performance}")
         else:
@@ -241,32 +234,27 @@ def get_esg_info():
         # ESG information
         print("\nESG INFORMATION:")
         
-        if ticker in esg_scores:
-            esg = esg_scores[ticker]
+        if ticker in esg_index:
+            scores = esg_lookup(ticker)
             
-            # Check if ESG data is a dictionary
-            if isinstance(esg, dict):
-                total_esg = esg.get('totalEsg', 'N/A')
-                env_score = esg.get('environmentScore', 'N/A')
-                social_score = esg.get('socialScore', 'N/A')
-                gov_score = esg.get('governanceScore', 'N/A')
-                
-                print(f"- Total ESG Score: {total_esg}")
-                print(f"- Environmental Score: {env_score}")
-                print(f"- Social Score: {social_score}")
-                print(f"- Governance Score: {gov_score}")
+            # Stocks without ESG data have no scores
+            if scores is not None:
+                total_esg = scores['totalEsg']
+                print(f"- Total ESG Score: {score_text(total_esg)}")
+                print(f"- Environmental Score: {score_text(scores['environmentScore'])}")
+                print(f"- Social Score: {score_text(scores['socialScore'])}")
+                print(f"- Governance Score: {score_text(scores['governanceScore'])}")
                 
                 # Determine risk level
-                if isinstance(total_esg, (int, float)):
-                    if total_esg <= 15:
-                        risk_level = "Low risk (excellent)"
-                    elif total_esg <= 25:
-                        risk_level = "Medium risk (average)"
-                    else:
-                        risk_level = "High risk (concerning)"
-                    print(f"- Risk Level: {risk_level}")
+                if total_esg <= 15:
+                    risk_level = "Low risk (excellent)"
+                elif total_esg <= 25:
+                    risk_level = "Medium risk (average)"
+                else:
+                    risk_level = "High risk (concerning)"
+                print(f"- Risk Level: {risk_level}")
             else:
-                print(f"ESG data for {ticker} is not in the expected format.")
+                print(f"No ESG data available for {ticker}.")
         else:
             print(f"No ESG information available for {ticker}.")
     
@@ -291,8 +279,42 @@ def show_main_menu():
     
     return int(choice)
 
-def main():
+def run_batch_command(args):
+    """Score a file of portfolios without any prompts"""
+    from wealthspread.correlation.batch import run_batch
+    run_batch(args.input, args.output, workers=args.workers, lookback=args.lookback, backend=args.backend,
+              max_esg=args.max_esg, exclude_missing_esg=args.exclude_missing_esg)
+
+
+def parse_args(argv=None):
+    """Parse the command line; no subcommand starts the interactive menu"""
+    parser = argparse.ArgumentParser(description="Wealth Spread: Intelligent Portfolio Diversification")
+    subcommands = parser.add_subparsers(dest="command")
+    batch = subcommands.add_parser(
+        "batch", help="Score many portfolios from a file",
+        description="Score every portfolio of a .jsonl or .csv file and write the suggestions "
+                    "to a .jsonl or .csv file, one row per portfolio with its scoring time.")
+    batch.add_argument("input", help="portfolios: .jsonl lines of {id, holdings: {ticker: amount}, "
+                                     "investment_amount} or .csv rows of id,ticker,amount,investment_amount")
+    batch.add_argument("output", help="results file, .jsonl or .csv")
+    batch.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    batch.add_argument("--lookback", choices=["3m", "1y", "5y"], default=None,
+                       help="score against a precomputed correlation snapshot")
+    batch.add_argument("--backend", choices=["dense", "factor"], default="dense",
+                       help="correlation backend (default: dense)")
+    batch.add_argument("--max-esg", type=float, default=None,
+                       help="only suggest stocks keeping the portfolio's ESG risk score at or below this")
+    batch.add_argument("--exclude-missing-esg", action="store_true",
+                       help="never suggest stocks without ESG data")
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Main entry point for the interactive CLI"""
+    args = parse_args(argv)
+    if args.command == "batch":
+        run_batch_command(args)
+        return
+
     try:
         while True:
             choice = show_main_menu()